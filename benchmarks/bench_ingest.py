@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк загрузки альбомов целиком: ZipProcessor.process_zip_fast на синтетических
+архивах против локального Postgres (как воркер очереди, но без очереди).
+
+Форма архивов задается параметрами: число альбомов (по архиву на альбом), артикулов
+в альбоме, изображений в артикуле, смесь форматов JPEG/PNG/TIFF и сжатие (stored или
+deflated). Каждое изображение уникально (шум со своим зерном), так что хранилище
+блобов не схлопывает файлы.
+
+Для каждого архива измеряется время стадий по обратным вызовам прогресса:
+    analyze  - открытие архива, имя альбома, валидация, план и сравнение с БД
+    extract  - распаковка в хранилище блобов и ссылки в дереве альбома
+    insert   - транзакция записи строк files
+    finalize - очистка блобов без ссылок и завершение
+Итог - файлы в секунду, занятость процессов пула распаковки, пиковый RSS процесса и
+процессов пула и записанные байты (ru_oublock), в JSON.
+
+БД берется из переменных POSTGRES_* (как у приложения) и должна быть создана по init.sql.
+Альбомы бенчмарка (префикс --album-prefix) после прогона удаляются из БД.
+
+Пример:
+    POSTGRES_HOST=localhost python benchmarks/bench_ingest.py --albums 2 --articles 50 --images 20
+    POSTGRES_HOST=localhost python benchmarks/bench_ingest.py --mix jpeg=1 --stored --merge
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source'))
+
+from PIL import Image  # noqa: E402
+
+FORMATS = {
+    'jpeg': ('.jpg', 'JPEG', {'quality': 90}),
+    'png': ('.png', 'PNG', {}),
+    'tiff': ('.tiff', 'TIFF', {}),
+}
+
+
+def parse_mix(value):
+    """'jpeg=6,png=3,tiff=1' -> [('jpeg', 6), ('png', 3), ('tiff', 1)]"""
+    mix = []
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip().lower()
+        if name not in FORMATS:
+            raise argparse.ArgumentTypeError(f"Unknown format: {name}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def render_image(rng, fmt, width, height):
+    """Изображение с градиентом и шумом: сжимается примерно как фотография"""
+    noise = Image.frombytes('L', (width, height), rng.randbytes(width * height))
+    base = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (base, noise, Image.blend(base, noise, 0.5)))
+    _, pil_format, options = FORMATS[fmt]
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def generate_archives(work_dir, args):
+    """Создает по архиву <prefix><n>/<артикул>/<файл> на альбом; возвращает [(путь, альбом, файлов)]"""
+    rng = random.Random(args.seed)
+    names, weights = zip(*args.mix)
+    compression = zipfile.ZIP_STORED if args.stored else zipfile.ZIP_DEFLATED
+    archives = []
+    for album_index in range(args.albums):
+        album = f"{args.album_prefix}{album_index:03d}"
+        path = os.path.join(work_dir, f"{album}.zip")
+        files = 0
+        with zipfile.ZipFile(path, 'w', compression=compression) as archive:
+            for article_index in range(args.articles):
+                for image_index in range(args.images):
+                    fmt = rng.choices(names, weights)[0]
+                    data = render_image(rng, fmt, args.width, args.height)
+                    archive.writestr(f"{album}/article_{article_index:04d}/image_{image_index:04d}{FORMATS[fmt][0]}",
+                                     data)
+                    files += 1
+        archives.append((path, album, files))
+    return archives
+
+
+def io_counters():
+    """Блоки вывода (по 512 байт) процесса и дождавшихся процессов пула"""
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_oublock
+            + resource.getrusage(resource.RUSAGE_CHILDREN).ru_oublock)
+
+
+def ingest(processor, zip_path, album, merge):
+    """Один process_zip_fast с временем стадий по обратным вызовам прогресса"""
+    marks = {}
+    counters = {}
+
+    def on_progress(stage, **values):
+        marks.setdefault(stage, time.perf_counter())
+        counters.update(values)
+
+    from prometheus_client import REGISTRY
+    utilization_sample = ('ingest_worker_utilization_ratio_sum', {'format': 'zip'})
+    utilization_before = REGISTRY.get_sample_value(*utilization_sample) or 0.0
+
+    blocks_before = io_counters()
+    start = time.perf_counter()
+    success, result = processor.process_zip_fast(zip_path, f"{album}.zip", on_progress, merge)
+    end = time.perf_counter()
+    if not success:
+        raise RuntimeError(f"Ingest of {album} failed: {result}")
+
+    extracting = marks.get('extracting', end)
+    inserting = marks.get('inserting', end)
+    inserted = marks.get('inserted', end)
+    stages = {
+        'analyze': extracting - start,
+        'extract': inserting - extracting,
+        'insert': inserted - inserting,
+        'finalize': end - inserted
+    }
+    wall = end - start
+    files = counters.get('files_total', 0)
+    # Наблюдение гистограммы появляется, только если распаковка шла в пуле процессов
+    utilization = (REGISTRY.get_sample_value(*utilization_sample) or 0.0) - utilization_before
+    return {
+        'album': album,
+        'mode': 'merge' if merge else 'replace',
+        'files': files,
+        'files_written': counters.get('files_inserted', 0),
+        'files_unchanged': counters.get('files_unchanged', 0),
+        'wall_seconds': round(wall, 4),
+        'files_per_sec': round(files / wall, 1) if wall else None,
+        'stages_seconds': {name: round(value, 4) for name, value in stages.items()},
+        'worker_utilization': round(utilization, 3) if utilization else None,
+        'bytes_written': (io_counters() - blocks_before) * 512
+    }
+
+
+def cleanup(albums):
+    from database import db_manager
+    db_manager.execute_query("DELETE FROM files WHERE album_name = ANY(%s)", (albums,), commit=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark album ingestion against Postgres')
+    parser.add_argument('--albums', type=int, default=1)
+    parser.add_argument('--articles', type=int, default=20, help='Articles per album')
+    parser.add_argument('--images', type=int, default=10, help='Images per article')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('jpeg=6,png=3,tiff=1'),
+                        help='Format weights, e.g. jpeg=6,png=3,tiff=1')
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--stored', action='store_true', help='Archives without compression')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='ZipProcessor max_workers')
+    parser.add_argument('--merge', action='store_true', help='Ingest every archive again in merge mode')
+    parser.add_argument('--album-prefix', default='bench_ingest_')
+    parser.add_argument('--upload-folder', help='Where albums are written (default: temporary directory)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', action='store_true', help='Keep benchmark albums in the database')
+    args = parser.parse_args()
+
+    from zip_processor import ZipProcessor
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        upload_folder = args.upload_folder or os.path.join(work_dir, 'images')
+        os.makedirs(upload_folder, exist_ok=True)
+
+        generate_start = time.perf_counter()
+        archives = generate_archives(work_dir, args)
+        generate_seconds = time.perf_counter() - generate_start
+
+        processor = ZipProcessor(upload_folder, 'http://bench', os.path.join(work_dir, 'thumbnails'),
+                                 max_workers=args.workers)
+        albums = [album for _, album, _ in archives]
+        runs = []
+        try:
+            for zip_path, album, _ in archives:
+                runs.append(ingest(processor, zip_path, album, merge=False))
+            if args.merge:
+                for zip_path, album, _ in archives:
+                    runs.append(ingest(processor, zip_path, album, merge=True))
+        finally:
+            if not args.keep:
+                cleanup(albums)
+                processor.blob_store.sweep()
+                if not args.upload_folder:
+                    shutil.rmtree(upload_folder, ignore_errors=True)
+
+        archive_bytes = sum(os.path.getsize(path) for path, _, _ in archives)
+
+    totals = {}
+    for mode in ('replace', 'merge'):
+        mode_runs = [run for run in runs if run['mode'] == mode]
+        if not mode_runs:
+            continue
+        wall = sum(run['wall_seconds'] for run in mode_runs)
+        files = sum(run['files'] for run in mode_runs)
+        totals[mode] = {
+            'files': files,
+            'wall_seconds': round(wall, 4),
+            'files_per_sec': round(files / wall, 1) if wall else None,
+            'stages_seconds': {stage: round(sum(run['stages_seconds'][stage] for run in mode_runs), 4)
+                               for stage in mode_runs[0]['stages_seconds']},
+            'bytes_written': sum(run['bytes_written'] for run in mode_runs)
+        }
+
+    print(json.dumps({
+        'cpu_count': os.cpu_count(),
+        'config': {
+            'albums': args.albums, 'articles': args.articles, 'images': args.images,
+            'mix': dict(args.mix), 'width': args.width, 'height': args.height,
+            'compression': 'stored' if args.stored else 'deflated', 'workers': args.workers
+        },
+        'archive_bytes': archive_bytes,
+        'generate_seconds': round(generate_seconds, 2),
+        'runs': runs,
+        'totals': totals,
+        # ru_maxrss в Linux измеряется в килобайтах
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'peak_rss_children_bytes': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
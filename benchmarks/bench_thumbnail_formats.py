@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк форматов превью: время кодирования и размер файла JPEG, WebP и AVIF
+с параметрами из THUMBNAIL_FORMATS для каждого размера превью.
+
+Оригинал декодируется и уменьшается один раз, замеряется только кодирование.
+Экономия считается относительно JPEG того же размера.
+
+Пример:
+    python benchmarks/bench_thumbnail_formats.py photos/*.jpg
+    python benchmarks/bench_thumbnail_formats.py --generate 5 --formats jpeg,webp
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source'))
+
+from PIL import Image, features  # noqa: E402
+
+from bench_thumbnails import generate_images, parse_sizes  # noqa: E402
+from thumbnail_manager import THUMBNAIL_FORMATS  # noqa: E402
+
+
+def encode(image, name):
+    """Кодирует изображение в формат превью, возвращает (секунды, байты)"""
+    pillow_format, _, _, options = THUMBNAIL_FORMATS[name]
+    buffer = io.BytesIO()
+    start = time.perf_counter()
+    image.save(buffer, pillow_format, **options)
+    return time.perf_counter() - start, buffer.tell()
+
+
+def run(paths, sizes, formats, repeat):
+    """Собирает время кодирования и размеры по каждому (размер, формат)"""
+    samples = {(size, name): {'seconds': [], 'bytes': []} for size in sizes for name in formats}
+
+    for path in paths:
+        with Image.open(path) as img:
+            frame = img.convert('RGB')
+        for size in sorted(sizes, key=lambda s: s[0] * s[1], reverse=True):
+            frame.thumbnail(size, Image.Resampling.LANCZOS)
+            for name in formats:
+                for _ in range(repeat):
+                    seconds, size_bytes = encode(frame, name)
+                    samples[(size, name)]['seconds'].append(seconds)
+                samples[(size, name)]['bytes'].append(size_bytes)
+
+    results = []
+    for size in sizes:
+        jpeg_bytes = sum(samples[(size, 'jpeg')]['bytes']) if 'jpeg' in formats else None
+        jpeg_seconds = sum(samples[(size, 'jpeg')]['seconds']) if 'jpeg' in formats else None
+        for name in formats:
+            seconds = samples[(size, name)]['seconds']
+            total_bytes = sum(samples[(size, name)]['bytes'])
+            results.append({
+                'size': f"{size[0]}x{size[1]}",
+                'format': name,
+                'mean_encode_ms': round(sum(seconds) / len(seconds) * 1000, 2),
+                'mean_bytes': round(total_bytes / len(paths)),
+                'bytes_saved_vs_jpeg_pct': round((1 - total_bytes / jpeg_bytes) * 100, 1) if jpeg_bytes else None,
+                'encode_time_vs_jpeg': round(sum(seconds) / jpeg_seconds, 2) if jpeg_seconds else None
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark thumbnail output formats')
+    parser.add_argument('images', nargs='*', help='Image files to use')
+    parser.add_argument('--sizes', default='96x96,600x600', type=parse_sizes)
+    parser.add_argument('--formats', default=','.join(THUMBNAIL_FORMATS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--generate', type=int, default=0, help='Generate N synthetic images')
+    parser.add_argument('--width', type=int, default=3000)
+    parser.add_argument('--height', type=int, default=2000)
+    args = parser.parse_args()
+
+    formats = []
+    skipped = []
+    for name in args.formats.split(','):
+        if name in THUMBNAIL_FORMATS and (name == 'jpeg' or features.check(name)):
+            formats.append(name)
+        else:
+            skipped.append(name)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = list(args.images)
+        if args.generate or not paths:
+            paths += generate_images(args.generate or 3, args.width, args.height, tmp_dir)
+        results = run(paths, args.sizes, formats, args.repeat)
+
+    print(json.dumps({
+        'images': len(paths),
+        'formats': formats,
+        'unsupported_formats': skipped,
+        'results': results
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк генерации превью: прежний путь (открытие и декодирование оригинала
+на каждый размер) против движка create_thumbnails (одно декодирование с
+DCT-масштабированием JPEG и каскадом размеров).
+
+Каждый режим запускается в отдельном процессе, чтобы пиковый RSS не смешивался.
+
+Пример:
+    python benchmarks/bench_thumbnails.py photos/*.jpg
+    python benchmarks/bench_thumbnails.py --generate 5 --width 6000 --height 4000
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source'))
+
+from PIL import Image  # noqa: E402
+
+DEFAULT_SIZES = [(96, 96), (600, 600)]
+
+
+def legacy_create_thumbnail(original_path, size, quality=85):
+    """Прежняя реализация create_thumbnail из app.py"""
+    with Image.open(original_path) as img:
+        if img.mode in ('RGBA', 'P'):
+            img = img.convert('RGB')
+
+        img.thumbnail(size, Image.Resampling.LANCZOS)
+
+        buffer = io.BytesIO()
+        img.save(buffer, 'JPEG', quality=quality, optimize=True)
+        buffer.seek(0)
+        return buffer
+
+
+def peak_rss_bytes():
+    """Пиковый RSS текущего процесса (VmHWM; ru_maxrss наследуется через exec)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss в Linux измеряется в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_mode(mode, paths, sizes, repeat):
+    """Выполняет один режим в текущем процессе и возвращает результаты"""
+    from thumbnail_manager import create_thumbnails
+
+    timings = []
+    for _ in range(repeat):
+        for path in paths:
+            start = time.perf_counter()
+            if mode == 'legacy':
+                for size in sizes:
+                    legacy_create_thumbnail(path, size)
+            else:
+                create_thumbnails(path, sizes)
+            timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    peak_rss = peak_rss_bytes()
+    return {
+        'mode': mode,
+        'images': len(timings),
+        'total_seconds': round(sum(timings), 4),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 2),
+        'p50_ms': round(timings[len(timings) // 2] * 1000, 2),
+        'max_ms': round(timings[-1] * 1000, 2),
+        'peak_rss_bytes': peak_rss
+    }
+
+
+def generate_images(count, width, height, directory):
+    """Создает синтетические JPEG, похожие по размеру на снимки с камеры"""
+    paths = []
+    for i in range(count):
+        noise = Image.effect_noise((width, height), 64 + i).convert('L')
+        gradient = Image.linear_gradient('L').resize((width, height))
+        img = Image.merge('RGB', (noise, gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+        path = os.path.join(directory, f"synthetic_{i}.jpg")
+        img.save(path, 'JPEG', quality=92)
+        paths.append(path)
+    return paths
+
+
+def parse_sizes(value):
+    return [tuple(int(x) for x in part.split('x')) for part in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark thumbnail generation')
+    parser.add_argument('images', nargs='*', help='JPEG files to use')
+    parser.add_argument('--sizes', default='96x96,600x600', type=parse_sizes)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--generate', type=int, default=0, help='Generate N synthetic images')
+    parser.add_argument('--width', type=int, default=6000)
+    parser.add_argument('--height', type=int, default=4000)
+    parser.add_argument('--mode', choices=['legacy', 'engine'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.images, args.sizes, args.repeat)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = list(args.images)
+        if args.generate or not paths:
+            paths += generate_images(args.generate or 3, args.width, args.height, tmp_dir)
+
+        results = []
+        for mode in ('legacy', 'engine'):
+            cmd = [sys.executable, os.path.abspath(__file__), '--mode', mode,
+                   '--sizes', ','.join(f"{w}x{h}" for w, h in args.sizes),
+                   '--repeat', str(args.repeat)] + paths
+            output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    legacy, engine = results
+    print(json.dumps({
+        'sizes': [f"{w}x{h}" for w, h in args.sizes],
+        'results': results,
+        'speedup': round(legacy['total_seconds'] / engine['total_seconds'], 2) if engine['total_seconds'] else None,
+        'peak_rss_ratio': round(engine['peak_rss_bytes'] / legacy['peak_rss_bytes'], 2) if legacy['peak_rss_bytes'] else None
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк распаковки ZIP: прежний путь (потоки с общим ZipFile, extract в папку
+альбома и перенос в папку артикула) против пула процессов ZipProcessor, где каждый
+процесс открывает архив сам, берет свой срез записей по смещению и пишет файлы
+сразу в итоговый путь. Результат - файлы в секунду для каждого max_workers.
+
+--stored создает несжатый архив: такие записи ZipProcessor копирует через
+copy_file_range/sendfile.
+
+Архив создается синтетически (сжимаемые данные, как у PNG/TIFF) или берется готовый.
+
+Пример:
+    python benchmarks/bench_zip_extract.py --files 2000 --workers 1,2,4,8
+    python benchmarks/bench_zip_extract.py --archive album.zip --workers 8
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source'))
+
+from zip_processor import ZipProcessor  # noqa: E402
+
+
+def generate_archive(path, files, file_size, articles=50, compression=zipfile.ZIP_DEFLATED):
+    """Создает архив album/<артикул>/<файл>.jpg с частично сжимаемым содержимым"""
+    rng = random.Random(42)
+    pattern = bytes(range(256)) * (file_size // 512 + 1)
+    with zipfile.ZipFile(path, 'w', compression=compression) as archive:
+        for i in range(files):
+            data = rng.randbytes(file_size // 2) + pattern[:file_size - file_size // 2]
+            archive.writestr(f"bench_album/article_{i % articles:04d}/image_{i:06d}.jpg", data)
+    return path
+
+
+def legacy_extract(zip_path, album_path, max_workers):
+    """Прежняя распаковка: батчи в потоках с одним общим ZipFile"""
+    extracted = 0
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        entries = [info for info in zip_ref.infolist() if not info.is_dir()]
+        batch_size = min(200, max(50, len(entries) // (max_workers * 2)))
+        batches = [entries[i:i + batch_size] for i in range(0, len(entries), batch_size)]
+
+        def extract_batch(batch):
+            for info in batch:
+                zip_ref.extract(info.filename, album_path)
+                # Перенос в <альбом>/<артикул>/<файл>, как в прежнем _process_single_file_fast
+                parts = info.filename.split('/')
+                article_dir = os.path.join(album_path, parts[-2])
+                os.makedirs(article_dir, exist_ok=True)
+                shutil.move(os.path.join(album_path, info.filename), os.path.join(article_dir, parts[-1]))
+            return len(batch)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for future in as_completed([executor.submit(extract_batch, batch) for batch in batches]):
+                try:
+                    extracted += future.result()
+                except Exception:
+                    # Общий дескриптор при параллельном чтении иногда дает ошибки
+                    pass
+    return extracted
+
+
+def engine_extract(zip_path, max_workers, upload_folder):
+    """Распаковка пулом процессов ZipProcessor"""
+    processor = ZipProcessor(upload_folder, 'http://bench', os.path.join(upload_folder, '.thumbnails'),
+                             max_workers=max_workers)
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        image_files = processor._get_image_files(zip_ref)
+    plan = processor._plan_extraction(image_files, 'bench_album')
+    return len(processor._process_files_parallel_batch(zip_path, plan, 'bench_album'))
+
+
+def measure(mode, zip_path, max_workers, repeat, work_dir):
+    timings = []
+    extracted = 0
+    for _ in range(repeat):
+        upload_folder = os.path.join(work_dir, 'images')
+        album_path = os.path.join(upload_folder, 'bench_album')
+        shutil.rmtree(upload_folder, ignore_errors=True)
+        os.makedirs(album_path)
+
+        start = time.perf_counter()
+        if mode == 'legacy':
+            extracted = legacy_extract(zip_path, album_path, max_workers)
+        else:
+            extracted = engine_extract(zip_path, max_workers, upload_folder)
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    return {
+        'mode': mode,
+        'max_workers': max_workers,
+        'files': extracted,
+        'best_seconds': round(best, 4),
+        'files_per_sec': round(extracted / best, 1) if best else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ZIP extraction')
+    parser.add_argument('--archive', help='Existing ZIP to extract (album/article/file layout)')
+    parser.add_argument('--files', type=int, default=2000, help='Files in the synthetic archive')
+    parser.add_argument('--file-size', type=int, default=256 * 1024, help='Bytes per synthetic file')
+    parser.add_argument('--stored', action='store_true', help='Synthetic archive without compression')
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--modes', default='legacy,engine')
+    args = parser.parse_args()
+
+    workers = [int(w) for w in args.workers.split(',')]
+    modes = args.modes.split(',')
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        zip_path = args.archive
+        if not zip_path:
+            zip_path = generate_archive(os.path.join(work_dir, 'bench.zip'), args.files, args.file_size,
+                                        compression=zipfile.ZIP_STORED if args.stored else zipfile.ZIP_DEFLATED)
+
+        results = [measure(mode, zip_path, max_workers, args.repeat, work_dir)
+                   for max_workers in workers for mode in modes]
+        archive_bytes = os.path.getsize(zip_path)
+
+    baseline = {r['max_workers']: r for r in results if r['mode'] == 'legacy'}
+    for result in results:
+        legacy = baseline.get(result['max_workers'])
+        if result['mode'] == 'engine' and legacy and legacy['files_per_sec']:
+            result['speedup_vs_legacy'] = round(result['files_per_sec'] / legacy['files_per_sec'], 2)
+
+    print(json.dumps({
+        'cpu_count': os.cpu_count(),
+        'archive_bytes': archive_bytes,
+        'results': results
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
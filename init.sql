@@ -10,9 +10,34 @@ CREATE TABLE IF NOT EXISTS files (
     album_name TEXT NOT NULL,
     article_number TEXT NOT NULL,
     public_link TEXT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    placeholder TEXT,
+    crc32 BIGINT,
+    file_size BIGINT,
+    blob_sha256 TEXT,
+    width INTEGER,
+    height INTEGER,
+    image_format TEXT,
+    file_mtime TIMESTAMP
 );
 
+-- Плейсхолдер превью (сетка 4x4 средних цветов, base64) для баз, созданных до его появления
+ALTER TABLE files ADD COLUMN IF NOT EXISTS placeholder TEXT;
+
+-- CRC32 и размер из архива для инкрементальной повторной загрузки альбома
+ALTER TABLE files ADD COLUMN IF NOT EXISTS crc32 BIGINT;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS file_size BIGINT;
+
+-- Хэш содержимого оригинала в хранилище блобов (images/.blobs)
+ALTER TABLE files ADD COLUMN IF NOT EXISTS blob_sha256 TEXT;
+
+-- Сведения об изображении из заголовка, записываемые при загрузке: списки файлов не обращаются к диску.
+-- В строках, созданных раньше, их дописывает синхронизация (/api/sync)
+ALTER TABLE files ADD COLUMN IF NOT EXISTS width INTEGER;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS height INTEGER;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS image_format TEXT;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS file_mtime TIMESTAMP;
+
 -- ОСНОВНЫЕ ИНДЕКСЫ
 CREATE INDEX IF NOT EXISTS idx_files_album_name ON files(album_name);
 CREATE INDEX IF NOT EXISTS idx_files_article_number ON files(article_number);
@@ -26,6 +51,153 @@ CREATE INDEX IF NOT EXISTS idx_files_article_album ON files(article_number, albu
 -- УНИКАЛЬНЫЙ ИНДЕКС ДЛЯ ПРЕДОТВРАЩЕНИЯ ДУБЛИКАТОВ
 CREATE UNIQUE INDEX IF NOT EXISTS idx_files_unique ON files(filename, album_name);
 
+-- Индекс ключей превью: дешевый ключ оригинала (inode, mtime, размер) -> хэш содержимого
+CREATE TABLE IF NOT EXISTS thumbnail_keys (
+    rel_path TEXT PRIMARY KEY,
+    inode NUMERIC(20) NOT NULL,
+    mtime_ns BIGINT NOT NULL,
+    file_size BIGINT NOT NULL,
+    content_hash TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Блобы оригиналов: файл в images/.blobs/<aa>/<bb>/<sha256>, на который ставятся
+-- жесткие ссылки из папок альбомов; refcount - число строк files с этим хэшем
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size BIGINT,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced ON blobs(sha256) WHERE refcount <= 0;
+
+-- refcount поддерживается триггерами на уровне оператора: массовая вставка или
+-- удаление альбома обновляют blobs одним запросом на хэш, а не на строку
+CREATE OR REPLACE FUNCTION files_blob_refcount() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO blobs (sha256, size, refcount)
+        SELECT blob_sha256, max(file_size), count(*)
+        FROM new_rows WHERE blob_sha256 IS NOT NULL
+        GROUP BY blob_sha256 ORDER BY blob_sha256
+        ON CONFLICT (sha256) DO UPDATE SET refcount = blobs.refcount + EXCLUDED.refcount;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE blobs b SET refcount = b.refcount - o.n
+        FROM (SELECT blob_sha256, count(*) AS n FROM old_rows
+              WHERE blob_sha256 IS NOT NULL GROUP BY blob_sha256) o
+        WHERE b.sha256 = o.blob_sha256;
+    ELSE
+        -- Учитываются только строки, у которых сменился блоб
+        INSERT INTO blobs (sha256, size, refcount)
+        SELECT n.blob_sha256, max(n.file_size), count(*)
+        FROM new_rows n JOIN old_rows o ON o.id = n.id
+        WHERE n.blob_sha256 IS NOT NULL AND n.blob_sha256 IS DISTINCT FROM o.blob_sha256
+        GROUP BY n.blob_sha256 ORDER BY n.blob_sha256
+        ON CONFLICT (sha256) DO UPDATE SET refcount = blobs.refcount + EXCLUDED.refcount;
+
+        UPDATE blobs b SET refcount = b.refcount - c.n
+        FROM (SELECT o.blob_sha256, count(*) AS n
+              FROM old_rows o JOIN new_rows n ON n.id = o.id
+              WHERE o.blob_sha256 IS NOT NULL AND o.blob_sha256 IS DISTINCT FROM n.blob_sha256
+              GROUP BY o.blob_sha256) c
+        WHERE b.sha256 = c.blob_sha256;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS files_blob_refcount_insert ON files;
+CREATE TRIGGER files_blob_refcount_insert AFTER INSERT ON files
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION files_blob_refcount();
+
+DROP TRIGGER IF EXISTS files_blob_refcount_delete ON files;
+CREATE TRIGGER files_blob_refcount_delete AFTER DELETE ON files
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION files_blob_refcount();
+
+DROP TRIGGER IF EXISTS files_blob_refcount_update ON files;
+CREATE TRIGGER files_blob_refcount_update AFTER UPDATE ON files
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION files_blob_refcount();
+
+-- Очередь фоновых задач загрузки (забирается воркером через FOR UPDATE SKIP LOCKED)
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    mode TEXT NOT NULL DEFAULT 'merge',
+    status TEXT NOT NULL DEFAULT 'queued',
+    stage TEXT,
+    original_name TEXT,
+    payload_path TEXT,
+    payload_size BIGINT,
+    payload_sha256 TEXT,
+    payload_crc32 BIGINT,
+    unpacked_size BIGINT,
+    workers INTEGER,
+    album_name TEXT,
+    user_id TEXT,
+    username TEXT,
+    files_total INTEGER NOT NULL DEFAULT 0,
+    files_extracted INTEGER NOT NULL DEFAULT 0,
+    files_inserted INTEGER NOT NULL DEFAULT 0,
+    files_unchanged INTEGER NOT NULL DEFAULT 0,
+    files_removed INTEGER NOT NULL DEFAULT 0,
+    files_done INTEGER NOT NULL DEFAULT 0,
+    files_failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    heartbeat_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_queued ON ingest_jobs(created_at, id) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_album ON ingest_jobs(kind, album_name, created_at DESC);
+-- Выполняющиеся загрузки: бюджет допуска (admission.py) считается по ним при каждом опросе очереди
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_running ON ingest_jobs(kind) WHERE status = 'running';
+
+-- Сессии возобновляемой загрузки частями (upload_sessions.py); файл - staging/<id>.part
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id TEXT PRIMARY KEY,
+    original_name TEXT NOT NULL,
+    mode TEXT NOT NULL DEFAULT 'merge',
+    total_size BIGINT NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    staging_path TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'open',
+    job_id BIGINT,
+    user_id TEXT,
+    username TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated ON upload_sessions(updated_at);
+
+-- Принятые части сессии с контрольной суммой каждой
+CREATE TABLE IF NOT EXISTS upload_chunks (
+    upload_id TEXT NOT NULL REFERENCES upload_sessions(id) ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (upload_id, chunk_index)
+);
+
+-- Колонки, появившиеся позже, для баз, созданных до них
+ALTER TABLE ingest_jobs ADD COLUMN IF NOT EXISTS payload_size BIGINT;
+ALTER TABLE ingest_jobs ADD COLUMN IF NOT EXISTS payload_sha256 TEXT;
+ALTER TABLE ingest_jobs ADD COLUMN IF NOT EXISTS payload_crc32 BIGINT;
+ALTER TABLE ingest_jobs ADD COLUMN IF NOT EXISTS mode TEXT NOT NULL DEFAULT 'merge';
+ALTER TABLE ingest_jobs ADD COLUMN IF NOT EXISTS files_unchanged INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE ingest_jobs ADD COLUMN IF NOT EXISTS files_removed INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE ingest_jobs ADD COLUMN IF NOT EXISTS unpacked_size BIGINT;
+ALTER TABLE ingest_jobs ADD COLUMN IF NOT EXISTS workers INTEGER;
+
 -- Таблица логов с оптимизированными индексами
 CREATE TABLE IF NOT EXISTS user_actions_log (
     id SERIAL PRIMARY KEY,
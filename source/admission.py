@@ -0,0 +1,206 @@
+# admission.py
+"""
+Допуск загрузок архивов к распаковке: общий бюджет на все процессы.
+
+Загрузки выполняют воркеры очереди (их может быть несколько, в разных
+контейнерах). Каждая загрузка -
+строка ingest_jobs со статусом running, в которой записаны выделенные ей
+процессы распаковки (workers) и ожидаемый объем распакованных файлов
+(unpacked_size). Задача thumbnails так же получает процессы для пула
+генерации превью из того же бюджета (claim_thumbnails). Решение о допуске принимается в транзакции под
+advisory-блокировкой, поэтому два процесса не займут один и тот же остаток
+бюджета:
+
+    - одновременно выполняется не больше INGEST_MAX_CONCURRENT загрузок;
+    - сумма процессов распаковки и генерации превью не больше
+      INGEST_WORKER_BUDGET: архив или альбом получает min(max_workers,
+      остаток бюджета) процессов;
+    - распакованный объем архива (сумма размеров из центрального каталога)
+      вместе с объемом выполняющихся загрузок должен помещаться в свободное
+      место тома images за вычетом INGEST_DISK_RESERVE_MB.
+
+Архив, который не помещается даже на пустой том (ничего не выполняется),
+отклоняется; помещающийся, но не вместе с текущими загрузками, ждет в
+очереди. Из очереди задачи берутся по очереди пользователей: порядок -
+число выполняющихся загрузок пользователя плюс номер задачи в его
+собственной очереди, так что десять архивов одного пользователя не
+задерживают единственный архив другого.
+"""
+import logging
+import os
+import shutil
+import zipfile
+
+from job_queue import JOB_KIND_ZIP, JOB_KIND_THUMBNAILS
+from tar_processor import is_tar_name
+from zip_processor import ZipProcessor
+
+logger = logging.getLogger(__name__)
+
+# Одновременных загрузок архивов на все процессы
+INGEST_MAX_CONCURRENT = int(os.environ.get('INGEST_MAX_CONCURRENT', 2))
+# Процессов распаковки и генерации превью на все задачи (по умолчанию - число ядер)
+INGEST_WORKER_BUDGET = int(os.environ.get('INGEST_WORKER_BUDGET') or os.cpu_count() or 1)
+# Место на томе images, которое загрузки не занимают (МБ)
+INGEST_DISK_RESERVE = int(os.environ.get('INGEST_DISK_RESERVE_MB', 2048)) * 1024 * 1024
+
+# Ключ pg_advisory_xact_lock, под которым принимаются решения о допуске
+INGEST_ADMISSION_LOCK = 0x1A6E5701
+
+
+class AdmissionError(Exception):
+    """Архив не может быть принят; status - HTTP-код ответа"""
+
+    def __init__(self, message, status=507):
+        super().__init__(message)
+        self.status = status
+
+
+def archive_unpacked_size(path, original_name):
+    """
+    Объем, который займут файлы архива после распаковки. Для ZIP - сумма размеров
+    изображений из центрального каталога (без чтения данных), для tar - размер
+    самого архива (каталога нет; для tar.gz это оценка снизу).
+    """
+    if is_tar_name(original_name):
+        return os.path.getsize(path)
+    with zipfile.ZipFile(path) as archive:
+        return sum(info.file_size for info in archive.infolist()
+                   if not info.is_dir() and ZipProcessor._is_image_path(info.filename))
+
+
+class IngestAdmission:
+    """Допуск задач очереди к распаковке и генерации превью (см. описание модуля)"""
+
+    def __init__(self, job_queue, upload_folder, max_concurrent=INGEST_MAX_CONCURRENT,
+                 worker_budget=INGEST_WORKER_BUDGET, disk_reserve=INGEST_DISK_RESERVE):
+        self.queue = job_queue
+        self.upload_folder = upload_folder
+        self.max_concurrent = max_concurrent
+        self.worker_budget = worker_budget
+        self.disk_reserve = disk_reserve
+
+    def available_bytes(self):
+        """Свободное место тома images за вычетом резерва"""
+        return shutil.disk_usage(self.upload_folder).free - self.disk_reserve
+
+    def check_disk(self, unpacked_size):
+        """Отклоняет архив, который не поместится на том, даже если других загрузок нет"""
+        available = self.available_bytes()
+        if unpacked_size and unpacked_size > available:
+            raise AdmissionError(
+                f'Not enough disk space: archive unpacks to {unpacked_size / (1024 ** 3):.1f} GB, '
+                f'{max(available, 0) / (1024 ** 3):.1f} GB available')
+
+    def claim(self, max_workers):
+        """
+        Забирает из очереди следующую задачу zip, если бюджет позволяет; None, если задач
+        нет или бюджет занят. В задаче workers - число выделенных процессов распаковки.
+        """
+        rejected = []
+        job = None
+        with self.queue.db.transaction() as cursor:
+            usage = self._lock_usage(cursor)
+            workers_left = self.worker_budget - usage['workers']
+            available = self.available_bytes() - usage['reserved']
+            if usage['running'] == 0:
+                rejected = self._reject_oversized(cursor, available)
+
+            # Очередь пользователей: выполняющиеся загрузки пользователя + номер задачи в его очереди
+            cursor.execute(
+                """WITH running AS (
+                       SELECT user_id, count(*) AS n FROM ingest_jobs
+                       WHERE kind = %s AND status = 'running' GROUP BY user_id
+                   ), queued AS (
+                       SELECT id, user_id, original_name, created_at, unpacked_size,
+                              row_number() OVER (PARTITION BY user_id ORDER BY created_at, id) AS position
+                       FROM ingest_jobs WHERE kind = %s AND status = 'queued'
+                   )
+                   SELECT q.id, q.original_name FROM queued q
+                   LEFT JOIN running r ON r.user_id IS NOT DISTINCT FROM q.user_id
+                   WHERE COALESCE(q.unpacked_size, 0) <= %s
+                   ORDER BY COALESCE(r.n, 0) + q.position, q.created_at, q.id
+                   LIMIT 1""",
+                (JOB_KIND_ZIP, JOB_KIND_ZIP, available)
+            )
+            candidate = cursor.fetchone()
+            if candidate and usage['running'] < self.max_concurrent and workers_left >= 1:
+                # tar распаковывается в одном потоке
+                workers = 1 if is_tar_name(candidate['original_name']) else max(1, min(max_workers, workers_left))
+                cursor.execute(
+                    """UPDATE ingest_jobs
+                       SET status = 'running', stage = NULL, attempts = attempts + 1, worker = %s, workers = %s,
+                           started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP
+                       WHERE id = %s
+                       RETURNING *""",
+                    (self.queue.worker_id, workers, candidate['id'])
+                )
+                job = dict(cursor.fetchone())
+
+        # Архивы отклоненных задач удаляются, когда отказ уже записан
+        for row in rejected:
+            logger.warning(f"💾 Задача #{row['id']} отклонена: архив не помещается на диск")
+            if row['payload_path']:
+                try:
+                    os.unlink(row['payload_path'])
+                except OSError:
+                    pass
+        if job:
+            logger.info(f"🎫 Задача #{job['id']} допущена: {job['workers']} процессов распаковки, "
+                        f"{usage['running'] + 1} из {self.max_concurrent} загрузок")
+        return job
+
+    def claim_thumbnails(self, max_workers):
+        """
+        Забирает из очереди самую старую задачу thumbnails, если в бюджете процессов есть
+        остаток; None, если задач нет или бюджет занят. В задаче workers - размер пула превью.
+        """
+        with self.queue.db.transaction() as cursor:
+            usage = self._lock_usage(cursor)
+            workers_left = self.worker_budget - usage['workers']
+            if workers_left < 1:
+                return None
+            cursor.execute(
+                """UPDATE ingest_jobs
+                   SET status = 'running', stage = NULL, attempts = attempts + 1, worker = %s, workers = %s,
+                       started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP
+                   WHERE id = (
+                       SELECT id FROM ingest_jobs
+                       WHERE kind = %s AND status = 'queued'
+                       ORDER BY created_at, id
+                       FOR UPDATE SKIP LOCKED
+                       LIMIT 1
+                   )
+                   RETURNING *""",
+                (self.queue.worker_id, max(1, min(max_workers, workers_left)), JOB_KIND_THUMBNAILS)
+            )
+            row = cursor.fetchone()
+        if row:
+            logger.info(f"🎫 Задача превью #{row['id']} допущена: {row['workers']} процессов")
+        return dict(row) if row else None
+
+    def _lock_usage(self, cursor):
+        """
+        Берет блокировку допуска до конца транзакции и возвращает занятый бюджет: загрузки
+        и место на диске - по задачам zip, процессы - по задачам zip и thumbnails
+        """
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (INGEST_ADMISSION_LOCK,))
+        cursor.execute(
+            """SELECT count(*) FILTER (WHERE kind = %s) AS running, COALESCE(sum(workers), 0) AS workers,
+                      COALESCE(sum(unpacked_size) FILTER (WHERE kind = %s), 0) AS reserved
+               FROM ingest_jobs WHERE kind = ANY(%s) AND status = 'running'""",
+            (JOB_KIND_ZIP, JOB_KIND_ZIP, [JOB_KIND_ZIP, JOB_KIND_THUMBNAILS])
+        )
+        return cursor.fetchone()
+
+    def _reject_oversized(self, cursor, available):
+        """Отклоняет задачи, которые не поместятся на том, когда ему больше нечем освободиться"""
+        cursor.execute(
+            """UPDATE ingest_jobs
+               SET status = 'failed', finished_at = CURRENT_TIMESTAMP,
+                   error = 'Недостаточно места на диске для распаковки архива'
+               WHERE kind = %s AND status = 'queued' AND unpacked_size > %s
+               RETURNING id, payload_path""",
+            (JOB_KIND_ZIP, available)
+        )
+        return cursor.fetchall()
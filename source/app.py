@@ -2,17 +2,19 @@
 
 import atexit
 import hashlib
-import io
 import logging
 import os
 import shutil
-import tempfile
+import threading
 import time
+import zipfile
 from datetime import datetime, timedelta
+from urllib.parse import quote, unquote
 
-from PIL import Image
-from flask import Flask, request, session, jsonify, render_template, send_from_directory, send_file, redirect, url_for
-from werkzeug.utils import secure_filename
+from flask import Flask, request, session, jsonify, render_template, send_from_directory, send_file, redirect, url_for, \
+    Response
+from werkzeug.exceptions import HTTPException
+from werkzeug.utils import secure_filename, safe_join
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Импорты для Prometheus
@@ -20,15 +22,26 @@ from prometheus_client import Gauge, generate_latest, CollectorRegistry, multipr
 from prometheus_client.exposition import choose_encoder
 import prometheus_client
 
+from blob_store import BlobStore
 from auth_system import AuthManager, permission_required, auth_context_processor, \
     is_authenticated, get_current_user, Permissions
 from database import db_manager as db_manager
 from document_generator import init_document_generator, get_document_generator
 from sync_manager import SyncManager
+from thumbnail_manager import ThumbnailManager, THUMBNAIL_FORMATS, negotiate_format, sprite_signature
+from thumbnail_gc import ThumbnailGarbageCollector
+from warmup_thumbnails import ThumbnailWarmup
 # Модули приложения
-from utils import cleanup_album_thumbnails, log_user_action
+from utils import cleanup_album_thumbnails, cleanup_article_thumbnails, log_user_action, parse_variant_sizes, \
+    read_image_info
+from utils import cleanup_file_thumbnails as utils_cleanup_file_thumbnails
 from zip_processor import ZipProcessor
-from metrics import update_metrics
+from tar_processor import is_tar_name
+from job_queue import JobQueue, JOB_KIND_ZIP, JOB_KIND_THUMBNAILS, JOB_MODES
+from admission import IngestAdmission, AdmissionError, archive_unpacked_size
+from upload_staging import receive_multipart_upload, receive_stream_upload
+from upload_sessions import UploadSessions, UploadSessionError
+from metrics import update_metrics, IMAGE_VARIANT_RENDERS, VariantAccessLog
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'default_secret_key')
@@ -82,13 +95,34 @@ app.context_processor(auth_context_processor)
 
 app.config['UPLOAD_FOLDER'] = 'images'
 app.config['THUMBNAIL_FOLDER'] = 'thumbnails'
+# Загруженные архивы ждут здесь воркера очереди (общий том app и worker)
+app.config['STAGING_FOLDER'] = 'staging'
 app.config['THUMBNAIL_SIZE'] = (96, 96)  # Размер превью
 app.config['PREVIEW_SIZE'] = (600, 600)  # Размер для предпросмотра
+# Варианты превью: имя в URL /thumbnails/<variant>/<path> -> размер
+app.config['THUMBNAIL_VARIANTS'] = {
+    'small': app.config['THUMBNAIL_SIZE'],
+    'medium': app.config['PREVIEW_SIZE']
+}
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 * 1024  # 16GB
+# Размеры вариантов изображений для /variants/<WxH>/<path> (разрешены только перечисленные)
+app.config['IMAGE_VARIANT_SIZES'] = parse_variant_sizes(os.environ.get('IMAGE_VARIANT_SIZES', '1200x1200,800x800,400x400'))
+# Дополнительные форматы превью, выбираемые по заголовку Accept (JPEG отдается всегда)
+app.config['THUMBNAIL_FORMATS'] = os.environ.get('THUMBNAIL_FORMATS', '').split(',')
+# Лог nginx с попаданиями в кэш вариантов (том logs nginx); из него /metrics берет image_variant_hits_total
+app.config['VARIANT_ACCESS_LOG'] = os.environ.get('VARIANT_ACCESS_LOG', '/app/nginx_logs/variants_access.log')
+# Через сколько секунд после задачи превью альбома /api/sprites может поставить новую, если спрайта нет
+app.config['SPRITE_RETRY_INTERVAL'] = int(os.environ.get('SPRITE_RETRY_INTERVAL', 3600))
+# Генерация превью всех размеров сразу после распаковки ZIP
+app.config['EAGER_THUMBNAILS'] = os.environ.get('EAGER_THUMBNAILS', 'true').lower() == 'true'
+# Бюджет папки превью на диске (0 - без ограничения) и период сборщика мусора
+app.config['THUMBNAIL_CACHE_MAX_BYTES'] = int(os.environ.get('THUMBNAIL_CACHE_MAX_MB', 10240)) * 1024 * 1024
+app.config['THUMBNAIL_GC_INTERVAL'] = int(os.environ.get('THUMBNAIL_GC_INTERVAL', 3600))
 
 # Создаем папки если их нет
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['THUMBNAIL_FOLDER'], exist_ok=True)
+os.makedirs(app.config['STAGING_FOLDER'], exist_ok=True)
 
 # Логирование
 logging.basicConfig(level=logging.DEBUG)
@@ -101,102 +135,60 @@ base_url = f"http://{domain}"
 # ==========  Инициализация модулей  ===========
 document_generator = init_document_generator(base_url, app.config['UPLOAD_FOLDER'])
 
-zip_processor = ZipProcessor(
+thumbnail_manager = ThumbnailManager(
     upload_folder=app.config['UPLOAD_FOLDER'],
-    base_url=base_url,
     thumbnail_folder=app.config['THUMBNAIL_FOLDER'],
-    max_workers=os.cpu_count()  # Используем все ядра
+    variants=app.config['THUMBNAIL_VARIANTS'],
+    on_demand_variants=app.config['IMAGE_VARIANT_SIZES'],
+    formats=app.config['THUMBNAIL_FORMATS']
 )
 
-sync_manager = SyncManager(
+# Хранилище оригиналов по содержимому: одинаковые файлы в разных альбомах - жесткие ссылки на один блоб
+blob_store = BlobStore(app.config['UPLOAD_FOLDER'])
+
+# Проход сборщика заодно удаляет брошенные прерванными загрузками файлы блобов
+thumbnail_gc = ThumbnailGarbageCollector(
     upload_folder=app.config['UPLOAD_FOLDER'],
-    base_url=base_url,
-    thumbnail_folder=app.config['THUMBNAIL_FOLDER']
+    thumbnail_folder=app.config['THUMBNAIL_FOLDER'],
+    max_bytes=app.config['THUMBNAIL_CACHE_MAX_BYTES'],
+    blob_store=blob_store
 )
 
+thumbnail_warmup = ThumbnailWarmup(thumbnail_manager)
 
-# =========  Инициализация модулей конец  ==========
-
+variant_access_log = VariantAccessLog(app.config['VARIANT_ACCESS_LOG'])
 
-def generate_image_hash(file_path):
-    """Генерирует хэш для файла для кэширования"""
-    try:
-        with open(file_path, 'rb') as f:
-            return hashlib.md5(f.read()).hexdigest()
-    except Exception as e:
-        logger.error(f"Error generating hash for {file_path}: {e}")
-        return hashlib.md5(file_path.encode()).hexdigest()
-
-
-def create_thumbnail(original_path, size, quality=85):
-    """Создает миниатюру изображения"""
-    try:
-        with Image.open(original_path) as img:
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-
-            img.thumbnail(size, Image.Resampling.LANCZOS)
+# Распаковка архивов; используется воркером очереди (ingest_worker.py)
+zip_processor = ZipProcessor(
+    upload_folder=app.config['UPLOAD_FOLDER'],
+    base_url=base_url,
+    thumbnail_folder=app.config['THUMBNAIL_FOLDER'],
+    max_workers=os.cpu_count(),  # Используем все ядра
+    blob_store=blob_store
+)
 
-            buffer = io.BytesIO()
-            img.save(buffer, 'JPEG', quality=quality, optimize=True)
-            buffer.seek(0)
+# Очередь задач загрузки; задачи выполняет ingest_worker.py
+job_queue = JobQueue()
 
-            return buffer
-    except Exception as e:
-        logger.error(f"Error creating thumbnail for {original_path}: {e}")
-        return None
+# Общий бюджет загрузок (одновременные распаковки, процессы, место на диске) для воркеров очереди
+ingest_admission = IngestAdmission(job_queue, app.config['UPLOAD_FOLDER'])
 
+# Возобновляемые загрузки частями (/api/uploads); собранный файл уходит в ту же очередь
+upload_sessions = UploadSessions(app.config['STAGING_FOLDER'])
 
-def get_thumbnail_path(original_path, size):
-    """Генерирует путь для миниатюры"""
-    file_hash = generate_image_hash(original_path)
-    filename = os.path.basename(original_path)
-    name, ext = os.path.splitext(filename)
-    size_str = f"{size[0]}x{size[1]}"
-
-    rel_path = os.path.relpath(original_path, app.config['UPLOAD_FOLDER'])
-    rel_dir = os.path.dirname(rel_path)
+sync_manager = SyncManager(
+    upload_folder=app.config['UPLOAD_FOLDER'],
+    base_url=base_url,
+    thumbnail_folder=app.config['THUMBNAIL_FOLDER']
+)
 
-    thumbnail_filename = f"{name}_{size_str}_{file_hash[:8]}.jpg"
 
-    if rel_dir and rel_dir != '.':
-        thumbnail_dir = os.path.join(app.config['THUMBNAIL_FOLDER'], rel_dir)
-        os.makedirs(thumbnail_dir, exist_ok=True)
-        return os.path.join(thumbnail_dir, thumbnail_filename)
-    else:
-        return os.path.join(app.config['THUMBNAIL_FOLDER'], thumbnail_filename)
+# =========  Инициализация модулей конец  ==========
 
 
 def cleanup_file_thumbnails(filename):
     """Очищает превью для конкретного файла"""
-    try:
-        original_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if not os.path.exists(original_path):
-            # Если оригинального файла нет, ищем и удаляем все возможные превью
-            rel_dir = os.path.dirname(filename)
-            file_base = os.path.splitext(os.path.basename(filename))[0]
-
-            if rel_dir and rel_dir != '.':
-                thumb_dir = os.path.join(app.config['THUMBNAIL_FOLDER'], rel_dir)
-                if os.path.exists(thumb_dir):
-                    # Удаляем все превью для этого файла
-                    for thumb_file in os.listdir(thumb_dir):
-                        if thumb_file.startswith(file_base + '_'):
-                            thumb_path = os.path.join(thumb_dir, thumb_file)
-                            os.remove(thumb_path)
-                            logger.info(f"Deleted orphaned thumbnail: {thumb_path}")
-        else:
-            # Удаляем превью для существующего файла
-            thumbnail_path = get_thumbnail_path(original_path, app.config['THUMBNAIL_SIZE'])
-            preview_path = get_thumbnail_path(original_path, app.config['PREVIEW_SIZE'])
-
-            for thumb_path in [thumbnail_path, preview_path]:
-                if os.path.exists(thumb_path):
-                    os.remove(thumb_path)
-                    logger.info(f"Deleted thumbnail: {thumb_path}")
-
-    except Exception as e:
-        logger.error(f"Error cleaning up thumbnails for file {filename}: {e}")
+    utils_cleanup_file_thumbnails(filename, app.config['UPLOAD_FOLDER'], app.config['THUMBNAIL_FOLDER'])
 
 
 # Инициализация базы данных
@@ -276,6 +268,8 @@ def get_all_files():
 def api_sync():
     try:
         deleted, added = sync_manager.sync()
+        if deleted:
+            blob_store.sweep()
         return jsonify({
             'message': 'Synchronization completed successfully',
             'deleted': deleted,
@@ -405,6 +399,8 @@ def prometheus_metrics():
     """Возвращает метрики в формате Prometheus"""
     # Обновляем метрики при каждом запросе
     update_metrics(app.start_time)
+    thumbnail_gc.export_metrics()
+    variant_access_log.export()
     registry = prometheus_client.REGISTRY
     data, content_type = choose_encoder(request.headers.get("Accept"))
     return data(registry), 200, {"Content-Type": content_type}
@@ -472,40 +468,245 @@ def api_cleanup_thumbnails(album_name):
 @app.route('/upload', methods=['POST'])
 @permission_required(Permissions.UPLOAD_ZIP)
 def upload_zip():
+    """
+    Принимает ZIP и ставит задачу в очередь: распаковку выполняет ingest_worker.py,
+    запрос не ждет ее и не держит воркер gunicorn.
+
+    Архив пишется прямо в staging за один проход (без промежуточного файла Werkzeug):
+    multipart-форма с полем zipfile или тело запроса application/zip с именем в X-Filename.
+    ?mode=merge (по умолчанию) обновляет существующий альбом только по изменившимся файлам,
+    ?mode=replace полностью заменяет его. tar и tar.gz тоже принимаются (воркер читает их потоком),
+    как и через /upload/tar.
+    """
     logger.info("Upload endpoint called")
-    if 'zipfile' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
+    mode = request.args.get('mode', 'merge')
+    if mode not in JOB_MODES:
+        return jsonify({'error': f'Unknown upload mode: {mode}'}), 400
+    try:
+        if request.mimetype == 'multipart/form-data':
+            staged, original_name = receive_multipart_upload(request.environ, app.config['STAGING_FOLDER'],
+                                                             'zipfile', app.config['MAX_CONTENT_LENGTH'])
+            if staged is None:
+                return jsonify({'error': 'No selected file'}), 400
+        else:
+            original_name = unquote(request.headers.get('X-Filename', ''))
+            if not original_name:
+                return jsonify({'error': 'No file name (X-Filename header)'}), 400
+            staged = receive_stream_upload(request.stream, app.config['STAGING_FOLDER'])
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error receiving ZIP upload: {e}")
+        return jsonify({'error': f'Failed to receive ZIP file: {str(e)}'}), 400
 
-    file = request.files['zipfile']
+    digest = staged.digest()
+    if digest['size'] == 0:
+        staged.discard()
+        return jsonify({'error': 'Empty file'}), 400
 
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+    try:
+        job_id = _queue_zip(original_name, staged.path, digest, mode)
+    except AdmissionError as e:
+        staged.discard()
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        logger.error(f"Error queueing ZIP {original_name}: {e}")
+        staged.discard()
+        return jsonify({'error': f'Failed to queue ZIP file: {str(e)}'}), 500
+
+    return jsonify({
+        'message': 'ZIP file queued for processing',
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('api_job_status', job_id=job_id),
+        'size': digest['size'],
+        'sha256': digest['sha256'],
+        'crc32': f"{digest['crc32']:08x}"
+    }), 202
+
+
+# Загрузка tar/tar.gz телом запроса: архив пишется в staging и ставится в очередь, как ZIP
+@app.route('/upload/tar', methods=['POST'])
+@permission_required(Permissions.UPLOAD_ZIP)
+def upload_tar_stream():
+    """
+    Принимает tar или tar.gz телом запроса (имя в X-Filename), записывает его в staging
+    и ставит задачу в очередь (ответ 202). Воркер очереди читает архив потоком за один
+    проход. ?mode=merge|replace - как у /upload.
 
-    if file:
-        original_name = file.filename
-
-        # Обрабатываем прямо из памяти без сохранения на диск
-        logger.info(f"💾 Обработка ZIP: {original_name}")
-        process_start = time.time()
-
-        # Создаем временный файл в памяти
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-            file.save(tmp_file.name)
-            success, result = zip_processor.process_zip(tmp_file.name, original_name)
-            # Удаляем временный файл
-            os.unlink(tmp_file.name)
-
-        process_time = time.time() - process_start
-        logger.info(f"✅ Обработка завершена за {process_time:.2f}s")
-
-        if success:
-            log_user_action('upload', 'album', original_name, {
-                'album_name': result,
-                'original_filename': original_name
-            })
-            return jsonify({'message': 'Files uploaded successfully', 'album_name': result})
-        else:
-            return jsonify({'error': f'Failed to process ZIP file: {result}'}), 500
+    В запросе архив не распаковывается: время распаковки зависит от скорости клиента и
+    размера архива и не укладывается гарантированно в таймаут воркера gunicorn.
+    """
+    original_name = unquote(request.headers.get('X-Filename', ''))
+    mode = request.args.get('mode', 'merge')
+    if not is_tar_name(original_name):
+        return jsonify({'error': 'Expected a .tar, .tar.gz or .tgz file name in X-Filename'}), 400
+    if mode not in JOB_MODES:
+        return jsonify({'error': f'Unknown upload mode: {mode}'}), 400
+
+    try:
+        staged = receive_stream_upload(request.stream, app.config['STAGING_FOLDER'])
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error receiving tar upload: {e}")
+        return jsonify({'error': f'Failed to receive tar file: {str(e)}'}), 400
+
+    digest = staged.digest()
+    if digest['size'] == 0:
+        staged.discard()
+        return jsonify({'error': 'Empty file'}), 400
+
+    try:
+        job_id = _queue_zip(original_name, staged.path, digest, mode)
+    except AdmissionError as e:
+        staged.discard()
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        logger.error(f"Error queueing tar {original_name}: {e}")
+        staged.discard()
+        return jsonify({'error': f'Failed to queue tar file: {str(e)}'}), 500
+
+    return jsonify({
+        'message': 'Tar file queued for processing',
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('api_job_status', job_id=job_id),
+        'size': digest['size'],
+        'sha256': digest['sha256'],
+        'crc32': f"{digest['crc32']:08x}"
+    }), 202
+
+
+def _queue_zip(original_name, payload_path, digest, mode):
+    """
+    Ставит принятый архив в очередь распаковки и пишет действие в журнал; возвращает id задачи.
+    AdmissionError - распакованный архив не поместится на диск.
+    """
+    try:
+        unpacked_size = archive_unpacked_size(payload_path, original_name)
+    except (zipfile.BadZipFile, OSError):
+        # Ошибку самого архива сообщит задача
+        unpacked_size = None
+    ingest_admission.check_disk(unpacked_size)
+
+    job_id = job_queue.enqueue(JOB_KIND_ZIP, original_name=original_name,
+                               payload_path=os.path.abspath(payload_path), payload_digest=digest,
+                               user=get_current_user(), mode=mode, unpacked_size=unpacked_size)
+    log_user_action('upload', 'album', original_name, {
+        'job_id': job_id,
+        'mode': mode,
+        'original_filename': original_name,
+        'size': digest['size'],
+        'sha256': digest.get('sha256')
+    })
+    return job_id
+
+
+# Возобновляемая загрузка частями: создание сессии
+@app.route('/api/uploads', methods=['POST'])
+@permission_required(Permissions.UPLOAD_ZIP)
+def api_upload_create():
+    """
+    Создает сессию загрузки: JSON {filename, size, chunk_size?, mode?}.
+    Части отправляются PUT /api/uploads/<id>/chunks/<offset>, затем POST /api/uploads/<id>/complete.
+    """
+    data = request.get_json(silent=True) or {}
+    original_name = data.get('filename')
+    mode = data.get('mode', 'merge')
+    if not original_name:
+        return jsonify({'error': 'No file name'}), 400
+    if mode not in JOB_MODES:
+        return jsonify({'error': f'Unknown upload mode: {mode}'}), 400
+    try:
+        session_row = upload_sessions.create(original_name, int(data.get('size') or 0), get_current_user(),
+                                             mode=mode, chunk_size=int(data.get('chunk_size') or 0),
+                                             max_size=app.config['MAX_CONTENT_LENGTH'])
+        return jsonify(_job_to_json(upload_sessions.status(session_row))), 201
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid size'}), 400
+    except Exception as e:
+        logger.error(f"Error creating upload session for {original_name}: {e}")
+        return jsonify({'error': f'Failed to create upload: {str(e)}'}), 500
+
+
+# Состояние сессии: принятые части и непрерывно принятое начало файла
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+@permission_required(Permissions.UPLOAD_ZIP)
+def api_upload_status(upload_id):
+    try:
+        return jsonify(_job_to_json(upload_sessions.status(upload_sessions.get(upload_id, get_current_user()))))
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status
+
+
+# Прием части по смещению; X-Chunk-Sha256 - контрольная сумма части от клиента
+@app.route('/api/uploads/<upload_id>/chunks/<int:offset>', methods=['PUT'])
+@permission_required(Permissions.UPLOAD_ZIP)
+def api_upload_chunk(upload_id, offset):
+    try:
+        session_row = upload_sessions.get(upload_id, get_current_user())
+        sha256 = upload_sessions.write_chunk(session_row, offset, request.stream, request.content_length,
+                                             request.headers.get('X-Chunk-Sha256'))
+        return jsonify({'offset': offset, 'size': request.content_length, 'sha256': sha256})
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        logger.error(f"Error receiving chunk {offset} of upload {upload_id}: {e}")
+        return jsonify({'error': f'Failed to receive chunk: {str(e)}'}), 500
+
+
+# Завершение сессии: архив ставится в очередь распаковки
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+@permission_required(Permissions.UPLOAD_ZIP)
+def api_upload_complete(upload_id):
+    try:
+        session_row = upload_sessions.get(upload_id, get_current_user())
+        job_id = upload_sessions.finalize(
+            session_row,
+            lambda s: _queue_zip(s['original_name'], s['staging_path'], {'size': s['total_size']}, s['mode']))
+    except (UploadSessionError, AdmissionError) as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        logger.error(f"Error finalizing upload {upload_id}: {e}")
+        return jsonify({'error': f'Failed to queue ZIP file: {str(e)}'}), 500
+
+    return jsonify({
+        'message': 'ZIP file queued for processing',
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('api_job_status', job_id=job_id),
+        'size': session_row['total_size']
+    }), 202
+
+
+# Отмена незавершенной сессии
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@permission_required(Permissions.UPLOAD_ZIP)
+def api_upload_abort(upload_id):
+    try:
+        upload_sessions.abort(upload_sessions.get(upload_id, get_current_user()))
+        return jsonify({'message': 'Upload aborted'})
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status
+
+
+# Состояние задачи очереди загрузки
+@app.route('/api/jobs/<int:job_id>')
+@permission_required(Permissions.UPLOAD_ZIP)
+def api_job_status(job_id):
+    """Возвращает статус, стадию, счетчики и ошибку задачи"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(_job_to_json(job))
+
+
+def _job_to_json(job):
+    """Задача очереди в JSON-совместимом виде (даты в ISO 8601)"""
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in job.items()}
 
 
 # Загрузка отдельных изображений
@@ -542,46 +743,59 @@ def upload_image():
 
         # Полный путь для сохранения
         full_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
 
-        # Сохраняем файл
-        file.save(full_path)
+        # Сохраняем файл в хранилище блобов и ставим на него ссылку
+        blob_sha256, blob_source = blob_store.stage_stream(file.stream)
+        try:
+            blob_store.link(blob_sha256, full_path, blob_source)
+        finally:
+            blob_store.release(blob_source)
 
         # Генерируем публичную ссылку
         public_link = f"{base_url}/images/{unique_filename}"
 
-        # Сохраняем в базу данных
+        # Сохраняем в базу данных вместе с размерами из заголовка (для списков файлов без stat)
         try:
+            width, height, image_format = read_image_info(full_path)
+            file_stat = os.stat(full_path)
             db_manager.execute_query(
-                "INSERT INTO files (filename, album_name, article_number, public_link) VALUES (%s, %s, %s, %s)",
-                (unique_filename, album_name, article_number, public_link),
+                "INSERT INTO files (filename, album_name, article_number, public_link, file_size, blob_sha256, "
+                "width, height, image_format, file_mtime) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                (unique_filename, album_name, article_number, public_link, file_stat.st_size, blob_sha256,
+                 width, height, image_format, datetime.fromtimestamp(file_stat.st_mtime)),
                 commit=True
             )
-
-            # Создаем миниатюры
-            create_thumbnail(full_path, app.config['THUMBNAIL_SIZE'])
-            create_thumbnail(full_path, app.config['PREVIEW_SIZE'])
-
-            log_user_action('upload_image', 'image', unique_filename, {
-                'album_name': album_name,
-                'article_number': article_number,
-                'original_filename': file.filename
-            })
-
-            return jsonify({
-                'message': 'Image uploaded successfully',
-                'album_name': album_name,
-                'article_number': article_number,
-                'filename': unique_filename,
-                'public_link': public_link
-            })
         except Exception as e:
             # Удаляем файл, если не удалось записать в базу
             if os.path.exists(full_path):
                 os.remove(full_path)
+            blob_store.discard_if_unlinked(blob_sha256)
             logger.error(f"Database error during image upload: {e}")
             return jsonify({'error': f'Failed to save image to database: {str(e)}'}), 500
 
+        # Создаем миниатюры всех размеров за одно декодирование. Файл уже записан в БД, поэтому
+        # ошибка здесь загрузку не откатывает: превью создаст /thumbnails при первом запросе
+        try:
+            if thumbnail_manager.render(full_path) is None:
+                logger.warning(f"Thumbnails were not created for {unique_filename}")
+        except Exception as e:
+            logger.warning(f"Error creating thumbnails for {unique_filename}: {e}")
+
+        log_user_action('upload_image', 'image', unique_filename, {
+            'album_name': album_name,
+            'article_number': article_number,
+            'original_filename': file.filename
+        })
+
+        return jsonify({
+            'message': 'Image uploaded successfully',
+            'album_name': album_name,
+            'article_number': article_number,
+            'filename': unique_filename,
+            'public_link': public_link
+        })
+
 
 # API: список всех файлов
 @app.route('/api/files')
@@ -618,14 +832,16 @@ def api_files_filtered(album_name, article_name=None):
     logger.info(f"API files filtered endpoint called for album: {album_name}, article: {article_name}")
     if article_name:
         results = db_manager.execute_query(
-            "SELECT filename, album_name, article_number, public_link, created_at FROM files \
+            "SELECT filename, album_name, article_number, public_link, created_at, file_size, width, height, \
+                image_format FROM files \
                 WHERE album_name = %s AND article_number = %s ORDER BY created_at DESC",
             (album_name, article_name),
             fetch=True
         )
     else:
         results = db_manager.execute_query(
-            "SELECT filename, album_name, article_number, public_link, created_at FROM files WHERE \
+            "SELECT filename, album_name, article_number, public_link, created_at, file_size, width, height, \
+                image_format FROM files WHERE \
                 album_name = %s ORDER BY created_at DESC",
             (album_name,),
             fetch=True
@@ -634,6 +850,53 @@ def api_files_filtered(album_name, article_name=None):
     return jsonify(results if results else [])
 
 
+def get_thumbnail_rows(album_name, article_name=None):
+    """
+    Информация о файлах альбома (или артикула) со ссылками на превью.
+    Размер и разрешение берутся из БД (записываются при загрузке), файлы не stat'ятся.
+    """
+    if article_name:
+        results = db_manager.execute_query(
+            """SELECT filename, album_name, article_number, public_link, created_at, placeholder,
+                      file_size, width, height, image_format
+               FROM files WHERE album_name = %s AND article_number = %s 
+               ORDER BY created_at DESC""",
+            (album_name, article_name),
+            fetch=True
+        )
+    else:
+        results = db_manager.execute_query(
+            """SELECT filename, album_name, article_number, public_link, created_at, placeholder,
+                      file_size, width, height, image_format
+               FROM files WHERE album_name = %s 
+               ORDER BY created_at DESC""",
+            (album_name,),
+            fetch=True
+        )
+
+    files_data = []
+    if results:
+        for row in results:
+            filename = row['filename']
+
+            files_data.append({
+                'filename': filename,
+                'album_name': row['album_name'],
+                'article_number': row['article_number'],
+                'public_link': row['public_link'],
+                'created_at': row['created_at'],
+                'thumbnail_url': f"/thumbnails/small/{filename}",
+                'preview_url': f"/thumbnails/medium/{filename}",
+                'placeholder': row['placeholder'],
+                'file_size': row['file_size'] or 0,
+                'width': row['width'],
+                'height': row['height'],
+                'image_format': row['image_format']
+            })
+
+    return files_data
+
+
 # Новые эндпоинты для превью
 @app.route('/api/thumbnails/<album_name>')
 @app.route('/api/thumbnails/<album_name>/<article_name>')
@@ -641,87 +904,213 @@ def api_files_filtered(album_name, article_name=None):
 def api_thumbnails(album_name, article_name=None):
     """API для получения информации о файлах с превью"""
     try:
-        if article_name:
-            results = db_manager.execute_query(
-                """SELECT filename, album_name, article_number, public_link, created_at 
-                   FROM files WHERE album_name = %s AND article_number = %s 
-                   ORDER BY created_at DESC""",
-                (album_name, article_name),
-                fetch=True
-            )
-        else:
-            results = db_manager.execute_query(
-                """SELECT filename, album_name, article_number, public_link, created_at 
-                   FROM files WHERE album_name = %s 
-                   ORDER BY created_at DESC""",
-                (album_name,),
-                fetch=True
-            )
-
-        files_data = []
-        if results:
-            for row in results:
-                filename = row['filename']
-                album = row['album_name']
-                article = row['article_number']
-                public_link = row['public_link']
-                created_at = row['created_at']
-
-                original_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-
-                files_data.append({
-                    'filename': filename,
-                    'album_name': album,
-                    'article_number': article,
-                    'public_link': public_link,
-                    'created_at': created_at,
-                    'thumbnail_url': f"/thumbnails/small/{filename}",
-                    'preview_url': f"/thumbnails/medium/{filename}",
-                    'file_size': os.path.getsize(original_path) if os.path.exists(original_path) else 0
-                })
-
-        return jsonify(files_data)
+        return jsonify(get_thumbnail_rows(album_name, article_name))
 
     except Exception as e:
         logger.error(f"Error in api_thumbnails: {e}")
         return jsonify({'error': str(e)}), 500
 
 
+# Спрайт маленьких превью артикула: одна картинка вместо запроса на каждый файл
+@app.route('/api/sprites/<album_name>/<article_name>')
+@permission_required(Permissions.VIEW_FILES)
+def api_sprite(album_name, article_name):
+    """Карта спрайта артикула (координаты превью) вместе со списком файлов"""
+    try:
+        files_data = get_thumbnail_rows(album_name, article_name)
+        if not files_data:
+            return jsonify({'error': 'Article not found'}), 404
+
+        signature = sprite_signature(files_data)
+        sprite = thumbnail_manager.load_sprite(album_name, article_name, signature)
+        if sprite is None:
+            # Спрайт собирает воркер очереди вместе с превью альбома, а не запрос; пока его нет,
+            # клиент показывает превью по одному. После недавней задачи альбома (спрайт не
+            # собрался или артикул успел измениться) новая не ставится до SPRITE_RETRY_INTERVAL
+            job = job_queue.enqueue_unless_recent(JOB_KIND_THUMBNAILS, album_name,
+                                                  app.config['SPRITE_RETRY_INTERVAL'], get_current_user())
+            if job['status'] in ('queued', 'running'):
+                return jsonify({'status': 'building', 'job_id': job['id']}), 202
+            return jsonify({'error': 'Sprite is not available', 'job_id': job['id']}), 404
+
+        return jsonify({
+            'sprite_url': f"/thumbnails/sprites/{quote(album_name, safe='')}/{quote(article_name, safe='')}"
+                          f"/sprite.jpg?v={signature[:12]}",
+            'width': sprite['width'],
+            'height': sprite['height'],
+            'tiles': sprite['tiles'],
+            'files': files_data
+        })
+
+    except Exception as e:
+        logger.error(f"Error in api_sprite: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/thumbnails/sprites/<album_name>/<article_name>/sprite.jpg')
+@permission_required(Permissions.VIEW_FILES)
+def serve_sprite(album_name, article_name):
+    """Отдает спрайт артикула (если nginx не нашел его на диске)"""
+    sprite_path = thumbnail_manager.get_sprite_path(album_name, article_name)
+    if sprite_path is None or not os.path.exists(sprite_path):
+        return jsonify({'error': 'Sprite not found'}), 404
+    response = send_file(sprite_path, mimetype='image/jpeg')
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
+
+
+# Прогресс фоновой генерации превью после загрузки ZIP
+@app.route('/api/thumbnail-progress/<album_name>')
+@permission_required(Permissions.VIEW_ALBUMS)
+def api_thumbnail_progress(album_name):
+    """Возвращает прогресс генерации превью для альбома (последняя задача thumbnails)"""
+    job = job_queue.latest(JOB_KIND_THUMBNAILS, album_name)
+    if job is None:
+        return jsonify({'error': 'No thumbnail generation for this album'}), 404
+    return jsonify({
+        'job_id': job['id'],
+        'status': job['status'],
+        'total': job['files_total'],
+        'done': job['files_done'],
+        'failed': job['files_failed'],
+        'error': job['error'],
+        'started_at': job['started_at'].isoformat() if job['started_at'] else None,
+        'finished_at': job['finished_at'].isoformat() if job['finished_at'] else None
+    })
+
+
+# Прогрев превью альбома, артикула или всех файлов (то же, что warmup_thumbnails.py)
+@app.route('/api/admin/thumbnail-warmup', methods=['GET'])
+@permission_required(Permissions.ACCESS_ADMIN)
+def api_thumbnail_warmup_status():
+    """Возвращает состояние последнего прогрева превью"""
+    return jsonify(thumbnail_warmup.get_status())
+
+
+@app.route('/api/admin/thumbnail-warmup', methods=['POST'])
+@permission_required(Permissions.ACCESS_ADMIN)
+def api_thumbnail_warmup_start():
+    """Запускает прогрев превью в фоне; прогресс - GET /api/admin/thumbnail-warmup"""
+    data = request.get_json(silent=True) or {}
+    album_name = data.get('album_name') or None
+    article_name = data.get('article_name') or None
+    if article_name and not album_name:
+        return jsonify({'error': 'article_name requires album_name'}), 400
+
+    try:
+        workers = int(data['workers']) if data.get('workers') else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'workers must be an integer'}), 400
+
+    if thumbnail_warmup.is_running():
+        return jsonify({'error': 'Thumbnail warm-up is already running'}), 409
+
+    def warmup_worker():
+        try:
+            thumbnail_warmup.run(album_name, article_name, workers,
+                                 force=bool(data.get('force')), restart=bool(data.get('restart')))
+        except Exception as e:
+            logger.error(f"Thumbnail warm-up failed: {e}")
+
+    threading.Thread(target=warmup_worker, daemon=True).start()
+
+    log_user_action('thumbnail_warmup', 'thumbnails', ThumbnailWarmup.scope_name(album_name, article_name), {
+        'workers': workers,
+        'force': bool(data.get('force'))
+    })
+    return jsonify({
+        'message': 'Thumbnail warm-up started',
+        'scope': ThumbnailWarmup.scope_name(album_name, article_name)
+    }), 202
+
+
 @app.route('/thumbnails/small/<path:filename>')
 @permission_required(Permissions.VIEW_FILES)
 def serve_small_thumbnail(filename):
     """Отдает маленькие превью (120x120)"""
-    return serve_thumbnail(filename, app.config['THUMBNAIL_SIZE'])
+    return serve_thumbnail(filename, 'small')
 
 
 @app.route('/thumbnails/medium/<path:filename>')
 @permission_required(Permissions.VIEW_FILES)
 def serve_medium_thumbnail(filename):
     """Отдает средние превью (400x400)"""
-    return serve_thumbnail(filename, app.config['PREVIEW_SIZE'])
+    return serve_thumbnail(filename, 'medium')
 
 
-def serve_thumbnail(filename, size):
-    """Обслуживает миниатюры, создавая их при необходимости"""
-    original_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+def serve_thumbnail(filename, variant):
+    """
+    Обслуживает миниатюры, создавая их при необходимости.
+    Сюда приходят только промахи nginx: готовые превью он отдает сам
+    из <THUMBNAIL_FOLDER>/<variant>/<filename>[.webp|.avif].
+    Формат выбирается по заголовку Accept так же, как в nginx.
+    """
+    original_path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+    if original_path is None:
+        return jsonify({'error': 'File not found'}), 404
 
-    if not os.path.exists(original_path):
+    # Один stat() оригинала: проверка существования и ключ для индекса превью
+    try:
+        original_stat = os.stat(original_path)
+    except OSError:
         return jsonify({'error': 'File not found'}), 404
 
-    thumbnail_path = get_thumbnail_path(original_path, size)
+    fmt = negotiate_format(request.headers.get('Accept'), thumbnail_manager.formats)
+    thumbnail_path = thumbnail_manager.get_thumbnail_path(filename, variant, fmt)
 
-    # Создаем миниатюру если ее нет
-    if not os.path.exists(thumbnail_path):
-        thumbnail_buffer = create_thumbnail(original_path, size)
-        if thumbnail_buffer:
-            with open(thumbnail_path, 'wb') as f:
-                f.write(thumbnail_buffer.getvalue())
-            logger.info(f"Created new thumbnail: {thumbnail_path}")
-        else:
+    # Создаем миниатюру если ее нет (вместе с остальными размерами и форматами за одно декодирование)
+    if not (os.path.exists(thumbnail_path) and thumbnail_manager.is_fresh(original_path, original_stat) is not False):
+        if thumbnail_manager.render(original_path, st=original_stat) is None:
             return send_from_directory('static', 'image-placeholder.png')
+        if not os.path.exists(thumbnail_path):
+            # Дополнительный формат не закодировался: отдаем JPEG
+            fmt = 'jpeg'
+            thumbnail_path = thumbnail_manager.get_thumbnail_path(filename, variant, fmt)
+
+    with open(thumbnail_path, 'rb') as f:
+        data = f.read()
+    return _thumbnail_response(data, hashlib.md5(data).hexdigest(), fmt)
+
+
+def _thumbnail_response(data, etag, fmt='jpeg'):
+    """Ответ с только что созданным превью; поддерживает If-None-Match (304)"""
+    # Имя файла превью совпадает с оригиналом, формат определяется согласованием по Accept
+    response = Response(data, mimetype=THUMBNAIL_FORMATS[fmt][1])
+    response.vary.add('Accept')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response.make_conditional(request)
+
+
+# Варианты изображений заданных размеров для внешних интеграций (публичные, как /images/)
+@app.route('/variants/<size>/<path:filename>')
+def serve_variant(size, filename):
+    """
+    Отдает оригинал, уменьшенный до одного из разрешенных размеров (IMAGE_VARIANT_SIZES).
+    Варианты кэшируются на диске в <THUMBNAIL_FOLDER>/<WxH>/<filename>, откуда
+    их дальше отдает nginx; сюда приходят только промахи.
+    """
+    if size not in app.config['IMAGE_VARIANT_SIZES']:
+        return jsonify({'error': 'Variant size is not allowed'}), 404
+
+    original_path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+    if original_path is None:
+        return jsonify({'error': 'File not found'}), 404
+
+    try:
+        original_stat = os.stat(original_path)
+    except OSError:
+        return jsonify({'error': 'File not found'}), 404
+
+    variant_path = thumbnail_manager.get_thumbnail_path(filename, size)
+    if not (os.path.exists(variant_path) and thumbnail_manager.is_fresh(original_path, original_stat) is not False):
+        IMAGE_VARIANT_RENDERS.labels(size=size).inc()
+        if thumbnail_manager.render(original_path, [size], st=original_stat, formats=['jpeg']) is None:
+            return jsonify({'error': 'Failed to create image variant'}), 500
 
-    return send_from_directory(os.path.dirname(thumbnail_path),
-                               os.path.basename(thumbnail_path))
+    return send_file(variant_path, mimetype='image/jpeg', max_age=30 * 86400, conditional=True)
 
 
 # Маршрут для отдачи оригинальных изображений
@@ -872,20 +1261,16 @@ def api_delete_album(album_name):
 
         # Удаляем файлы и папки
         album_path = os.path.join(app.config['UPLOAD_FOLDER'], album_name)
-        thumbnail_album_path = os.path.join(app.config['THUMBNAIL_FOLDER'], album_name)
 
         # Удаляем файлы изображений
         if os.path.exists(album_path):
             shutil.rmtree(album_path)
             logger.info(f"Deleted album directory: {album_path}")
+        blob_store.sweep()
 
-        # Удаляем превью альбома
+        # Удаляем превью альбома во всех вариантах
         cleanup_album_thumbnails(album_name, app.config['THUMBNAIL_FOLDER'])
-
-        # Удаляем папку превью если осталась
-        if os.path.exists(thumbnail_album_path):
-            shutil.rmtree(thumbnail_album_path)
-            logger.info(f"Deleted album thumbnails directory: {thumbnail_album_path}")
+        thumbnail_manager.forget(album_name)
 
         log_user_action('delete_album', 'album', album_name,
                         {'deleted_files_count': len(filenames) if 'filenames' in locals() else 'unknown'})
@@ -924,16 +1309,15 @@ def api_delete_article(album_name, article_name):
         if os.path.exists(article_path):
             shutil.rmtree(article_path)
             logger.info(f"Deleted article directory: {article_path}")
+        blob_store.sweep()
 
         # Удаляем превью для каждого файла
         for filename in filenames:
             cleanup_file_thumbnails(filename)
+        thumbnail_manager.forget(f"{album_name}/{article_name}")
 
         # Удаляем папку превью артикула если осталась
-        thumbnail_article_path = os.path.join(app.config['THUMBNAIL_FOLDER'], album_name, article_name)
-        if os.path.exists(thumbnail_article_path):
-            shutil.rmtree(thumbnail_article_path)
-            logger.info(f"Deleted article thumbnails directory: {thumbnail_article_path}")
+        cleanup_article_thumbnails(album_name, article_name, app.config['THUMBNAIL_FOLDER'])
 
         log_user_action('delete_article', 'article', f"{album_name}/{article_name}",
                         {'deleted_files_count': len(filenames) if 'filenames' in locals() else 'unknown'})
@@ -1219,6 +1603,9 @@ init_db()
 # Запуск обновления метрик
 start_metrics_updater()
 
+# Запуск сборщика мусора папки превью
+thumbnail_gc.start(app.config['THUMBNAIL_GC_INTERVAL'])
+
 # --- Main ---
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
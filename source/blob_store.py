@@ -0,0 +1,231 @@
+# blob_store.py
+"""
+Хранилище оригиналов по содержимому: каждый файл лежит один раз в
+<UPLOAD_FOLDER>/.blobs/<aa>/<bb>/<sha256>, а в дереве альбомов на него
+ставится жесткая ссылка. Одна и та же фотография в разных альбомах
+занимает место на диске один раз.
+
+Число ссылок из БД хранится в blobs.refcount и поддерживается триггерами
+на таблице files (init.sql), поэтому любое удаление строк учитывается
+автоматически; sweep() удаляет блобы, на которые строк больше нет, а
+sweep_orphans() - файлы блобов без строки blobs и без ссылок в дереве
+альбомов (брошенные прерванными загрузками), старше BLOB_ORPHAN_GRACE.
+
+Файлы в дереве альбомов никогда не перезаписываются на месте (это испортило
+бы общий блоб): новая версия ставится новой ссылкой через os.replace.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import uuid
+
+from database import db_manager
+
+logger = logging.getLogger(__name__)
+
+# Папка блобов внутри UPLOAD_FOLDER (тот же том, иначе жесткие ссылки невозможны)
+BLOB_DIR_NAME = '.blobs'
+BLOB_CHUNK_SIZE = 1024 * 1024
+# Сколько секунд файл без ссылок не трогается сборщиком (дольше самой долгой загрузки)
+BLOB_ORPHAN_GRACE = int(os.environ.get('BLOB_ORPHAN_GRACE', 86400))
+# Хэшей в одном запросе к blobs при поиске брошенных файлов
+BLOB_SWEEP_BATCH = 1000
+
+
+class BlobStore:
+    def __init__(self, upload_folder):
+        self.root = os.path.join(upload_folder, BLOB_DIR_NAME)
+        self.temp_dir = os.path.join(self.root, 'tmp')
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256):
+        return os.path.exists(self.blob_path(sha256))
+
+    def temp_file(self):
+        """Временный файл на томе блобов: (открытый файл, путь)"""
+        os.makedirs(self.temp_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.temp_dir)
+        return os.fdopen(fd, 'wb'), path
+
+    def commit(self, temp_path, sha256, keep=False):
+        """
+        Делает временный файл блобом (если такого еще нет) и удаляет временное имя.
+        С keep=True временный файл остается источником для link(), его освобождает release().
+        """
+        blob_path = self.blob_path(sha256)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        try:
+            # link не перезаписывает: при гонке двух загрузок остается первый блоб
+            os.link(temp_path, blob_path)
+        except FileExistsError:
+            pass
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        if not keep:
+            os.unlink(temp_path)
+        return blob_path
+
+    def release(self, source):
+        """Удаляет источник, оставленный stage_stream() / commit(keep=True)"""
+        try:
+            os.unlink(source)
+        except FileNotFoundError:
+            pass
+
+    def store_stream(self, stream, chunk_size=BLOB_CHUNK_SIZE):
+        """Записывает поток в хранилище, считая SHA-256 по дороге; возвращает хэш"""
+        sha256, source = self.stage_stream(stream, chunk_size)
+        self.release(source)
+        return sha256
+
+    def stage_stream(self, stream, chunk_size=BLOB_CHUNK_SIZE):
+        """
+        Как store_stream(), но оставляет записанную копию во временной папке:
+        возвращает (хэш, источник). Источник передается в link(), если ссылка
+        ставится не сразу - блоб за это время может удалить сборщик.
+        """
+        hasher = hashlib.sha256()
+        dst, temp_path = self.temp_file()
+        try:
+            with dst:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    dst.write(chunk)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        sha256 = hasher.hexdigest()
+        self.commit(temp_path, sha256, keep=True)
+        return sha256, temp_path
+
+    def link(self, sha256, destination, source=None):
+        """
+        Ставит (или атомарно заменяет) файл destination жесткой ссылкой на блоб.
+        Если блоб удалили после commit() (sweep() другой загрузки, discard_if_unlinked()),
+        он восстанавливается из source; без source - FileNotFoundError.
+        """
+        blob_path = self.blob_path(sha256)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        temp_link = f"{destination}.tmp-{uuid.uuid4().hex}"
+        try:
+            os.link(blob_path, temp_link)
+        except FileNotFoundError:
+            if source is None:
+                raise
+            logger.warning(f"Блоб {sha256} удален до постановки ссылки, восстанавливаем из источника")
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            try:
+                os.link(source, blob_path)
+            except FileExistsError:
+                pass
+            os.link(blob_path, temp_link)
+        try:
+            os.replace(temp_link, destination)
+        except BaseException:
+            os.unlink(temp_link)
+            raise
+
+    def discard_if_unlinked(self, sha256):
+        """Удаляет блоб, на который не осталось ссылок в дереве альбомов (откат неудачной загрузки)"""
+        blob_path = self.blob_path(sha256)
+        try:
+            if os.stat(blob_path).st_nlink == 1:
+                os.unlink(blob_path)
+        except FileNotFoundError:
+            pass
+
+    def sweep(self):
+        """Удаляет блобы с нулевым refcount; возвращает их число"""
+        try:
+            results = db_manager.execute_query(
+                "DELETE FROM blobs WHERE refcount <= 0 RETURNING sha256",
+                fetch=True,
+                commit=True
+            )
+        except Exception as e:
+            logger.error(f"Error sweeping blobs: {e}")
+            return 0
+
+        removed = 0
+        for row in results or []:
+            try:
+                os.unlink(self.blob_path(row['sha256']))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        if removed:
+            logger.info(f"🧹 Удалено блобов без ссылок: {removed}")
+        return removed
+
+    def sweep_orphans(self, grace=BLOB_ORPHAN_GRACE):
+        """
+        Удаляет файлы блобов без ссылок в дереве альбомов (st_nlink == 1) и без
+        строки в blobs, а также брошенные временные файлы - остатки прерванных
+        загрузок (убитый воркер). Файл трогается,
+        только если его не меняли и на него не ставили и не снимали ссылок
+        (mtime и ctime) дольше grace секунд. Возвращает число удаленных файлов.
+        """
+        cutoff = time.time() - grace
+        removed = 0
+
+        try:
+            with os.scandir(self.temp_dir) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                            os.unlink(entry.path)
+                            removed += 1
+                    except FileNotFoundError:
+                        pass
+        except FileNotFoundError:
+            pass
+
+        candidates = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                dirnames[:] = [name for name in dirnames if name != os.path.basename(self.temp_dir)]
+            for name in filenames:
+                try:
+                    st = os.lstat(os.path.join(dirpath, name))
+                except FileNotFoundError:
+                    continue
+                if st.st_nlink == 1 and max(st.st_mtime, st.st_ctime) < cutoff:
+                    candidates[name] = st
+
+        hashes = list(candidates)
+        for start in range(0, len(hashes), BLOB_SWEEP_BATCH):
+            batch = hashes[start:start + BLOB_SWEEP_BATCH]
+            try:
+                known = db_manager.execute_query(
+                    "SELECT sha256 FROM blobs WHERE sha256 = ANY(%s)",
+                    (batch,),
+                    fetch=True
+                )
+            except Exception as e:
+                logger.error(f"Error sweeping orphan blobs: {e}")
+                break
+            known = {row['sha256'] for row in known or []}
+            for sha256 in batch:
+                if sha256 in known:
+                    continue
+                blob_path = self.blob_path(sha256)
+                try:
+                    # Проверяем еще раз: за время прохода на блоб могли поставить ссылку
+                    st = os.lstat(blob_path)
+                    if st.st_nlink == 1 and max(st.st_mtime, st.st_ctime) < cutoff:
+                        os.unlink(blob_path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+
+        if removed:
+            logger.info(f"🧹 Удалено брошенных файлов блобов: {removed}")
+        return removed
@@ -2,6 +2,7 @@ import os
 import psycopg2
 from psycopg2.extras import DictCursor, execute_batch
 import logging
+import threading
 import time
 from threading import Lock
 from contextlib import contextmanager
@@ -20,40 +21,45 @@ class DatabaseManager:
 
         self.database_url = f'postgresql://{user}:{password}@{host}:{port}/{db_name}'
 
-        self.conn = None
+        # Соединение у каждого потока свое: commit/rollback одного потока (heartbeat очереди,
+        # фоновые сборщики) не должен завершать открытую транзакцию другого
+        self._local = threading.local()
         self.lock = Lock()
         self.connection_pool = []
         self.max_pool_size = 5
         self.pool_lock = Lock()
-        self.pid = os.getpid()
-        self.last_connection_time = 0
         self.connection_timeout = 300
 
         logger.info(f"🔧 Инициализирован менеджер БД для {host}:{port}")
 
+    @property
+    def conn(self):
+        """Соединение текущего потока"""
+        return getattr(self._local, 'conn', None)
+
     def get_connection(self):
-        """Получение соединения с пулом"""
-        with self.pool_lock:
-            current_pid = os.getpid()
-            current_time = time.time()
-
-            # Если PID изменился (форк) ИЛИ соединение мертво ИЛИ таймаут — пересоздать
-            if (
-                    self.conn is None or
-                    (hasattr(self.conn, 'closed') and self.conn.closed != 0) or
-                    current_pid != self.pid or
-                    current_time - self.last_connection_time > self.connection_timeout
-            ):
-                self._close_connection()
-                self._create_connection()
-                self.pid = current_pid
-
-            return self.conn
+        """Получение соединения текущего потока"""
+        local = self._local
+        current_pid = os.getpid()
+        current_time = time.time()
+
+        # Если PID изменился (форк) ИЛИ соединение мертво ИЛИ таймаут — пересоздать
+        if (
+                self.conn is None or
+                (hasattr(self.conn, 'closed') and self.conn.closed != 0) or
+                current_pid != getattr(local, 'pid', None) or
+                current_time - getattr(local, 'last_connection_time', 0) > self.connection_timeout
+        ):
+            self._close_connection()
+            self._create_connection()
+            local.pid = current_pid
+
+        return self.conn
 
     def _create_connection(self):
         """Создание нового соединения"""
         try:
-            self.conn = psycopg2.connect(
+            conn = psycopg2.connect(
                 self.database_url,
                 cursor_factory=DictCursor,
                 keepalives=1,
@@ -61,8 +67,9 @@ class DatabaseManager:
                 keepalives_interval=10,
                 keepalives_count=5
             )
-            self.conn.autocommit = False
-            self.last_connection_time = time.time()
+            conn.autocommit = False
+            self._local.conn = conn
+            self._local.last_connection_time = time.time()
             logger.info("New database connection created")
         except Exception as e:
             logger.error(f"Failed to create database connection: {e}")
@@ -76,7 +83,7 @@ class DatabaseManager:
                 logger.info("Database connection closed")
             except Exception as e:
                 logger.error(f"Error closing database connection: {e}")
-        self.conn = None
+        self._local.conn = None
 
     def execute_query(self, query, params=None, fetch=False, commit=False):
         """Универсальная функция выполнения запросов с повторными попытками"""
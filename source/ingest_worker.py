@@ -0,0 +1,229 @@
+# ingest_worker.py
+"""
+Воркер очереди загрузки: обрабатывает задачи из таблицы ingest_jobs вне
+веб-процессов gunicorn, поэтому распаковка больших архивов не держит
+sync-воркеры и не упирается в таймаут запроса.
+
+Задачи:
+    zip         - распаковка загруженного архива (ZIP или tar, загруженного формой
+                  или частями) и запись файлов в БД;
+                  после успешной записи ставится задача thumbnails (EAGER_THUMBNAILS)
+    thumbnails  - генерация превью альбома в пуле процессов и спрайтов его артикулов
+
+Запуск (отдельный сервис worker в docker-compose):
+    python ingest_worker.py
+
+Каждый вид задач обрабатывается своим слотом, так что генерация превью
+не задерживает распаковку следующего архива. Для большей пропускной
+способности запускается несколько воркеров: задачи распределяются через
+FOR UPDATE SKIP LOCKED, а задачи zip и thumbnails - через общий бюджет
+загрузок (admission.py), который ограничивает число одновременных
+распаковок и процессов распаковки и генерации превью на все воркеры.
+"""
+import logging
+import os
+import threading
+import time
+
+from job_queue import JOB_KIND_ZIP, JOB_KIND_THUMBNAILS
+from tar_processor import TarProcessor, is_tar_name
+from zip_processor import ArchiveError
+
+logger = logging.getLogger(__name__)
+
+# Интервал опроса очереди, когда задач нет (секунды)
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))
+# Интервал heartbeat выполняющихся задач и время, после которого задача считается брошенной
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_STALE_TIMEOUT = int(os.environ.get('JOB_STALE_TIMEOUT', 600))
+# Порт /metrics воркера (метрики стадий загрузки, см. metrics.py); 0 - не публиковать
+WORKER_METRICS_PORT = int(os.environ.get('WORKER_METRICS_PORT', 9101))
+
+
+class IngestWorker:
+    """
+    Разбирает очередь задач: по потоку-слоту на вид задач плюс поток
+    heartbeat, который продлевает выполняющиеся задачи и возвращает в
+    очередь задачи упавших воркеров.
+    """
+
+    def __init__(self, job_queue, zip_processor, thumbnail_manager, thumbnail_warmup, eager_thumbnails=True,
+                 admission=None):
+        self.queue = job_queue
+        self.admission = admission
+        self.zip_processor = zip_processor
+        self.tar_processor = TarProcessor(zip_processor)
+        self.thumbnail_manager = thumbnail_manager
+        self.thumbnail_warmup = thumbnail_warmup
+        self.eager_thumbnails = eager_thumbnails
+        self.handlers = {
+            JOB_KIND_ZIP: self._run_zip_job,
+            JOB_KIND_THUMBNAILS: self._run_thumbnails_job
+        }
+        self.running_jobs = set()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        """Запускает слоты и блокируется до остановки"""
+        threads = [threading.Thread(target=self._heartbeat_loop, name='jobs-heartbeat', daemon=True)]
+        for kind in self.handlers:
+            threads.append(threading.Thread(target=self._slot_loop, args=(kind,), name=f'jobs-{kind}', daemon=True))
+        for thread in threads:
+            thread.start()
+        logger.info(f"👷 Воркер очереди {self.queue.worker_id} запущен: {', '.join(self.handlers)}")
+        try:
+            while not self.stop_event.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.stop_event.set()
+
+    def _slot_loop(self, kind):
+        while not self.stop_event.is_set():
+            try:
+                if kind == JOB_KIND_ZIP and self.admission:
+                    job = self.admission.claim(self.zip_processor.max_workers)
+                elif kind == JOB_KIND_THUMBNAILS and self.admission:
+                    job = self.admission.claim_thumbnails(self.zip_processor.max_workers)
+                else:
+                    job = self.queue.claim([kind])
+            except Exception as e:
+                logger.error(f"Ошибка получения задачи {kind}: {e}")
+                job = None
+            if not job:
+                self.stop_event.wait(JOB_POLL_INTERVAL)
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        job_id = job['id']
+        with self.lock:
+            self.running_jobs.add(job_id)
+        logger.info(f"▶️ Задача {job['kind']} #{job_id} (попытка {job['attempts']})")
+        try:
+            self.handlers[job['kind']](job)
+        except Exception as e:
+            self.queue.fail(job_id, e)
+        finally:
+            with self.lock:
+                self.running_jobs.discard(job_id)
+
+    def _heartbeat_loop(self):
+        while not self.stop_event.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                with self.lock:
+                    job_ids = list(self.running_jobs)
+                self.queue.heartbeat(job_ids)
+                self.queue.requeue_stale(JOB_STALE_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Ошибка heartbeat очереди: {e}")
+
+    def _run_zip_job(self, job):
+        job_id = job['id']
+        zip_path = job['payload_path']
+        if not zip_path or not os.path.exists(zip_path):
+            self._discard_payload(zip_path)
+            self.queue.fail(job_id, 'Загруженный архив не найден')
+            return
+        if job['payload_size'] is not None and os.path.getsize(zip_path) != job['payload_size']:
+            self._discard_payload(zip_path)
+            self.queue.fail(job_id, 'Размер загруженного архива не совпадает с принятым')
+            return
+
+        def on_progress(stage, **counters):
+            self.queue.update(job_id, stage=stage, **counters)
+
+        definitive = False
+        try:
+            if is_tar_name(job['original_name']):
+                with open(zip_path, 'rb') as stream:
+                    success, result = self.tar_processor.process_stream(stream, job['original_name'], on_progress,
+                                                                        merge=job['mode'] == 'merge')
+            else:
+                success, result = self.zip_processor.process_zip(zip_path, job['original_name'], on_progress,
+                                                                 merge=job['mode'] == 'merge',
+                                                                 max_workers=job.get('workers'))
+        except ArchiveError as e:
+            success, result, definitive = False, str(e), True
+        except Exception as e:
+            success, result = False, str(e)
+
+        # Временную ошибку (БД, диск, упавший пул) повторяем с тем же архивом, пока есть попытки;
+        # после успеха или ошибки в самом архиве он больше не нужен
+        if not success and not definitive and job['attempts'] < self.queue.max_attempts:
+            self.queue.retry(job_id, f'Failed to process ZIP file: {result}')
+            return
+        self._discard_payload(zip_path)
+
+        if not success:
+            self.queue.fail(job_id, f'Failed to process ZIP file: {result}')
+            return
+
+        self.queue.complete(job_id, stage='done', album_name=result)
+        if self.eager_thumbnails:
+            self.queue.enqueue(JOB_KIND_THUMBNAILS, album_name=result,
+                               user={'sub': job['user_id'], 'preferred_username': job['username']})
+
+    @staticmethod
+    def _discard_payload(zip_path):
+        """Удаляет архив задачи из staging после окончательного результата (успех или отказ)"""
+        if not zip_path:
+            return
+        try:
+            os.unlink(zip_path)
+        except OSError:
+            pass
+
+    def _run_thumbnails_job(self, job):
+        job_id = job['id']
+        album_name = job['album_name']
+        original_paths = [os.path.join(self.thumbnail_manager.upload_folder, *filename.split('/'))
+                          for filename in self.thumbnail_warmup.collect(album_name)]
+        self.queue.update(job_id, stage='rendering', files_total=len(original_paths))
+
+        last_update = 0.0
+
+        def on_progress(done, failed):
+            # Прогресс пишется в БД не чаще раза в секунду
+            nonlocal last_update
+            if time.time() - last_update >= 1.0:
+                last_update = time.time()
+                self.queue.update(job_id, files_done=done, files_failed=failed)
+
+        logger.info(f"🖼️ Генерация превью для альбома '{album_name}': {len(original_paths)} файлов")
+        # Размер пула выделен бюджетом загрузок при получении задачи (admission.claim_thumbnails)
+        max_workers = job.get('workers') or self.zip_processor.max_workers
+        done, failed = self.thumbnail_manager.generate_batch(original_paths, max_workers=max_workers,
+                                                             progress_callback=on_progress)
+
+        # Спрайты артикулов (/api/sprites) собираются из только что созданных маленьких превью
+        # Превью готовы, поэтому задача завершается успешно; несобранные спрайты видны в error
+        self.queue.update(job_id, stage='sprites', files_done=done, files_failed=failed)
+        error = None
+        try:
+            sprites, sprites_failed = self.thumbnail_manager.build_album_sprites(album_name)
+            logger.info(f"🧩 Спрайты альбома '{album_name}': {sprites}, не собрано: {sprites_failed}")
+            if sprites_failed:
+                error = f'Не удалось собрать спрайты {sprites_failed} артикулов'
+        except Exception as e:
+            logger.error(f"Error building sprites for album {album_name}: {e}")
+            error = f'Ошибка сборки спрайтов: {e}'
+        self.queue.complete(job_id, stage='done', files_done=done, files_failed=failed, error=error)
+
+
+def main():
+    # Конфигурация, папки и менеджеры - те же, что у веб-приложения
+    from app import app, job_queue, zip_processor, thumbnail_manager, thumbnail_warmup, ingest_admission
+
+    if WORKER_METRICS_PORT:
+        from prometheus_client import start_http_server
+        start_http_server(WORKER_METRICS_PORT)
+        logger.info(f"📈 Метрики воркера на порту {WORKER_METRICS_PORT}")
+
+    worker = IngestWorker(job_queue, zip_processor, thumbnail_manager, thumbnail_warmup,
+                          eager_thumbnails=app.config['EAGER_THUMBNAILS'], admission=ingest_admission)
+    worker.run()
+
+
+if __name__ == '__main__':
+    main()
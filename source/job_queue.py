@@ -0,0 +1,204 @@
+# job_queue.py
+import logging
+import os
+import socket
+
+from database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# Виды задач очереди
+JOB_KIND_ZIP = 'zip'
+JOB_KIND_THUMBNAILS = 'thumbnails'
+
+# Колонки задачи, которые отдаются в API
+JOB_FIELDS = ('id', 'kind', 'mode', 'status', 'stage', 'original_name', 'album_name', 'username', 'payload_size',
+              'files_total', 'files_extracted', 'files_inserted', 'files_unchanged', 'files_removed',
+              'files_done', 'files_failed', 'error', 'attempts', 'created_at', 'started_at', 'finished_at',
+              'unpacked_size', 'workers')
+
+# Ключ pg_advisory_xact_lock (вместе с hashtext альбома) для постановки задач альбома без дублей
+JOB_ENQUEUE_LOCK = 0x1A6E5702
+
+# Режимы обработки ZIP: merge - инкрементальное обновление альбома, replace - полная замена
+JOB_MODES = ('merge', 'replace')
+
+
+class JobQueue:
+    """
+    Очередь фоновых задач в таблице ingest_jobs.
+
+    Задачи забираются воркерами через FOR UPDATE SKIP LOCKED: несколько
+    процессов (и контейнеров) разбирают очередь, не блокируя друг друга.
+    Работающий воркер периодически обновляет heartbeat_at; задачи, чей
+    воркер пропал, возвращаются в очередь (requeue_stale).
+
+    У очереди свой DatabaseManager, а у него - свое соединение в каждом
+    потоке (слоты и heartbeat воркера), поэтому обновления прогресса и
+    heartbeat не фиксируют и не откатывают чужие транзакции, в том числе
+    решение о допуске под pg_advisory_xact_lock (admission.py).
+    """
+
+    def __init__(self, max_attempts=3, db=None):
+        self.max_attempts = max_attempts
+        self.db = db or DatabaseManager()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def enqueue(self, kind, original_name=None, payload_path=None, payload_digest=None, album_name=None, user=None,
+                mode='merge', unpacked_size=None):
+        """
+        Ставит задачу в очередь и возвращает ее id.
+        payload_digest - {'size', 'sha256', 'crc32'} принятого файла (см. upload_staging.StagingFile),
+        mode - режим обработки ZIP (JOB_MODES), unpacked_size - объем после распаковки (admission.py)
+        """
+        user = user or {}
+        payload_digest = payload_digest or {}
+        result = self.db.execute_query(
+            """INSERT INTO ingest_jobs (kind, mode, original_name, payload_path, payload_size, payload_sha256,
+                                        payload_crc32, unpacked_size, album_name, user_id, username)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
+            (kind, mode, original_name, payload_path, payload_digest.get('size'), payload_digest.get('sha256'),
+             payload_digest.get('crc32'), unpacked_size, album_name,
+             user.get('sub'), user.get('preferred_username') or user.get('email')),
+            fetch=True,
+            commit=True
+        )
+        job_id = result[0]['id']
+        logger.info(f"📥 Задача {kind} #{job_id} поставлена в очередь ({original_name or album_name})")
+        return job_id
+
+    def enqueue_unless_recent(self, kind, album_name, interval, user=None):
+        """
+        Ставит задачу альбома, если такой задачи нет в очереди, она не выполняется и не
+        завершалась за последние interval секунд. Проверка и вставка идут под блокировкой
+        альбома, поэтому одновременные запросы не ставят задачу дважды.
+        Возвращает {'id', 'status', 'created'}: новую задачу или уже существующую.
+        """
+        user = user or {}
+        with self.db.transaction() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (JOB_ENQUEUE_LOCK, album_name))
+            cursor.execute(
+                """SELECT id, status FROM ingest_jobs
+                   WHERE kind = %s AND album_name = %s
+                     AND (status IN ('queued', 'running')
+                          OR finished_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+                   ORDER BY created_at DESC, id DESC LIMIT 1""",
+                (kind, album_name, interval)
+            )
+            existing = cursor.fetchone()
+            if existing:
+                return dict(existing, created=False)
+            cursor.execute(
+                """INSERT INTO ingest_jobs (kind, album_name, user_id, username)
+                   VALUES (%s, %s, %s, %s) RETURNING id, status""",
+                (kind, album_name, user.get('sub'), user.get('preferred_username') or user.get('email'))
+            )
+            job = dict(cursor.fetchone(), created=True)
+        logger.info(f"📥 Задача {kind} #{job['id']} поставлена в очередь ({album_name})")
+        return job
+
+    def claim(self, kinds):
+        """Забирает самую старую задачу из очереди; None, если задач нет (задачи zip - IngestAdmission.claim)"""
+        result = self.db.execute_query(
+            """UPDATE ingest_jobs
+               SET status = 'running', stage = NULL, attempts = attempts + 1, worker = %s,
+                   started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP
+               WHERE id = (
+                   SELECT id FROM ingest_jobs
+                   WHERE status = 'queued' AND kind = ANY(%s)
+                   ORDER BY created_at, id
+                   FOR UPDATE SKIP LOCKED
+                   LIMIT 1
+               )
+               RETURNING *""",
+            (self.worker_id, list(kinds)),
+            fetch=True,
+            commit=True
+        )
+        return result[0] if result else None
+
+    def update(self, job_id, finished=False, **fields):
+        """Обновляет стадию и счетчики задачи (заодно продлевает heartbeat)"""
+        columns = [column for column in fields if column in JOB_FIELDS]
+        assignments = ''.join(f", {column} = %s" for column in columns)
+        if finished:
+            assignments += ", finished_at = CURRENT_TIMESTAMP"
+        self.db.execute_query(
+            f"UPDATE ingest_jobs SET heartbeat_at = CURRENT_TIMESTAMP{assignments} WHERE id = %s",
+            tuple(fields[column] for column in columns) + (job_id,),
+            commit=True
+        )
+
+    def heartbeat(self, job_ids):
+        """Продлевает heartbeat выполняющихся задач"""
+        if job_ids:
+            self.db.execute_query(
+                "UPDATE ingest_jobs SET heartbeat_at = CURRENT_TIMESTAMP WHERE id = ANY(%s)",
+                (list(job_ids),),
+                commit=True
+            )
+
+    def complete(self, job_id, **fields):
+        self.update(job_id, finished=True, status='completed', **fields)
+
+    def fail(self, job_id, error):
+        logger.error(f"❌ Задача #{job_id} завершилась ошибкой: {error}")
+        self.update(job_id, finished=True, status='failed', error=str(error))
+
+    def retry(self, job_id, error):
+        """Возвращает задачу в очередь после временной ошибки; ошибка остается видна в статусе"""
+        logger.warning(f"🔁 Задача #{job_id} возвращена в очередь: {error}")
+        self.db.execute_query(
+            """UPDATE ingest_jobs SET status = 'queued', stage = NULL, worker = NULL, error = %s,
+                      heartbeat_at = CURRENT_TIMESTAMP
+               WHERE id = %s""",
+            (str(error), job_id),
+            commit=True
+        )
+
+    def get(self, job_id):
+        """Задача по id (словарь полей JOB_FIELDS) или None"""
+        result = self.db.execute_query(
+            f"SELECT {', '.join(JOB_FIELDS)} FROM ingest_jobs WHERE id = %s",
+            (job_id,),
+            fetch=True
+        )
+        return result[0] if result else None
+
+    def latest(self, kind, album_name):
+        """Последняя задача данного вида для альбома"""
+        result = self.db.execute_query(
+            f"""SELECT {', '.join(JOB_FIELDS)} FROM ingest_jobs
+                WHERE kind = %s AND album_name = %s
+                ORDER BY created_at DESC, id DESC LIMIT 1""",
+            (kind, album_name),
+            fetch=True
+        )
+        return result[0] if result else None
+
+    def requeue_stale(self, timeout):
+        """
+        Возвращает в очередь задачи, воркер которых не обновлял heartbeat дольше timeout секунд.
+        Задачи, исчерпавшие попытки, помечаются как failed. Возвращает число затронутых задач.
+        """
+        result = self.db.execute_query(
+            """WITH stale AS (
+                   SELECT id, attempts >= %s AS exhausted
+                   FROM ingest_jobs
+                   WHERE status = 'running' AND heartbeat_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+               )
+               UPDATE ingest_jobs j
+               SET status = CASE WHEN s.exhausted THEN 'failed' ELSE 'queued' END,
+                   error = CASE WHEN s.exhausted THEN 'Воркер прервался, попытки исчерпаны' ELSE j.error END,
+                   finished_at = CASE WHEN s.exhausted THEN CURRENT_TIMESTAMP ELSE NULL END,
+                   worker = NULL
+               FROM stale s
+               WHERE j.id = s.id
+               RETURNING j.id, j.status""",
+            (self.max_attempts, timeout),
+            fetch=True,
+            commit=True
+        )
+        for row in result or []:
+            logger.warning(f"⚠️ Задача #{row['id']} без heartbeat: {row['status']}")
+        return len(result or [])
@@ -1,10 +1,13 @@
 """Модуль для работы с метриками приложения"""
 
 import os
+import re
 import shutil
+import threading
+import time
 import psutil
 from datetime import datetime
-from prometheus_client import Gauge, generate_latest, CollectorRegistry, multiprocess
+from prometheus_client import Gauge, Counter, Histogram, generate_latest, CollectorRegistry, multiprocess
 import logging
 from database import db_manager
 
@@ -65,6 +68,178 @@ MEMORY_USED = Gauge('memory_bytes_used', 'Used physical memory in bytes')
 MEMORY_FREE = Gauge('memory_bytes_free', 'Free physical memory in bytes')
 MEMORY_PERCENT = Gauge('memory_percent_used', 'Percentage of used memory')
 
+# Варианты изображений /variants/<WxH>/: готовые отдает nginx, до приложения доходят только промахи,
+# которые рендерятся здесь. Попадания считаются по variants_access.log nginx (VariantAccessLog)
+IMAGE_VARIANT_RENDERS = Counter(
+    'image_variant_renders_total',
+    'Image variants rendered by the app on an nginx cache miss',
+    ['size']
+)
+IMAGE_VARIANT_HITS = Counter(
+    'image_variant_hits_total',
+    'Image variants served by nginx from the disk cache (parsed from variants_access.log)',
+    ['size']
+)
+
+# Метрики сборщика мусора папки превью (накопленные значения из файла состояния сборщика)
+THUMBNAIL_GC_RECLAIMED_BYTES = Gauge(
+    'thumbnail_gc_reclaimed_bytes',
+    'Disk bytes reclaimed by the thumbnail garbage collector',
+    ['reason']
+)
+THUMBNAIL_GC_REMOVED_FILES = Gauge(
+    'thumbnail_gc_removed_files',
+    'Files removed by the thumbnail garbage collector',
+    ['reason']
+)
+THUMBNAIL_GC_LAST_RUN_SECONDS = Gauge(
+    'thumbnail_gc_last_run_duration_seconds',
+    'Duration of the last thumbnail garbage collector run'
+)
+THUMBNAIL_GC_LAST_RUN_TIMESTAMP = Gauge(
+    'thumbnail_gc_last_run_timestamp_seconds',
+    'Start time of the last thumbnail garbage collector run'
+)
+THUMBNAIL_CACHE_DISK_BYTES = Gauge(
+    'thumbnail_cache_disk_bytes',
+    'Disk bytes used by thumbnails after the last garbage collector run'
+)
+
+# Метрики загрузки архивов (воркер очереди).
+# Стадии: receive - чтение и распаковка tar, analyze - имя альбома, валидация и сравнение с БД,
+# extract - распаковка ZIP, link - ссылки tar в дереве альбома, insert - транзакция БД,
+# finalize - превью измененных файлов и очистка блобов
+INGEST_STAGE_SECONDS = Histogram(
+    'ingest_stage_duration_seconds',
+    'Duration of each archive ingestion stage',
+    ['format', 'stage'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+INGEST_DURATION_SECONDS = Histogram(
+    'ingest_duration_seconds',
+    'Total archive ingestion time',
+    ['format', 'mode'],
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+)
+INGEST_ARCHIVES = Counter(
+    'ingest_archives_total',
+    'Ingested archives by outcome',
+    ['format', 'mode', 'result']
+)
+INGEST_ARCHIVE_FILES = Histogram(
+    'ingest_archive_files',
+    'Image files per successfully ingested archive',
+    ['format'],
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+)
+INGEST_FILES = Counter(
+    'ingest_files_total',
+    'Image files handled during ingestion by outcome (written, unchanged, removed)',
+    ['format', 'outcome']
+)
+INGEST_BYTES_IN = Counter(
+    'ingest_bytes_in_total',
+    'Archive bytes read for ingestion',
+    ['format']
+)
+INGEST_BYTES_OUT = Counter(
+    'ingest_bytes_out_total',
+    'Uncompressed image bytes written to albums',
+    ['format']
+)
+# Занятость пула распаковки ZIP: время работы процессов над срезами / (процессы * длительность)
+INGEST_WORKER_UTILIZATION = Histogram(
+    'ingest_worker_utilization_ratio',
+    'Share of time extraction pool processes were busy during an ingestion',
+    ['format'],
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0)
+)
+
+
+class IngestMetrics:
+    """
+    Замер одной загрузки архива: stage(name) закрывает предыдущую стадию и начинает
+    следующую, update() принимает счетчики прогресса, finish() публикует итог.
+    """
+
+    def __init__(self, archive_format, mode):
+        self.format = archive_format
+        self.mode = mode
+        self.start = self.stage_start = time.perf_counter()
+        self.current_stage = None
+        self.counters = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # Заполняется, только если распаковка шла в пуле процессов
+        self.worker_utilization = None
+
+    def stage(self, name):
+        now = time.perf_counter()
+        if self.current_stage:
+            INGEST_STAGE_SECONDS.labels(self.format, self.current_stage).observe(now - self.stage_start)
+        self.current_stage, self.stage_start = name, now
+
+    def update(self, **counters):
+        self.counters.update(counters)
+
+    def finish(self, success):
+        self.stage(None)
+        INGEST_DURATION_SECONDS.labels(self.format, self.mode).observe(time.perf_counter() - self.start)
+        INGEST_ARCHIVES.labels(self.format, self.mode, 'success' if success else 'failure').inc()
+        INGEST_BYTES_IN.labels(self.format).inc(self.bytes_in)
+        if not success:
+            return
+        INGEST_ARCHIVE_FILES.labels(self.format).observe(self.counters.get('files_total', 0))
+        INGEST_BYTES_OUT.labels(self.format).inc(self.bytes_out)
+        if self.worker_utilization is not None:
+            INGEST_WORKER_UTILIZATION.labels(self.format).observe(self.worker_utilization)
+        for outcome, key in (('written', 'files_inserted'), ('unchanged', 'files_unchanged'),
+                             ('removed', 'files_removed')):
+            INGEST_FILES.labels(self.format, outcome).inc(self.counters.get(key, 0))
+
+
+class VariantAccessLog:
+    """
+    Считает попадания в кэш вариантов по логу nginx: в variants_access.log пишутся только
+    ответы с диска (промах уходит в приложение, и запрос логируется в общий лог сервера).
+    export() дочитывает строки, появившиеся с прошлого вызова; после ротации лога чтение
+    начинается сначала нового файла. Каждый процесс читает лог сам, поэтому счетчик в
+    процессе - число попаданий в логе с момента его запуска (первый вызов читает весь файл).
+    """
+
+    LINE_PATTERN = re.compile(rb'"[A-Z]+ /variants/(\d+x\d+)/[^"]*" (\d{3}) ')
+
+    def __init__(self, path):
+        self.path = path
+        self.inode = None
+        self.offset = 0
+        self.lock = threading.Lock()
+
+    def export(self):
+        """Переносит новые строки лога в IMAGE_VARIANT_HITS"""
+        with self.lock:
+            try:
+                stat = os.stat(self.path)
+                if stat.st_ino != self.inode or stat.st_size < self.offset:
+                    self.inode, self.offset = stat.st_ino, 0
+                with open(self.path, 'rb') as log:
+                    log.seek(self.offset)
+                    data = log.read()
+            except OSError as e:
+                logger.debug(f"Лог вариантов {self.path} недоступен: {e}")
+                return
+
+            # Незаконченную последнюю строку дочитаем в следующий раз
+            complete = data.rfind(b'\n') + 1
+            self.offset += complete
+            hits = {}
+            for match in self.LINE_PATTERN.finditer(data, 0, complete):
+                if match.group(2) in (b'200', b'304'):
+                    size = match.group(1).decode()
+                    hits[size] = hits.get(size, 0) + 1
+            for size, count in hits.items():
+                IMAGE_VARIANT_HITS.labels(size=size).inc(count)
+
 
 def update_metrics(start_time=None):
     """Обновление метрик на основе текущего состояния системы. 
@@ -505,6 +505,176 @@ function hideLoadingOverlay() {
     }
 }
 
+// --- Ожидание задачи очереди загрузки ---
+const JOB_STAGE_LABELS = {
+    extracting: 'Распаковываем файлы',
+    inserting: 'Сохраняем ссылки',
+    inserted: 'Сохраняем ссылки'
+};
+
+function describeJob(job) {
+    if (job.status === 'queued') {
+        return 'Архив в очереди на обработку...';
+    }
+    const label = JOB_STAGE_LABELS[job.stage] || 'Обрабатываем архив';
+    if (job.files_total) {
+        const done = job.stage === 'inserted' ? job.files_inserted : job.files_extracted;
+        return `${label}: ${done} из ${job.files_total}`;
+    }
+    return `${label}...`;
+}
+
+/**
+ * Опрашивает /api/jobs/<id>, пока задача не завершится, и показывает прогресс в оверлее.
+ * Возвращает завершенную задачу; при ошибке задачи - исключение с ее текстом.
+ */
+async function waitForJob(jobId, interval = 1000) {
+    while (true) {
+        const response = await apiFetch(`/api/jobs/${jobId}`);
+        if (!response) {
+            throw new Error('Сессия истекла');
+        }
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        const job = await response.json();
+        if (job.status === 'completed') {
+            return job;
+        }
+        if (job.status === 'failed') {
+            throw new Error(job.error || 'Ошибка обработки архива');
+        }
+        showLoadingOverlay('Обработка архива...', describeJob(job));
+        await new Promise(resolve => setTimeout(resolve, interval));
+    }
+}
+
+// --- Возобновляемая загрузка частями ---
+// Архивы больше порога отправляются частями параллельно: обрыв связи стоит одной части, а не всей загрузки
+const CHUNKED_UPLOAD_THRESHOLD = 64 * 1024 * 1024;
+const CHUNK_UPLOAD_CONCURRENCY = 4;
+const CHUNK_UPLOAD_RETRIES = 5;
+const ARCHIVE_NAME_PATTERN = /\.(zip|tar|tgz|tar\.gz)$/i;
+const TAR_NAME_PATTERN = /\.(tar|tgz|tar\.gz)$/i;
+
+function uploadSessionKey(file) {
+    return `upload:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function uploadJson(url, options = {}) {
+    const response = await apiFetch(url, options);
+    if (!response) {
+        const error = new Error('Сессия истекла');
+        error.status = 401;
+        throw error;
+    }
+    const data = await response.json().catch(() => ({}));
+    if (!response.ok) {
+        const error = new Error(data.error || `HTTP ${response.status}`);
+        error.status = response.status;
+        throw error;
+    }
+    return data;
+}
+
+async function sha256Hex(buffer) {
+    // crypto.subtle есть только в защищенном контексте (HTTPS); без него сумму части считает только сервер
+    if (!window.crypto || !window.crypto.subtle) {
+        return null;
+    }
+    const digest = await window.crypto.subtle.digest('SHA-256', buffer);
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function openUploadSession(file) {
+    // Сессия того же файла продолжается, если сервер ее еще хранит
+    const savedId = localStorage.getItem(uploadSessionKey(file));
+    if (savedId) {
+        try {
+            const upload = await uploadJson(`/api/uploads/${savedId}`);
+            if (upload.status === 'open') {
+                return upload;
+            }
+        } catch (error) {
+            console.warn('Upload session is not resumable, starting over:', error.message);
+        }
+    }
+    const upload = await uploadJson('/api/uploads', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({filename: file.name, size: file.size})
+    });
+    localStorage.setItem(uploadSessionKey(file), upload.id);
+    return upload;
+}
+
+async function putChunk(upload, file, index) {
+    const offset = index * upload.chunk_size;
+    const buffer = await file.slice(offset, Math.min(offset + upload.chunk_size, file.size)).arrayBuffer();
+    const checksum = await sha256Hex(buffer);
+    const headers = {'Content-Type': 'application/octet-stream'};
+    if (checksum) {
+        headers['X-Chunk-Sha256'] = checksum;
+    }
+    for (let attempt = 1; ; attempt++) {
+        try {
+            return await uploadJson(`/api/uploads/${upload.id}/chunks/${offset}`, {
+                method: 'PUT',
+                headers,
+                body: buffer
+            });
+        } catch (error) {
+            // Ошибки сети, 5xx и поврежденная по дороге часть (422) повторяются, остальные - нет
+            const retriable = !error.status || error.status >= 500 || error.status === 422;
+            if (!retriable || attempt >= CHUNK_UPLOAD_RETRIES) {
+                throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, Math.min(30000, 1000 * 2 ** attempt)));
+        }
+    }
+}
+
+/**
+ * Загружает файл частями, по CHUNK_UPLOAD_CONCURRENCY параллельно, и ставит архив в очередь.
+ * Недостающие части ранее начатой сессии дозагружаются (id сессии хранится в localStorage).
+ * onProgress(loaded, total) вызывается после каждой части. Возвращает ответ /complete.
+ */
+async function uploadChunked(file, onProgress) {
+    const upload = await openUploadSession(file);
+    const received = new Set(upload.chunks_received);
+    const pending = [];
+    for (let index = 0; index < upload.chunks_total; index++) {
+        if (!received.has(index)) {
+            pending.push(index);
+        }
+    }
+
+    let loaded = Math.min(received.size * upload.chunk_size, file.size);
+    onProgress(loaded, file.size);
+
+    let failure = null;
+    const worker = async () => {
+        while (pending.length && !failure) {
+            const index = pending.shift();
+            try {
+                const result = await putChunk(upload, file, index);
+                loaded = Math.min(loaded + result.size, file.size);
+                onProgress(loaded, file.size);
+            } catch (error) {
+                failure = failure || error;
+            }
+        }
+    };
+    await Promise.all(Array.from({length: CHUNK_UPLOAD_CONCURRENCY}, worker));
+    if (failure) {
+        throw failure;
+    }
+
+    const data = await uploadJson(`/api/uploads/${upload.id}/complete`, {method: 'POST'});
+    localStorage.removeItem(uploadSessionKey(file));
+    return data;
+}
+
 // --- Функция обновления UI ---
 function updateUI() {
     if (!zipFileInput || !dropArea || !uploadBtn) {
@@ -519,7 +689,7 @@ function updateUI() {
             uploadBtn.disabled = false;
         }
     } else {
-        dropArea.innerHTML = `<p>Перетащите ZIP-архив сюда</p><p>или</p><button type="button" class="btn" id="browseBtn">Выбрать файл</button>`;
+        dropArea.innerHTML = `<p>Перетащите ZIP- или tar-архив сюда</p><p>или</p><button type="button" class="btn" id="browseBtn">Выбрать файл</button>`;
         uploadBtn.disabled = true;
     }
 }
@@ -705,8 +875,69 @@ function clearLinkList() {
     }
 }
 
+// --- Плейсхолдер превью из строки файла: сетка 4x4 средних цветов (4 бита на канал) ---
+const PLACEHOLDER_GRID = 4;
+
+function decodePlaceholder(placeholder) {
+    if (!placeholder) return null;
+    try {
+        const bytes = Uint8Array.from(atob(placeholder), c => c.charCodeAt(0));
+        const nibble = i => ((bytes[i >> 1] >> ((i & 1) ? 0 : 4)) & 15) * 17;
+
+        const canvas = document.createElement('canvas');
+        canvas.width = PLACEHOLDER_GRID;
+        canvas.height = PLACEHOLDER_GRID;
+        const ctx = canvas.getContext('2d');
+        const pixels = ctx.createImageData(PLACEHOLDER_GRID, PLACEHOLDER_GRID);
+        for (let cell = 0; cell < PLACEHOLDER_GRID * PLACEHOLDER_GRID; cell++) {
+            pixels.data[cell * 4] = nibble(cell * 3);
+            pixels.data[cell * 4 + 1] = nibble(cell * 3 + 1);
+            pixels.data[cell * 4 + 2] = nibble(cell * 3 + 2);
+            pixels.data[cell * 4 + 3] = 255;
+        }
+        ctx.putImageData(pixels, 0, 0);
+        // Браузер растягивает 4x4 со сглаживанием - получается размытое превью
+        return canvas.toDataURL();
+    } catch (error) {
+        console.warn('Invalid placeholder:', error);
+        return null;
+    }
+}
+
+// --- Спрайт превью артикула: одна картинка вместо запроса на каждый файл ---
+async function loadArticleSprite(albumName, articleName) {
+    try {
+        const response = await apiFetch(`/api/sprites/${encodeURIComponent(albumName)}/${encodeURIComponent(articleName)}`);
+        // 202 - спрайт еще собирается в очереди: пока показываем превью по одному
+        if (!response || response.status !== 200) return null;
+        return await response.json();
+    } catch (error) {
+        console.warn('Sprite unavailable, falling back to per-file thumbnails:', error);
+        return null;
+    }
+}
+
+// Плитка из спрайта с поведением object-fit: cover в квадрате размером size
+function createSpriteTile(sprite, tile, placeholderUrl = null, size = 60) {
+    const [x, y, w, h] = tile;
+    const scale = size / Math.min(w, h);
+
+    const div = document.createElement('div');
+    div.className = 'sprite-tile';
+    div.style.backgroundImage = `url("${sprite.sprite_url}")`;
+    div.style.backgroundSize = `${sprite.width * scale}px ${sprite.height * scale}px`;
+    div.style.backgroundPosition = `${-(x * scale + (w * scale - size) / 2)}px ${-(y * scale + (h * scale - size) / 2)}px`;
+    if (placeholderUrl) {
+        // Плейсхолдер нижним слоем виден, пока грузится спрайт
+        div.style.backgroundImage += `, url("${placeholderUrl}")`;
+        div.style.backgroundSize += ', 100% 100%';
+        div.style.backgroundPosition += ', 0 0';
+    }
+    return div;
+}
+
 // --- Создание элемента списка файлов с превью ---
-function createFileListItem(item, parentElement) {
+function createFileListItem(item, parentElement, sprite = null) {
     const li = document.createElement('li');
     li.className = 'link-item';
 
@@ -724,20 +955,27 @@ function createFileListItem(item, parentElement) {
     const previewDiv = document.createElement('div');
     previewDiv.className = 'link-preview';
 
-    const img = document.createElement('img');
-    img.className = 'lazy-image';
-    img.width = PREVIEW_CONFIG.thumbnail.width;
-    img.height = PREVIEW_CONFIG.thumbnail.height;
+    const placeholderUrl = decodePlaceholder(fileData.placeholder);
+    const spriteTile = sprite && sprite.tiles ? sprite.tiles[fileData.filename] : null;
+    const img = spriteTile ? createSpriteTile(sprite, spriteTile, placeholderUrl) : document.createElement('img');
+    if (spriteTile) {
+        img.title = Path.basename(fileData.filename);
+        img.addEventListener('click', () => showPreviewModal(fileData));
+    } else {
+        img.className = 'lazy-image';
+        img.width = PREVIEW_CONFIG.thumbnail.width;
+        img.height = PREVIEW_CONFIG.thumbnail.height;
 
-    img.src = 'data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iNjAiIGhlaWdodD0iNjAiIHZpZXdCb3g9IjAgMCA2MCA2MCIgZmlsbD0ibm9uZSIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj4KPHJlY3Qgd2lkdGg9IjYwIiBoZWlnaHQ9IjYwIiBmaWxsPSIjRjFGNUY5Ii8+CjxwYXRoIGQ9Ik0zNi41IDI0LjVIMjMuNVYzNy41SDM2LjVWMjQuNVoiIGZpbGw9IiNEOEUxRTYiLz4KPHBhdGggZD0iTTI1IDI2SDM1VjI5SDI1VjI2WiIgZmlsbD0iI0Q4RTFFNiIvPgo8cGF0aCBkPSJNMjUgMzFIMzJWMzRIMjVWMzFaIiBmaWxsPSIjRDhFMUU2Ii8+Cjwvc3ZnPg==';
-    img.setAttribute('data-src', fileData.thumbnail_url);
-    img.alt = Path.basename(fileData.filename);
+        img.src = placeholderUrl || 'data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iNjAiIGhlaWdodD0iNjAiIHZpZXdCb3g9IjAgMCA2MCA2MCIgZmlsbD0ibm9uZSIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj4KPHJlY3Qgd2lkdGg9IjYwIiBoZWlnaHQ9IjYwIiBmaWxsPSIjRjFGNUY5Ii8+CjxwYXRoIGQ9Ik0zNi41IDI0LjVIMjMuNVYzNy41SDM2LjVWMjQuNVoiIGZpbGw9IiNEOEUxRTYiLz4KPHBhdGggZD0iTTI1IDI2SDM1VjI5SDI1VjI2WiIgZmlsbD0iI0Q4RTFFNiIvPgo8cGF0aCBkPSJNMjUgMzFIMzJWMzRIMjVWMzFaIiBmaWxsPSIjRDhFMUU2Ii8+Cjwvc3ZnPg==';
+        img.setAttribute('data-src', fileData.thumbnail_url);
+        img.alt = Path.basename(fileData.filename);
 
-    img.addEventListener('click', () => showPreviewModal(fileData));
+        img.addEventListener('click', () => showPreviewModal(fileData));
 
-    img.onerror = function() {
-        this.src = 'data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iNjAiIGhlaWdodD0iNjAiIHZpZXdCb3g9IjAgMCA2MCA2MCIgZmlsbD0ibm9uZSIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj4KPHJlY3Qgd2lkdGg9IjYwIiBoZWlnaHQ9IjYwIiBmaWxsPSIjRjFGNUY5Ii8+CjxwYXRoIGQ9Ik0zNi41IDI0LjVIMjMuNVYzNy41SDM2LjVWMjQuNVoiIGZpbGw9IiNEOEUxRTYiLz4KPHBhdGggZD0iTTI1IDI2SDM1VjI5SDI1VjI2WiIgZmlsbD0iI0Q4RTFFNiIvPgo8cGF0aCBkPSJNMjUgMzFIMzJWMzRIMjVWMzFaIiBmaWxsPSIjRDhFMUU2Ii8+Cjwvc3ZnPg==';
-    };
+        img.onerror = function() {
+            this.src = 'data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iNjAiIGhlaWdodD0iNjAiIHZpZXdCb3g9IjAgMCA2MCA2MCIgZmlsbD0ibm9uZSIgeG1sbnM9Imh0dHA6Ly93d3cudzMub3JnLzIwMDAvc3ZnIj4KPHJlY3Qgd2lkdGg9IjYwIiBoZWlnaHQ9IjYwIiBmaWxsPSIjRjFGNUY5Ii8+CjxwYXRoIGQ9Ik0zNi41IDI0LjVIMjMuNVYzNy41SDM2LjVWMjQuNVoiIGZpbGw9IiNEOEUxRTYiLz4KPHBhdGggZD0iTTI1IDI2SDM1VjI5SDI1VjI2WiIgZmlsbD0iI0Q4RTFFNiIvPgo8cGF0aCBkPSJNMjUgMzFIMzJWMzRIMjVWMzFaIiBmaWxsPSIjRDhFMUU2Ii8+Cjwvc3ZnPg==';
+        };
+    }
 
     const urlDiv = document.createElement('div');
     urlDiv.className = 'link-url';
@@ -756,7 +994,8 @@ function createFileListItem(item, parentElement) {
 
     const fileInfo = document.createElement('div');
     fileInfo.className = 'file-info';
-    fileInfo.textContent = `${Path.basename(fileData.filename)} • ${formatFileSize(fileData.file_size || 0)}`;
+    fileInfo.textContent = `${Path.basename(fileData.filename)} • ${formatFileSize(fileData.file_size || 0)}`
+        + (fileData.width && fileData.height ? ` • ${fileData.width}×${fileData.height}` : '');
 
     urlDiv.appendChild(urlInput);
     previewDiv.appendChild(img);
@@ -766,7 +1005,9 @@ function createFileListItem(item, parentElement) {
     li.appendChild(fileInfo);
     parentElement.appendChild(li);
 
-    lazyLoader.observe(img);
+    if (!spriteTile) {
+        lazyLoader.observe(img);
+    }
 }
 
 // --- Модальное окно для просмотра полноразмерного изображения ---
@@ -839,23 +1080,32 @@ async function showFilesForAlbum(albumName, articleName = '') {
     await updateTitleWithCount(albumName, articleName);
 
     try {
-        let url;
-        if (articleName) {
-            url = `/api/thumbnails/${encodeURIComponent(albumName)}/${encodeURIComponent(articleName)}`;
+        // Для артикула список файлов приходит вместе с картой спрайта:
+        // два запроса (карта и картинка спрайта) вместо запроса на каждое превью
+        const sprite = articleName ? await loadArticleSprite(albumName, articleName) : null;
+        let files;
+
+        if (sprite) {
+            files = sprite.files;
         } else {
-            url = `/api/thumbnails/${encodeURIComponent(albumName)}`;
-        }
+            let url;
+            if (articleName) {
+                url = `/api/thumbnails/${encodeURIComponent(albumName)}/${encodeURIComponent(articleName)}`;
+            } else {
+                url = `/api/thumbnails/${encodeURIComponent(albumName)}`;
+            }
 
-        console.log('Fetching URL:', url);
+            console.log('Fetching URL:', url);
 
-        const response = await apiFetch(url);
-        if (!response) return; // Проверка на null в случае 401
-        
-        if (!response.ok) {
-            throw new Error(`HTTP ${response.status}: ${response.statusText}`);
-        }
+            const response = await apiFetch(url);
+            if (!response) return; // Проверка на null в случае 401
+
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+            }
 
-        const files = await response.json();
+            files = await response.json();
+        }
         console.log('Received files:', files);
 
         if (!files || files.length === 0) {
@@ -879,7 +1129,7 @@ async function showFilesForAlbum(albumName, articleName = '') {
             });
 
             files.forEach(item => {
-                createFileListItem(item, linkList);
+                createFileListItem(item, linkList, sprite);
             });
         } else {
             const groupedFiles = {};
@@ -1323,11 +1573,11 @@ document.addEventListener('DOMContentLoaded', function() {
 
     dropArea.addEventListener('drop', (e) => {
         const file = e.dataTransfer.files[0];
-        if (file && file.name.toLowerCase().endsWith('.zip')) {
+        if (file && ARCHIVE_NAME_PATTERN.test(file.name)) {
             droppedFile = file;
             updateUI();
         } else {
-            alert('Пожалуйста, выберите ZIP-архив.');
+            alert('Пожалуйста, выберите ZIP- или tar-архив.');
         }
     });
 
@@ -1385,18 +1635,62 @@ document.addEventListener('DOMContentLoaded', function() {
              return;
         }
         const file = droppedFile || zipFileInput.files[0];
-        if (!file || !file.name.toLowerCase().endsWith('.zip')) {
-            alert('Пожалуйста, выберите ZIP-архив.');
+        if (!file || !ARCHIVE_NAME_PATTERN.test(file.name)) {
+            alert('Пожалуйста, выберите ZIP- или tar-архив.');
             return;
         }
-
-        const formData = new FormData();
-        formData.append('zipfile', file, file.name);
+        const isTar = TAR_NAME_PATTERN.test(file.name);
 
         progressContainer.style.display = 'block';
         uploadBtn.disabled = true;
         uploadBtn.innerHTML = '<span>Загрузка...</span>';
 
+        // Архив принят и поставлен в очередь: ждем распаковки и показываем альбом
+        const onQueued = (data) => {
+            // ОЧИСТКА ФОРМЫ И СБРОС СОСТОЯНИЯ
+            zipFileInput.value = '';
+            droppedFile = null;
+            updateUI(); // Это вызовет сброс кнопки к неактивному состоянию
+
+            // Архив распаковывается воркером очереди, ждем завершения задачи
+            waitForJob(data.job_id).then(job => {
+                let albumName = job.album_name || file.name.replace(ARCHIVE_NAME_PATTERN, '');
+                currentAlbumName = albumName;
+
+                showLoadingOverlay('Завершение', 'Всё готово! Обновляем список файлов...');
+                loadAlbums();
+                return showFilesForAlbum(albumName).then(() => {
+                    setTimeout(() => {
+                        hideLoadingOverlay();
+                    }, 500);
+                });
+            }).catch(error => {
+                console.error('Upload job failed:', error);
+                hideLoadingOverlay();
+                alert(`Ошибка обработки архива: ${error.message}`);
+            });
+        };
+
+        // Большие архивы - частями, с дозагрузкой после обрыва
+        if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+            uploadChunked(file, (loaded, total) => {
+                const percentComplete = (loaded / total) * 100;
+                progressBar.style.width = percentComplete + '%';
+                progressText.textContent = Math.round(percentComplete) + '%';
+            }).then(data => {
+                progressContainer.style.display = 'none';
+                onQueued(data);
+            }).catch(error => {
+                console.error('Chunked upload failed:', error);
+                progressContainer.style.display = 'none';
+                hideLoadingOverlay();
+                alert(`Ошибка загрузки: ${error.message}. Повторная отправка того же файла продолжит загрузку.`);
+                uploadBtn.disabled = false;
+                uploadBtn.innerHTML = '<span>Загрузить архив</span>';
+            });
+            return;
+        }
+
         const xhr = new XMLHttpRequest();
 
         xhr.upload.addEventListener('progress', (e) => {
@@ -1409,7 +1703,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 if (percentComplete > 95) {
                     showLoadingOverlay(
                         'Загрузка завершена.',
-                        'Распаковываем файлы и создаем ссылки. Это может занять несколько минут...'
+                        'Передаем архив на обработку...'
                     );
                 }
             }
@@ -1426,25 +1720,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 try {
                     const data = JSON.parse(xhr.responseText);
                     if (!data.error) {
-                        let albumName = data.album_name || file.name.replace(/\.zip$/i, '');
-                        currentAlbumName = albumName;
-
-                        showLoadingOverlay('Завершение', 'Всё готово!', 'Обновляем список файлов...');
-
-                        setTimeout(() => {
-                            showFilesForAlbum(albumName).then(() => {
-                                setTimeout(() => {
-                                    hideLoadingOverlay();
-                                }, 500);
-                            });
-                        }, 1000);
-
-                        // ОЧИСТКА ФОРМЫ И СБРОС СОСТОЯНИЯ
-                        zipFileInput.value = '';
-                        droppedFile = null;
-                        updateUI(); // Это вызовет сброс кнопки к неактивному состоянию
-
-                        loadAlbums();
+                        onQueued(data);
                     } else {
                         console.error('Upload failed:', data.error);
                         hideLoadingOverlay();
@@ -1464,7 +1740,14 @@ document.addEventListener('DOMContentLoaded', function() {
             } else {
                 console.error('Upload failed with status:', xhr.status);
                 hideLoadingOverlay();
-                alert(`Ошибка загрузки: HTTP ${xhr.status}`);
+                // Например, 507: архив не поместится на диск после распаковки
+                let message = `HTTP ${xhr.status}`;
+                try {
+                    message = JSON.parse(xhr.responseText).error || message;
+                } catch (error) {
+                    // Ответ не JSON (ошибка nginx)
+                }
+                alert(`Ошибка загрузки: ${message}`);
                 // В случае ошибки тоже сбрасываем состояние
                 uploadBtn.disabled = false;
                 uploadBtn.innerHTML = '<span>Загрузить архив</span>';
@@ -1480,8 +1763,18 @@ document.addEventListener('DOMContentLoaded', function() {
             uploadBtn.innerHTML = '<span>Загрузить архив</span>';
         });
 
-        xhr.open('POST', '/upload');
-        xhr.send(formData);
+        if (isTar) {
+            // tar идет телом запроса и ставится в очередь, как ZIP
+            xhr.open('POST', '/upload/tar');
+            xhr.setRequestHeader('X-Filename', encodeURIComponent(file.name));
+            xhr.setRequestHeader('Content-Type', 'application/x-tar');
+            xhr.send(file);
+        } else {
+            const formData = new FormData();
+            formData.append('zipfile', file, file.name);
+            xhr.open('POST', '/upload');
+            xhr.send(formData);
+        }
     });
 
 
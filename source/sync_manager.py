@@ -1,9 +1,10 @@
 # sync_manager.py
 import os
 import logging
+from datetime import datetime
 from urllib.parse import quote
 from database import db_manager
-from utils import safe_folder_name, cleanup_file_thumbnails
+from utils import safe_folder_name, cleanup_file_thumbnails, read_image_info
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +27,8 @@ class SyncManager:
         fs_files = {}
 
         for root, dirs, files in os.walk(self.upload_folder):
+            # Служебные папки (.blobs - хранилище оригиналов) не относятся к альбомам
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
             for file in files:
                 _, ext = os.path.splitext(file.lower())
                 if ext in self.allowed_extensions:
@@ -64,14 +67,15 @@ class SyncManager:
         Получает все файлы из базы данных
         """
         db_files_result = db_manager.execute_query(
-            "SELECT filename, album_name, article_number, public_link FROM files",
+            "SELECT filename, album_name, article_number, public_link, file_mtime IS NULL AS missing_info FROM files",
             fetch=True
         )
 
         return {row['filename']: {
             'album_name': row['album_name'],
             'article_number': row['article_number'],
-            'public_link': row['public_link']
+            'public_link': row['public_link'],
+            'missing_info': row['missing_info']
         } for row in db_files_result} if db_files_result else {}
 
     def sync(self):
@@ -87,9 +91,13 @@ class SyncManager:
             # Находим различия
             files_to_delete = set(db_files.keys()) - set(fs_files.keys())
             files_to_add = set(fs_files.keys()) - set(db_files.keys())
+            # Строки, записанные до появления сведений об изображении, дополняются с диска
+            files_to_describe = [rel_path for rel_path, info in db_files.items()
+                                 if info['missing_info'] and rel_path in fs_files]
 
             # Подготавливаем операции для транзакции
             operations = self._prepare_operations(files_to_delete, files_to_add, fs_files)
+            operations += self._describe_operations(files_to_describe)
 
             # Выполняем операции в транзакции
             if operations:
@@ -126,16 +134,41 @@ class SyncManager:
                     file_info['album_name'],
                     file_info['article_number'],
                     file_info['public_link']
-                ))
+                ) + self._read_file_info(rel_path))
 
             insert_query = """
-                INSERT INTO files (filename, album_name, article_number, public_link) 
-                VALUES (%s, %s, %s, %s)
+                INSERT INTO files (filename, album_name, article_number, public_link,
+                                   file_size, width, height, image_format, file_mtime) 
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
             """
             operations.append((insert_query, insert_data, True))  # True для executemany
 
         return operations
 
+    def _describe_operations(self, rel_paths):
+        """Операция, дописывающая размер, разрешение, формат и время изменения в существующие строки"""
+        if not rel_paths:
+            return []
+        update_data = []
+        for rel_path in rel_paths:
+            file_size, width, height, image_format, mtime = self._read_file_info(rel_path)
+            update_data.append((file_size, width, height, image_format, mtime, rel_path))
+        update_query = """
+            UPDATE files SET file_size = COALESCE(file_size, %s), width = %s, height = %s,
+                             image_format = %s, file_mtime = %s
+            WHERE filename = %s
+        """
+        return [(update_query, update_data, True)]
+
+    def _read_file_info(self, rel_path):
+        """(размер, ширина, высота, формат, время изменения) файла альбома; размеры - из заголовка"""
+        full_path = os.path.join(self.upload_folder, *rel_path.split('/'))
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return None, None, None, None, None
+        return (stat.st_size,) + read_image_info(full_path) + (datetime.fromtimestamp(stat.st_mtime),)
+
     def _cleanup_thumbnails(self, files_to_delete):
         """
         Очищает превью для удаленных файлов
@@ -165,6 +198,7 @@ class SyncManager:
             # Статистика по файлам в файловой системе
             fs_files_count = 0
             for root, dirs, files in os.walk(self.upload_folder):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
                 for file in files:
                     _, ext = os.path.splitext(file.lower())
                     if ext in self.allowed_extensions:
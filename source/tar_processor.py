@@ -0,0 +1,193 @@
+# tar_processor.py
+"""
+Загрузка альбомов из tar и tar.gz потоком.
+
+В отличие от ZIP, у tar нет центрального каталога в конце файла: записи
+идут подряд, поэтому каждую можно обработать, как только она пришла.
+Содержимое сразу пишется в хранилище блобов (имя блоба - хэш, от альбома
+не зависит), а когда поток кончился и известен полный список файлов,
+альбом определяется так же, как для ZIP, и файлы ставятся в дерево
+альбомов жесткими ссылками - это операции с метаданными без копирования.
+Воркер очереди читает архив из staging за один проход.
+"""
+import logging
+import os
+import tarfile
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+from metrics import IngestMetrics
+from utils import read_image_info
+from zip_processor import ArchiveError
+
+logger = logging.getLogger(__name__)
+
+# Расширения tar-архивов (сжатие определяется по содержимому)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz')
+
+# Как часто сообщать прогресс распаковки (записей)
+TAR_PROGRESS_EVERY = 100
+
+# Запись tar с полями, которые ZipProcessor читает у ZipInfo (CRC, file_size) при слиянии альбома,
+# и сведениями об изображении для строки files
+TarEntry = namedtuple('TarEntry', 'filename CRC file_size sha256 width height image_format mtime source')
+
+
+def is_tar_name(filename):
+    return bool(filename) and filename.lower().endswith(TAR_EXTENSIONS)
+
+
+class _CountingReader:
+    """Считает байты, прочитанные из staging-файла"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class _Crc32Reader:
+    """Читает поток записи и считает ее CRC32 (нужен для инкрементального обновления альбома)"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.crc32 = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        return data
+
+
+class TarProcessor:
+    """Потоковая загрузка tar поверх ZipProcessor: те же альбомы, артикулы, слияние и запись в БД"""
+
+    def __init__(self, zip_processor):
+        self.zip_processor = zip_processor
+        self.blob_store = zip_processor.blob_store
+
+    def process_stream(self, stream, original_name=None, progress_callback=None, merge=False):
+        """
+        Обрабатывает tar (в том числе сжатый) по мере чтения stream.
+        Возвращает (True, имя альбома) или (False, ошибка) и бросает ArchiveError, как
+        ZipProcessor.process_zip; progress_callback получает те же стадии и счетчики.
+        """
+        metrics = IngestMetrics('tar', 'merge' if merge else 'replace')
+
+        def report(stage, **counters):
+            metrics.update(**counters)
+            if progress_callback:
+                try:
+                    progress_callback(stage, **counters)
+                except Exception as e:
+                    logger.warning(f"Ошибка обновления прогресса tar: {e}")
+
+        logger.info(f"🚀 Начинаем потоковую обработку tar: {original_name}")
+        start_time = time.time()
+        processor = self.zip_processor
+
+        all_files = []
+        entries = []
+        source = _CountingReader(stream)
+        succeeded = False
+        metrics.stage('receive')
+        try:
+            with tarfile.open(fileobj=source, mode='r|*') as archive:
+                for member in archive:
+                    # Ссылки и устройства не распаковываем; '.' и '..' в путях отбрасываем, как для ZIP
+                    name = '/'.join(part for part in member.name.split('/') if part not in ('', '.', '..'))
+                    if not member.isfile() or not name:
+                        continue
+                    all_files.append(name)
+                    if not processor._is_image_path(name):
+                        continue
+
+                    reader = _Crc32Reader(archive.extractfile(member))
+                    # Копия записи остается источником до постановки ссылок: блоб, который уже
+                    # был в хранилище, может удалить сборщик, пока принимается остальной архив
+                    sha256, blob_source = self.blob_store.stage_stream(reader)
+                    # Заголовок только что записанного файла читается из page cache
+                    entries.append(TarEntry(name, reader.crc32, member.size, sha256,
+                                            *read_image_info(blob_source),
+                                            datetime.fromtimestamp(member.mtime), blob_source))
+                    if len(entries) % TAR_PROGRESS_EVERY == 0:
+                        report('extracting', files_extracted=len(entries))
+        except (tarfile.TarError, EOFError, zlib.error) as e:
+            logger.error(f"❌ Ошибка чтения tar {original_name}: {e}")
+            self._discard(entries)
+            metrics.bytes_in = source.bytes_read
+            metrics.finish(False)
+            raise ArchiveError(f"Некорректный tar-архив: {e}") from e
+        except OSError as e:
+            # Обрыв приема или ошибка записи на диск, а не дефект архива
+            logger.error(f"❌ Ошибка чтения tar {original_name}: {e}")
+            self._discard(entries)
+            metrics.bytes_in = source.bytes_read
+            metrics.finish(False)
+            return False, f"Ошибка чтения tar-архива: {e}"
+
+        receive_time = time.time() - start_time
+        metrics.bytes_in = source.bytes_read
+        metrics.stage('analyze')
+        try:
+            is_valid, validation_error = processor._validate_paths(all_files)
+            if not is_valid:
+                self._discard(entries)
+                raise ArchiveError(validation_error)
+
+            album_name = processor._album_name_from_paths(all_files, original_name or 'tar_album', original_name)
+            # Итоговые пути - как у ZIP; при повторе пути в tar действует последняя запись
+            planned = {}
+            for entry in entries:
+                destination = processor._plan_destination(entry.filename, album_name)
+                if destination:
+                    planned[destination[0]] = (entry,) + destination
+            full_plan = list(planned.values())
+            plan, existing, removed = processor._diff_plan(full_plan, album_name, merge)
+            report('extracting', album_name=album_name, files_total=len(full_plan),
+                   files_unchanged=len(full_plan) - len(plan), files_removed=len(removed),
+                   files_extracted=len(entries))
+
+            metrics.stage('link')
+            files_to_insert = []
+            for entry, relative_path, article_number in plan:
+                self.blob_store.link(entry.sha256, os.path.join(processor.upload_folder, *relative_path.split('/')),
+                                     entry.source)
+                files_to_insert.append((relative_path, album_name, article_number,
+                                        processor._public_link(relative_path),
+                                        entry.CRC, entry.file_size, entry.sha256,
+                                        entry.width, entry.height, entry.image_format, entry.mtime))
+
+            db_success = processor._commit_album(album_name, files_to_insert, existing, removed, report, metrics)
+            metrics.bytes_out = sum(f[5] for f in files_to_insert)
+            # Блобы файлов без изменений (и дубликатов внутри архива) без ссылок не нужны
+            self._discard(entries)
+
+            logger.info(f"✅ tar обработан за {time.time() - start_time:.2f}s (прием и распаковка "
+                        f"{receive_time:.2f}s): {len(files_to_insert)} файлов записано в альбом '{album_name}'")
+            if not db_success:
+                return False, "Ошибка записи файлов в базу данных"
+            succeeded = True
+            return True, album_name
+
+        except ArchiveError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки tar {original_name}: {e}")
+            self._discard(entries)
+            return False, str(e)
+        finally:
+            metrics.finish(succeeded)
+
+    def _discard(self, entries):
+        """Освобождает источники записей и удаляет блобы, на которые не поставлено ни одной ссылки"""
+        for entry in entries:
+            self.blob_store.release(entry.source)
+        for sha256 in {entry.sha256 for entry in entries}:
+            self.blob_store.discard_if_unlinked(sha256)
@@ -0,0 +1,273 @@
+# thumbnail_gc.py
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+from metrics import (THUMBNAIL_GC_RECLAIMED_BYTES, THUMBNAIL_GC_REMOVED_FILES, THUMBNAIL_GC_LAST_RUN_SECONDS,
+                     THUMBNAIL_GC_LAST_RUN_TIMESTAMP, THUMBNAIL_CACHE_DISK_BYTES)
+from thumbnail_manager import SPRITE_LAYER, THUMBNAIL_FORMAT_SUFFIXES, publish_file
+from utils import thumbnail_layers
+
+logger = logging.getLogger(__name__)
+
+# Причины удаления превью (значения метки reason в метриках)
+GC_REASONS = ('orphan', 'evicted', 'temp')
+
+
+class ThumbnailGarbageCollector:
+    """
+    Сборщик мусора папки превью с бюджетом по размеру.
+
+    За один проход:
+    - удаляет превью и спрайты, оригиналы которых больше не существуют;
+    - удаляет брошенные временные файлы атомарной записи (.tmp-*);
+    - если кэш превышает бюджет, вытесняет давно не читавшиеся превью
+      (LRU по atime) до low_watermark от бюджета.
+
+    Если передано хранилище блобов, после прохода по превью оно удаляет
+    брошенные прерванными загрузками файлы блобов (BlobStore.sweep_orphans).
+
+    Удаление идет пачками по batch_size файлов с паузой между ними, чтобы
+    не мешать отдаче превью. Проход выполняет только один процесс (flock),
+    итоги сохраняются в файл состояния, из которого метрики читают все воркеры.
+
+    atime обновляется с точностью relatime (не чаще раза в сутки), поэтому
+    LRU здесь - порядок "давно не открывали", а не точный.
+    """
+
+    def __init__(self, upload_folder, thumbnail_folder, max_bytes, batch_size=500, batch_pause=0.05,
+                 low_watermark=0.9, temp_max_age=3600, blob_store=None):
+        self.upload_folder = upload_folder
+        self.thumbnail_folder = thumbnail_folder
+        # 0 - без бюджета: удаляются только сироты и временные файлы
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.low_watermark = low_watermark
+        self.temp_max_age = temp_max_age
+        self.blob_store = blob_store
+        self.state_path = os.path.join(thumbnail_folder, '.gc-state.json')
+        self.thread = None
+
+    def _original_path(self, layer_name, rel_parts):
+        """Оригинал превью; для спрайта - папка артикула"""
+        if layer_name == SPRITE_LAYER:
+            return os.path.join(self.upload_folder, *rel_parts[:-1])
+        return os.path.join(self.upload_folder, *rel_parts)
+
+    @staticmethod
+    def _listing(cache, directory):
+        """Имена в папке оригиналов (один listdir на папку за проход); None если папки нет"""
+        if directory not in cache:
+            try:
+                cache[directory] = set(os.listdir(directory))
+            except (FileNotFoundError, NotADirectoryError):
+                cache[directory] = None
+        return cache[directory]
+
+    def _scan(self):
+        """Обходит слои превью, отдает (path, layer_name, rel_parts, stat) для каждого файла"""
+        for layer in thumbnail_layers(self.thumbnail_folder):
+            layer_name = os.path.basename(layer)
+            stack = [(layer, [])]
+            while stack:
+                directory, parts = stack.pop()
+                try:
+                    entries = list(os.scandir(directory))
+                except FileNotFoundError:
+                    continue
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((entry.path, parts + [entry.name]))
+                        elif entry.is_file(follow_symlinks=False):
+                            yield entry.path, layer_name, parts + [entry.name], entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+
+    def _is_orphan(self, layer_name, rel_parts, listings):
+        original = self._original_path(layer_name, rel_parts)
+        if layer_name == SPRITE_LAYER:
+            parent, name = os.path.split(original)
+        else:
+            parent, name = os.path.dirname(original), rel_parts[-1]
+        names = self._listing(listings, parent)
+        if names is None:
+            return True
+        # Превью в WebP/AVIF лежат рядом с JPEG с суффиксом формата: <file>.webp
+        return not any(name.endswith(suffix) and name[:len(name) - len(suffix)] in names
+                       for suffix in THUMBNAIL_FORMAT_SUFFIXES)
+
+    def _delete(self, victims, stats):
+        """Удаляет файлы пачками; victims - список (path, size, reason)"""
+        for start in range(0, len(victims), self.batch_size):
+            for path, size, reason in victims[start:start + self.batch_size]:
+                # Оригинал мог появиться после чтения папки (идет распаковка архива)
+                if reason == 'orphan' and self._original_exists(path):
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    logger.warning(f"GC failed to remove {path}: {e}")
+                    continue
+                stats['removed'][reason] += 1
+                stats['reclaimed'][reason] += size
+            time.sleep(self.batch_pause)
+
+    def _original_exists(self, path):
+        """Существует ли оригинал файла превью (с учетом суффикса формата)"""
+        original = self._original_path(*self._split(path))
+        return any(os.path.exists(original[:len(original) - len(suffix)])
+                   for suffix in THUMBNAIL_FORMAT_SUFFIXES if original.endswith(suffix))
+
+    def _split(self, path):
+        """Путь превью -> (layer_name, rel_parts)"""
+        parts = os.path.relpath(path, self.thumbnail_folder).split(os.sep)
+        return parts[0], parts[1:]
+
+    def _remove_orphan_dirs(self, directories):
+        """Удаляет опустевшие папки превью, у которых нет папки оригиналов"""
+        for directory in sorted(directories, key=lambda d: d.count(os.sep), reverse=True):
+            while os.path.dirname(directory) != self.thumbnail_folder.rstrip(os.sep):
+                _, rel_parts = self._split(directory)
+                if os.path.isdir(os.path.join(self.upload_folder, *rel_parts)):
+                    break
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break
+                directory = os.path.dirname(directory)
+
+    def run(self):
+        """
+        Один проход сборщика. Возвращает статистику прохода
+        или None, если проход уже выполняет другой процесс.
+        """
+        lock_dir = os.path.join(self.thumbnail_folder, '.locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        fd = os.open(os.path.join(lock_dir, 'gc.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info("Thumbnail GC is already running in another process")
+                return None
+            stats = self._run_locked()
+            if self.blob_store:
+                self.blob_store.sweep_orphans()
+            return stats
+        finally:
+            os.close(fd)
+
+    def _run_locked(self):
+        start_time = time.time()
+        stats = {
+            'removed': dict.fromkeys(GC_REASONS, 0),
+            'reclaimed': dict.fromkeys(GC_REASONS, 0)
+        }
+        listings = {}
+        victims = []
+        orphan_dirs = set()
+        survivors = []
+        total_bytes = 0
+
+        for path, layer_name, rel_parts, st in self._scan():
+            # Место на диске, а не логический размер: мелкие превью занимают целый блок
+            size = st.st_blocks * 512 if hasattr(st, 'st_blocks') else st.st_size
+
+            if rel_parts[-1].startswith('.tmp-'):
+                if start_time - st.st_mtime > self.temp_max_age:
+                    victims.append((path, size, 'temp'))
+                continue
+
+            if self._is_orphan(layer_name, rel_parts, listings):
+                victims.append((path, size, 'orphan'))
+                orphan_dirs.add(os.path.dirname(path))
+                continue
+
+            survivors.append((st.st_atime, size, path))
+            total_bytes += size
+
+        if self.max_bytes and total_bytes > self.max_bytes:
+            target = self.max_bytes * self.low_watermark
+            survivors.sort()
+            for atime, size, path in survivors:
+                if total_bytes <= target:
+                    break
+                victims.append((path, size, 'evicted'))
+                total_bytes -= size
+
+        self._delete(victims, stats)
+        self._remove_orphan_dirs(orphan_dirs)
+
+        stats['cache_bytes'] = total_bytes
+        stats['duration'] = time.time() - start_time
+        self._save_state(stats, start_time)
+
+        logger.info(
+            f"🧹 Thumbnail GC: {sum(stats['removed'].values())} files, "
+            f"{sum(stats['reclaimed'].values()) / 1024 / 1024:.1f} MB reclaimed "
+            f"(orphan {stats['removed']['orphan']}, evicted {stats['removed']['evicted']}, "
+            f"temp {stats['removed']['temp']}), cache {total_bytes / 1024 / 1024:.1f} MB, "
+            f"{stats['duration']:.2f}s"
+        )
+        return stats
+
+    def load_state(self):
+        """Накопленные итоги сборщика из файла состояния"""
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self, stats, start_time):
+        state = self.load_state() or {}
+        for key, per_reason in (('removed_files', stats['removed']), ('reclaimed_bytes', stats['reclaimed'])):
+            totals = state.get(key, {})
+            state[key] = {reason: totals.get(reason, 0) + per_reason[reason] for reason in GC_REASONS}
+        state.update({
+            'cache_bytes': stats['cache_bytes'],
+            'max_bytes': self.max_bytes,
+            'last_run_started': start_time,
+            'last_run_seconds': stats['duration']
+        })
+        try:
+            publish_file(self.state_path, json.dumps(state).encode('utf-8'))
+        except OSError as e:
+            logger.warning(f"Failed to save thumbnail GC state: {e}")
+        self.export_metrics(state)
+
+    def export_metrics(self, state=None):
+        """Переносит итоги сборщика в метрики Prometheus текущего процесса"""
+        state = state or self.load_state()
+        if not state:
+            return
+        for reason in GC_REASONS:
+            THUMBNAIL_GC_RECLAIMED_BYTES.labels(reason=reason).set(state['reclaimed_bytes'].get(reason, 0))
+            THUMBNAIL_GC_REMOVED_FILES.labels(reason=reason).set(state['removed_files'].get(reason, 0))
+        THUMBNAIL_GC_LAST_RUN_SECONDS.set(state['last_run_seconds'])
+        THUMBNAIL_GC_LAST_RUN_TIMESTAMP.set(state['last_run_started'])
+        THUMBNAIL_CACHE_DISK_BYTES.set(state['cache_bytes'])
+
+    def start(self, interval, initial_delay=60):
+        """Запускает периодические проходы в фоновом потоке"""
+        if self.thread and self.thread.is_alive():
+            return
+
+        def gc_loop():
+            time.sleep(initial_delay)
+            while True:
+                try:
+                    self.run()
+                except Exception as e:
+                    logger.error(f"Error in thumbnail GC loop: {e}")
+                time.sleep(interval)
+
+        self.thread = threading.Thread(target=gc_loop, daemon=True)
+        self.thread.start()
@@ -0,0 +1,645 @@
+# thumbnail_manager.py
+import base64
+import fcntl
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image, features
+
+from database import db_manager
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при хэшировании оригинала (файл не читается в память целиком)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def generate_image_hash(file_path):
+    """Генерирует MD5 содержимого файла, читая его блоками"""
+    try:
+        md5 = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                md5.update(chunk)
+        return md5.hexdigest()
+    except Exception as e:
+        logger.error(f"Error generating hash for {file_path}: {e}")
+        return hashlib.md5(file_path.encode()).hexdigest()
+
+
+# Количество файлов блокировок генерации превью (ключи распределяются по ним хэшем)
+RENDER_LOCK_STRIPES = 1024
+# Сколько ждать чужую генерацию того же превью, прежде чем рендерить самим
+RENDER_LOCK_TIMEOUT = 60
+
+# Папка спрайтов артикулов в THUMBNAIL_FOLDER и вариант превью, из которого они собираются
+SPRITE_LAYER = 'sprites'
+SPRITE_VARIANT = 'small'
+
+# Запас разрешения при DCT-масштабировании JPEG (как reducing_gap в Image.thumbnail)
+DRAFT_REDUCING_GAP = 2.0
+
+# Сетка плейсхолдера (LQIP): средние цвета ячеек 4x4, по 4 бита на канал
+PLACEHOLDER_GRID = 4
+
+
+def compute_placeholder(image):
+    """
+    Плейсхолдер изображения: сетка PLACEHOLDER_GRID x PLACEHOLDER_GRID средних цветов.
+    Каждый канал квантуется до 4 бит, полубайты упаковываются попарно:
+    16 ячеек * 3 канала = 24 байта, в base64 - 32 символа.
+    """
+    grid = PLACEHOLDER_GRID
+    if image.width < grid or image.height < grid:
+        image = image.resize((max(image.width, grid), max(image.height, grid)))
+
+    pixels = np.asarray(image.convert('RGB'), dtype=np.float32)
+    height, width = pixels.shape[0] // grid * grid, pixels.shape[1] // grid * grid
+    cells = pixels[:height, :width].reshape(grid, height // grid, grid, width // grid, 3).mean(axis=(1, 3))
+
+    nibbles = np.clip(np.rint(cells / 17), 0, 15).astype(np.uint8).ravel()
+    packed = (nibbles[0::2] << 4) | nibbles[1::2]
+    return base64.b64encode(packed.tobytes()).decode('ascii')
+
+
+
+# Форматы превью: имя -> (формат Pillow, MIME-тип, суффикс файла, параметры кодирования).
+# JPEG лежит по пути URL без суффикса, остальные форматы - рядом с суффиксом (<file>.webp)
+THUMBNAIL_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', '', {'quality': 85, 'optimize': True}),
+    'webp': ('WEBP', 'image/webp', '.webp', {'quality': 80, 'method': 4}),
+    'avif': ('AVIF', 'image/avif', '.avif', {'quality': 60, 'speed': 8}),
+}
+# Суффиксы файлов превью всех форматов
+THUMBNAIL_FORMAT_SUFFIXES = tuple(suffix for _, _, suffix, _ in THUMBNAIL_FORMATS.values())
+# Порядок предпочтения при согласовании по Accept (JPEG - всегда запасной вариант)
+FORMAT_PREFERENCE = ('avif', 'webp')
+
+
+def supported_formats(names):
+    """Оставляет известные форматы, поддерживаемые сборкой Pillow; JPEG есть всегда"""
+    formats = ['jpeg']
+    for name in names:
+        name = name.strip().lower()
+        if not name or name in formats:
+            continue
+        if name not in THUMBNAIL_FORMATS or not features.check(name):
+            logger.warning(f"Thumbnail format {name} is not supported and will not be used")
+            continue
+        formats.append(name)
+    return formats
+
+
+def negotiate_format(accept_header, formats):
+    """
+    Выбирает формат превью по заголовку Accept.
+    Проверка - вхождение MIME-типа, как в map $http_accept в nginx.conf,
+    чтобы Flask и nginx выбирали один и тот же файл.
+    """
+    accept_header = accept_header or ''
+    for name in FORMAT_PREFERENCE:
+        if name in formats and THUMBNAIL_FORMATS[name][1] in accept_header:
+            return name
+    return 'jpeg'
+
+
+def encode_thumbnails(original_path, sizes, formats=('jpeg',), quality=None, placeholder=False):
+    """
+    Создает миниатюры нескольких размеров и форматов за одно декодирование оригинала.
+
+    JPEG декодируется через draft() сразу с уменьшением (1/2, 1/4, 1/8) до
+    разрешения, достаточного для наибольшего размера. Меньшие размеры
+    получаются каскадом из предыдущего промежуточного изображения, каждый
+    размер кодируется во все запрошенные форматы.
+    Возвращает ({(size, format): bytes}, плейсхолдер или None); при ошибке - ({}, None).
+    Ошибка кодирования дополнительного формата (WebP, AVIF) пропускает только его.
+    quality переопределяет качество JPEG.
+    """
+    sizes = sorted(set(tuple(size) for size in sizes), key=lambda s: s[0] * s[1], reverse=True)
+    if not sizes:
+        return {}, None
+
+    try:
+        encoded = {}
+        with Image.open(original_path) as img:
+            largest = sizes[0]
+            if img.format == 'JPEG':
+                img.draft(None, (int(largest[0] * DRAFT_REDUCING_GAP), int(largest[1] * DRAFT_REDUCING_GAP)))
+
+            frame = img.convert('RGB') if img.mode in ('RGBA', 'P') else img
+
+            for size in sizes:
+                # thumbnail() работает на месте: каждый следующий размер берется из предыдущего
+                frame.thumbnail(size, Image.Resampling.LANCZOS)
+
+                for name in formats:
+                    pillow_format, _, _, options = THUMBNAIL_FORMATS[name]
+                    if name == 'jpeg' and quality is not None:
+                        options = dict(options, quality=quality)
+                    buffer = io.BytesIO()
+                    try:
+                        frame.save(buffer, pillow_format, **options)
+                    except Exception as e:
+                        if name == 'jpeg':
+                            raise
+                        logger.warning(f"Error encoding {name} thumbnail {size} for {original_path}: {e}")
+                        continue
+                    encoded[(size, name)] = buffer.getvalue()
+
+            return encoded, compute_placeholder(frame) if placeholder else None
+    except Exception as e:
+        logger.error(f"Error creating thumbnails for {original_path}: {e}")
+        return {}, None
+
+
+def create_thumbnails(original_path, sizes, quality=85):
+    """
+    Создает JPEG-миниатюры нескольких размеров за одно декодирование оригинала.
+    Возвращает словарь {size: BytesIO}; при ошибке - пустой словарь.
+    """
+    encoded, _ = encode_thumbnails(original_path, sizes, quality=quality)
+    return {size: io.BytesIO(data) for (size, _), data in encoded.items()}
+
+
+def create_thumbnail(original_path, size, quality=85):
+    """Создает миниатюру изображения"""
+    return create_thumbnails(original_path, [size], quality).get(tuple(size))
+
+
+def publish_file(path, data):
+    """Атомарно записывает файл: временный файл в той же папке и os.replace"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+# Менеджер внутри процесса пула генерации превью
+_worker_manager = None
+
+
+def _init_render_worker(upload_folder, thumbnail_folder, variants, on_demand_variants=None, formats=None):
+    """Инициализация процесса пула: свой менеджер (и свое соединение с БД)"""
+    global _worker_manager
+    _worker_manager = ThumbnailManager(upload_folder, thumbnail_folder, variants,
+                                       on_demand_variants=on_demand_variants, formats=formats)
+
+
+def _render_file_thumbnails(original_path):
+    """Создает недостающие превью всех размеров для одного файла (выполняется в пуле)"""
+    return _worker_manager.render(original_path) is not None
+
+
+def sprite_signature(files):
+    """Подпись содержимого артикула (строки files): меняется при добавлении, удалении или перезаливке файлов"""
+    source = '\n'.join(sorted(f"{f['filename']}|{f['created_at']}" for f in files))
+    return hashlib.md5(source.encode()).hexdigest()
+
+
+def _warm_file_thumbnails(original_path, force=False):
+    """
+    Прогрев превью одного файла (выполняется в пуле).
+    Возвращает 'fresh' (превью актуальны), 'rendered', 'missing' (нет оригинала) или 'failed'.
+    """
+    try:
+        st = os.stat(original_path)
+    except FileNotFoundError:
+        return 'missing'
+
+    manager = _worker_manager
+    if not force:
+        rel_path = manager._rel_path(original_path)
+        if all(os.path.exists(manager.get_thumbnail_path(rel_path, variant, fmt))
+               for variant in manager.default_variants for fmt in manager.formats) \
+                and manager.is_fresh(original_path, st) is not False:
+            return 'fresh'
+    return 'rendered' if manager.render(original_path, st=st, force=force) is not None else 'failed'
+
+
+class ThumbnailManager:
+    """
+    Менеджер превью: пути миниатюр, их генерация и индекс ключей оригиналов.
+
+    Превью лежат по детерминированному пути, повторяющему URL запроса:
+    <thumbnail_folder>/<variant>/<album>/<article>/<file> (формат JPEG),
+    поэтому nginx отдает их напрямую, а Flask видит только промахи.
+    Дополнительные форматы (WebP, AVIF) лежат рядом с суффиксом: <file>.webp;
+    nginx выбирает файл по заголовку Accept.
+
+    Варианты on_demand_variants (например, размеры для маркетплейсов '800x800')
+    создаются только по запросу, но лежат в том же дереве и устаревают вместе
+    с остальными превью оригинала.
+
+    Индекс хранит для каждого оригинала дешевый ключ (inode, mtime, размер)
+    и хэш содержимого, из которого были созданы превью. Пока ключ не изменился,
+    актуальность превью проверяется одним stat(); при смене ключа содержимое
+    хэшируется, и превью пересоздаются только если изменился хэш.
+    """
+
+    def __init__(self, upload_folder, thumbnail_folder, variants, max_cached_keys=50000, on_demand_variants=None,
+                 formats=None):
+        self.upload_folder = upload_folder
+        self.thumbnail_folder = thumbnail_folder
+        # Форматы превью: JPEG и поддерживаемые дополнительные ('webp', 'avif')
+        self.formats = supported_formats(formats or [])
+        # Варианты, создаваемые по умолчанию (при загрузке и прогреве)
+        self.default_variants = list(variants)
+        self.on_demand_variants = {name: tuple(size) for name, size in (on_demand_variants or {}).items()}
+        # Имя варианта в URL -> размер, например {'small': (96, 96), '800x800': (800, 800)}
+        self.variants = {name: tuple(size) for name, size in variants.items()}
+        self.variants.update(self.on_demand_variants)
+        # Локальный кэш индекса в памяти воркера: rel_path -> (key, content_hash)
+        self.max_cached_keys = max_cached_keys
+        self.key_cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+
+    @staticmethod
+    def _stat_key(st):
+        """Дешевый ключ оригинала из результата stat()"""
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _rel_path(self, original_path):
+        return os.path.relpath(original_path, self.upload_folder).replace(os.sep, '/')
+
+    def _remember(self, rel_path, key, content_hash):
+        with self.cache_lock:
+            self.key_cache[rel_path] = (key, content_hash)
+            self.key_cache.move_to_end(rel_path)
+            while len(self.key_cache) > self.max_cached_keys:
+                self.key_cache.popitem(last=False)
+
+    def _load_key(self, rel_path):
+        """Читает запись индекса из БД (None - записи нет); ошибка БД пробрасывается"""
+        result = db_manager.execute_query(
+            "SELECT inode, mtime_ns, file_size, content_hash FROM thumbnail_keys WHERE rel_path = %s",
+            (rel_path,),
+            fetch=True
+        )
+        if not result:
+            return None
+        row = result[0]
+        return (int(row['inode']), int(row['mtime_ns']), int(row['file_size'])), row['content_hash']
+
+    def _store_key(self, rel_path, key, content_hash):
+        """Сохраняет запись индекса в БД"""
+        try:
+            db_manager.execute_query(
+                """INSERT INTO thumbnail_keys (rel_path, inode, mtime_ns, file_size, content_hash)
+                   VALUES (%s, %s, %s, %s, %s)
+                   ON CONFLICT (rel_path) DO UPDATE SET
+                       inode = EXCLUDED.inode,
+                       mtime_ns = EXCLUDED.mtime_ns,
+                       file_size = EXCLUDED.file_size,
+                       content_hash = EXCLUDED.content_hash,
+                       updated_at = CURRENT_TIMESTAMP""",
+                (rel_path, key[0], key[1], key[2], content_hash),
+                commit=True
+            )
+        except Exception as e:
+            logger.warning(f"Failed to store thumbnail key for {rel_path}: {e}")
+
+    def _lookup(self, rel_path, refresh=False):
+        """Запись индекса: сначала из памяти воркера, затем из БД"""
+        if not refresh:
+            with self.cache_lock:
+                cached = self.key_cache.get(rel_path)
+            if cached:
+                return cached
+
+        stored = self._load_key(rel_path)
+        if stored:
+            self._remember(rel_path, *stored)
+        return stored
+
+    def is_fresh(self, original_path, st, refresh=False):
+        """
+        Проверяет, созданы ли превью из текущего содержимого оригинала.
+        Содержимое хэшируется только если изменился ключ (inode, mtime, размер).
+        refresh=True читает запись из БД в обход памяти воркера.
+        Возвращает None, если индекс недоступен (ошибка БД): актуальность неизвестна,
+        и существующие превью нужно отдавать, а не пересоздавать.
+        """
+        rel_path = self._rel_path(original_path)
+        key = self._stat_key(st)
+
+        try:
+            stored = self._lookup(rel_path, refresh)
+        except Exception as e:
+            logger.warning(f"Thumbnail key lookup failed for {rel_path}: {e}")
+            return None
+        if not stored:
+            return False
+        if stored[0] == key:
+            return True
+
+        # Ключ изменился (например, файл распакован заново) - сравниваем содержимое
+        content_hash = generate_image_hash(original_path)
+        if content_hash != stored[1]:
+            return False
+
+        self._store_key(rel_path, key, content_hash)
+        self._remember(rel_path, key, content_hash)
+        return True
+
+    def _mark_rendered(self, original_path, st):
+        """Запоминает ключ и хэш содержимого, из которого созданы превью"""
+        rel_path = self._rel_path(original_path)
+        key = self._stat_key(st)
+        content_hash = generate_image_hash(original_path)
+        self._store_key(rel_path, key, content_hash)
+        self._remember(rel_path, key, content_hash)
+
+    def get_thumbnail_path(self, rel_path, variant, fmt='jpeg'):
+        """Путь превью, повторяющий URL /thumbnails/<variant>/<rel_path> (с суффиксом формата, кроме JPEG)"""
+        path = os.path.join(self.thumbnail_folder, variant, *rel_path.split('/'))
+        return path + THUMBNAIL_FORMATS[fmt][2]
+
+    @contextmanager
+    def _render_lock(self, rel_path, namespace='thumb'):
+        """
+        Межпроцессная блокировка генерации превью одного оригинала (flock).
+        Пока один воркер рендерит, остальные ждут и затем получают готовый результат.
+        """
+        lock_dir = os.path.join(self.thumbnail_folder, '.locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        stripe = int(hashlib.md5(rel_path.encode()).hexdigest(), 16) % RENDER_LOCK_STRIPES
+        fd = os.open(os.path.join(lock_dir, f"{namespace}-{stripe:04d}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            deadline = time.time() + RENDER_LOCK_TIMEOUT
+            locked = False
+            while not locked:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                except BlockingIOError:
+                    if time.time() >= deadline:
+                        logger.warning(f"Render lock timeout for {rel_path}, rendering without lock")
+                        break
+                    time.sleep(0.05)
+            yield
+        finally:
+            os.close(fd)
+
+    def render(self, original_path, variants=None, st=None, force=False, formats=None):
+        """
+        Создает недостающие или устаревшие превью за одно декодирование.
+        variants - имена вариантов (по умолчанию все, кроме вариантов по запросу),
+        formats - форматы (по умолчанию все включенные).
+        force=True пересоздает превью, даже если они актуальны (например, после смены размеров).
+        Возвращает словарь {variant: путь JPEG-превью} или None при ошибке.
+        """
+        variants = list(variants or self.default_variants)
+        formats = [fmt for fmt in (formats or self.formats) if fmt in self.formats]
+        st = st or os.stat(original_path)
+        rel_path = self._rel_path(original_path)
+
+        with self._render_lock(rel_path):
+            return self._render_locked(original_path, rel_path, variants, formats, st, force)
+
+    def _render_locked(self, original_path, rel_path, variants, formats, st, force=False):
+        """Генерация под блокировкой: сначала перепроверяем, не сделал ли ее другой воркер"""
+        paths = {variant: self.get_thumbnail_path(rel_path, variant) for variant in variants}
+        targets = {(variant, fmt): self.get_thumbnail_path(rel_path, variant, fmt)
+                   for variant in variants for fmt in formats}
+
+        fresh = False if force else self.is_fresh(original_path, st, refresh=True)
+        if fresh is not False:
+            # Актуальные превью или индекс недоступен (None): существующие не трогаем, создаем недостающие
+            pending = [target for target, path in targets.items() if not os.path.exists(path)]
+        else:
+            # Оригинал изменился: пересоздаем запрошенные превью, остальные (и варианты по запросу) удаляем
+            pending = list(targets)
+            for variant in self.variants:
+                for fmt in THUMBNAIL_FORMATS:
+                    if (variant, fmt) not in targets:
+                        self._remove(self.get_thumbnail_path(rel_path, variant, fmt))
+
+        if not pending:
+            return paths
+
+        encoded, placeholder = encode_thumbnails(original_path,
+                                                 [self.variants[variant] for variant, _ in pending],
+                                                 [fmt for fmt in formats if any(f == fmt for _, f in pending)],
+                                                 placeholder=True)
+        # Обязателен только JPEG: недостающий WebP/AVIF создастся при следующем запросе этого формата
+        if any((self.variants[variant], fmt) not in encoded for variant, fmt in pending if fmt == 'jpeg'):
+            return None
+
+        for variant, fmt in pending:
+            data = encoded.get((self.variants[variant], fmt))
+            if data is None:
+                continue
+            publish_file(targets[(variant, fmt)], data)
+            logger.info(f"Created new thumbnail: {targets[(variant, fmt)]}")
+
+        self._store_placeholder(rel_path, placeholder)
+        if fresh is False:
+            self._mark_rendered(original_path, st)
+        return paths
+
+    @staticmethod
+    def _store_placeholder(rel_path, placeholder):
+        """Сохраняет плейсхолдер в строку файла, чтобы списки отдавали его без запросов превью"""
+        try:
+            db_manager.execute_query(
+                "UPDATE files SET placeholder = %s WHERE filename = %s AND placeholder IS DISTINCT FROM %s",
+                (placeholder, rel_path, placeholder),
+                commit=True
+            )
+        except Exception as e:
+            logger.warning(f"Failed to store placeholder for {rel_path}: {e}")
+
+    def get_sprite_path(self, album_name, article_name):
+        """Путь спрайта артикула (None для небезопасных имен)"""
+        if any(part in ('', '.', '..') or '/' in part for part in (album_name, article_name)):
+            return None
+        return os.path.join(self.thumbnail_folder, SPRITE_LAYER, album_name, article_name, 'sprite.jpg')
+
+    def load_sprite(self, album_name, article_name, signature):
+        """
+        Готовая карта спрайта артикула с диска, если она соответствует подписи;
+        None - спрайта нет или он устарел (собирает его воркер очереди, build_album_sprites).
+        """
+        image_path = self.get_sprite_path(album_name, article_name)
+        if image_path is None:
+            return None
+        return self._load_sprite_map(os.path.join(os.path.dirname(image_path), 'sprite.json'), image_path, signature)
+
+    def build_album_sprites(self, album_name):
+        """
+        Собирает недостающие и устаревшие спрайты всех артикулов альбома.
+        Возвращает (число готовых спрайтов, число артикулов, спрайт которых собрать не удалось).
+        """
+        rows = db_manager.execute_query(
+            "SELECT filename, article_number, created_at FROM files WHERE album_name = %s ORDER BY created_at DESC",
+            (album_name,),
+            fetch=True
+        )
+        articles = {}
+        for row in rows or []:
+            articles.setdefault(row['article_number'], []).append(row)
+
+        built = failed = 0
+        for article_name, files in articles.items():
+            try:
+                if self.build_sprite(album_name, article_name, [f['filename'] for f in files],
+                                     sprite_signature(files)):
+                    built += 1
+                    continue
+            except Exception as e:
+                logger.error(f"Error building sprite for {album_name}/{article_name}: {e}")
+            failed += 1
+        return built, failed
+
+    def build_sprite(self, album_name, article_name, filenames, signature):
+        """
+        Собирает спрайт маленьких превью артикула и карту координат (в воркере очереди:
+        недостающие превью рендерятся здесь же). Результат кэшируется на диске и
+        пересобирается при смене подписи артикула.
+        Возвращает {'width', 'height', 'tiles': {filename: [x, y, w, h]}} или None.
+        """
+        image_path = self.get_sprite_path(album_name, article_name)
+        if image_path is None:
+            return None
+        map_path = os.path.join(os.path.dirname(image_path), 'sprite.json')
+
+        sprite = self._load_sprite_map(map_path, image_path, signature)
+        if sprite:
+            return sprite
+
+        with self._render_lock(f"{album_name}/{article_name}", namespace='sprite'):
+            # Другой воркер мог собрать спрайт, пока мы ждали блокировку
+            sprite = self._load_sprite_map(map_path, image_path, signature)
+            if sprite:
+                return sprite
+
+            tile_width, tile_height = self.variants[SPRITE_VARIANT]
+            columns = max(1, math.ceil(math.sqrt(len(filenames))))
+            rows = max(1, math.ceil(len(filenames) / columns))
+            sheet = Image.new('RGB', (columns * tile_width, rows * tile_height), 'white')
+
+            tiles = {}
+            for index, filename in enumerate(filenames):
+                original_path = os.path.join(self.upload_folder, *filename.split('/'))
+                try:
+                    paths = self.render(original_path, [SPRITE_VARIANT], formats=['jpeg'])
+                    if paths is None:
+                        continue
+                    x, y = (index % columns) * tile_width, (index // columns) * tile_height
+                    with Image.open(paths[SPRITE_VARIANT]) as tile:
+                        sheet.paste(tile, (x, y))
+                        tiles[filename] = [x, y, tile.width, tile.height]
+                except Exception as e:
+                    logger.error(f"Error adding {filename} to sprite: {e}")
+
+            buffer = io.BytesIO()
+            sheet.save(buffer, 'JPEG', quality=85, optimize=True)
+
+            sprite = {
+                'signature': signature,
+                'width': sheet.width,
+                'height': sheet.height,
+                'tiles': tiles
+            }
+            publish_file(image_path, buffer.getvalue())
+            publish_file(map_path, json.dumps(sprite, ensure_ascii=False).encode('utf-8'))
+            logger.info(f"Created sprite for {album_name}/{article_name}: {len(tiles)} tiles")
+            return sprite
+
+    @staticmethod
+    def _load_sprite_map(map_path, image_path, signature):
+        """Карта спрайта с диска, если она соответствует подписи артикула"""
+        try:
+            with open(map_path, encoding='utf-8') as f:
+                sprite = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if sprite.get('signature') != signature or not os.path.exists(image_path):
+            return None
+        return sprite
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def worker_initargs(self):
+        """Аргументы _init_render_worker для пула процессов с той же конфигурацией вариантов"""
+        base_variants = {name: self.variants[name] for name in self.default_variants}
+        return self.upload_folder, self.thumbnail_folder, base_variants, self.on_demand_variants, self.formats
+
+    def generate_batch(self, original_paths, max_workers=None, progress_callback=None):
+        """
+        Создает превью всех размеров для списка оригиналов в пуле процессов.
+        progress_callback(done, failed) вызывается после каждого файла.
+        Возвращает (done, failed).
+        """
+        done = failed = 0
+        if not original_paths:
+            return done, failed
+
+        start_time = time.time()
+        max_workers = max_workers or os.cpu_count() or 1
+
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_init_render_worker,
+                                 initargs=self.worker_initargs()) as executor:
+            futures = {executor.submit(_render_file_thumbnails, path): path for path in original_paths}
+
+            for future in as_completed(futures):
+                try:
+                    if future.result():
+                        done += 1
+                    else:
+                        failed += 1
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"Ошибка генерации превью {futures[future]}: {e}")
+
+                if progress_callback:
+                    progress_callback(done, failed)
+
+        elapsed = time.time() - start_time
+        logger.info(f"🖼️ Превью созданы за {elapsed:.2f}s: {done} файлов, ошибок: {failed}")
+        return done, failed
+
+    def forget(self, rel_prefix):
+        """Удаляет записи индекса для альбома или артикула (префикс относительного пути)"""
+        prefix = rel_prefix.rstrip('/') + '/'
+        with self.cache_lock:
+            for rel_path in [p for p in self.key_cache if p.startswith(prefix)]:
+                del self.key_cache[rel_path]
+
+        # Экранируем спецсимволы LIKE в именах альбомов
+        pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        try:
+            db_manager.execute_query(
+                "DELETE FROM thumbnail_keys WHERE rel_path LIKE %s",
+                (pattern,),
+                commit=True
+            )
+        except Exception as e:
+            logger.warning(f"Failed to forget thumbnail keys for {rel_prefix}: {e}")
@@ -0,0 +1,248 @@
+# upload_sessions.py
+"""
+Возобновляемая загрузка больших архивов частями.
+
+Клиент создает сессию (имя, размер), затем отправляет части фиксированного
+размера по их смещению - в любом порядке и параллельно - и при обрыве
+связи запрашивает, какие части уже приняты, дозагружая только недостающие.
+Части пишутся через pwrite прямо в staging-файл сессии, заранее
+выделенный на полный размер; SHA-256 каждой части считается по дороге и
+сверяется с заголовком клиента. Когда приняты все части, finalize ставит
+архив в очередь загрузки, как /upload.
+
+Состояние сессий хранится в БД (upload_sessions, upload_chunks): части
+одной загрузки принимают разные воркеры gunicorn.
+"""
+import hashlib
+import logging
+import os
+import uuid
+
+from database import db_manager
+
+logger = logging.getLogger(__name__)
+
+# Размер части по умолчанию и допустимые границы (части меньше 1 МБ - лишние запросы)
+UPLOAD_SESSION_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_SESSION_MIN_CHUNK_SIZE = 1024 * 1024
+UPLOAD_SESSION_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# Блок чтения тела запроса с частью
+UPLOAD_SESSION_READ_BLOCK = 1024 * 1024
+# Незавершенные сессии старше этого срока удаляются вместе с файлом (секунды)
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 3600))
+
+# Поля сессии, которые отдаются в API
+SESSION_FIELDS = ('id', 'original_name', 'mode', 'total_size', 'chunk_size', 'status', 'job_id',
+                  'created_at', 'updated_at')
+
+
+class UploadSessionError(Exception):
+    """Ошибка запроса к сессии загрузки; status - HTTP-код ответа"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadSessions:
+    """Сессии возобновляемой загрузки: файлы в staging, состояние в БД"""
+
+    def __init__(self, staging_folder, db=None):
+        self.staging_folder = staging_folder
+        self.db = db or db_manager
+
+    def create(self, original_name, total_size, user, mode='merge', chunk_size=None, max_size=None):
+        """Создает сессию и выделяет место под файл; возвращает сессию"""
+        if total_size <= 0:
+            raise UploadSessionError('Empty file')
+        if max_size and total_size > max_size:
+            raise UploadSessionError('File is too large', 413)
+        chunk_size = min(max(chunk_size or UPLOAD_SESSION_CHUNK_SIZE, UPLOAD_SESSION_MIN_CHUNK_SIZE),
+                         UPLOAD_SESSION_MAX_CHUNK_SIZE)
+
+        self.expire()
+
+        upload_id = uuid.uuid4().hex
+        path = os.path.abspath(os.path.join(self.staging_folder, f"{upload_id}.part"))
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            # Место резервируется сразу: нехватка диска видна до передачи данных, а не на 90%
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fd, 0, total_size)
+            else:
+                os.ftruncate(fd, total_size)
+        except OSError as e:
+            os.close(fd)
+            os.unlink(path)
+            raise UploadSessionError(f'Not enough space for upload: {e}', 507)
+        os.close(fd)
+
+        user = user or {}
+        result = self.db.execute_query(
+            """INSERT INTO upload_sessions (id, original_name, mode, total_size, chunk_size, staging_path,
+                                            user_id, username)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING *""",
+            (upload_id, original_name, mode, total_size, chunk_size, path,
+             user.get('sub'), user.get('preferred_username') or user.get('email')),
+            fetch=True,
+            commit=True
+        )
+        logger.info(f"📤 Сессия загрузки {upload_id}: {original_name}, {total_size / (1024 * 1024):.1f} МБ "
+                    f"частями по {chunk_size // (1024 * 1024)} МБ")
+        return result[0]
+
+    def get(self, upload_id, user):
+        """Сессия текущего пользователя; UploadSessionError 404, если ее нет"""
+        results = self.db.execute_query(
+            "SELECT * FROM upload_sessions WHERE id = %s",
+            (upload_id,),
+            fetch=True
+        )
+        session = results[0] if results else None
+        if session is None or session['user_id'] != (user or {}).get('sub'):
+            raise UploadSessionError('Upload not found', 404)
+        return session
+
+    def status(self, session):
+        """Сессия с принятыми частями и длиной непрерывно принятого начала файла"""
+        results = self.db.execute_query(
+            "SELECT chunk_index FROM upload_chunks WHERE upload_id = %s ORDER BY chunk_index",
+            (session['id'],),
+            fetch=True
+        )
+        received = [row['chunk_index'] for row in results or []]
+        contiguous = 0
+        while contiguous < len(received) and received[contiguous] == contiguous:
+            contiguous += 1
+
+        status = {field: session[field] for field in SESSION_FIELDS}
+        status['chunks_total'] = self.chunks_total(session)
+        status['chunks_received'] = received
+        status['committed_offset'] = min(contiguous * session['chunk_size'], session['total_size'])
+        return status
+
+    @staticmethod
+    def chunks_total(session):
+        return -(-session['total_size'] // session['chunk_size'])
+
+    def write_chunk(self, session, offset, stream, content_length, expected_sha256=None):
+        """
+        Пишет часть, начинающуюся с offset, из потока запроса; возвращает ее SHA-256.
+        Часть фиксируется в БД только если длина и контрольная сумма совпали.
+        """
+        if session['status'] != 'open':
+            raise UploadSessionError('Upload is already finalized', 409)
+        chunk_size = session['chunk_size']
+        if offset < 0 or offset % chunk_size or offset >= session['total_size']:
+            raise UploadSessionError(f'Offset must be a multiple of {chunk_size} within the file')
+        expected_length = min(chunk_size, session['total_size'] - offset)
+        if content_length != expected_length:
+            raise UploadSessionError(f'Chunk at {offset} must be {expected_length} bytes')
+
+        hasher = hashlib.sha256()
+        written = 0
+        fd = os.open(session['staging_path'], os.O_WRONLY)
+        try:
+            while written < expected_length:
+                block = stream.read(min(UPLOAD_SESSION_READ_BLOCK, expected_length - written))
+                if not block:
+                    break
+                hasher.update(block)
+                os.pwrite(fd, block, offset + written)
+                written += len(block)
+        finally:
+            os.close(fd)
+
+        if written != expected_length:
+            raise UploadSessionError(f'Chunk at {offset} is truncated: {written} of {expected_length} bytes')
+        sha256 = hasher.hexdigest()
+        if expected_sha256 and expected_sha256.lower() != sha256:
+            raise UploadSessionError(f'Checksum mismatch for chunk at {offset}', 422)
+
+        self.db.execute_in_transaction([
+            ("""INSERT INTO upload_chunks (upload_id, chunk_index, size, sha256)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (upload_id, chunk_index)
+                DO UPDATE SET size = EXCLUDED.size, sha256 = EXCLUDED.sha256, received_at = CURRENT_TIMESTAMP""",
+             (session['id'], offset // chunk_size, written, sha256)),
+            ("UPDATE upload_sessions SET updated_at = CURRENT_TIMESTAMP WHERE id = %s", (session['id'],))
+        ])
+        return sha256
+
+    def finalize(self, session, enqueue):
+        """
+        Закрывает сессию, если приняты все части, и передает файл enqueue(session);
+        возвращает id задачи. Повторный вызов возвращает ту же задачу.
+        """
+        if session['status'] == 'finalized':
+            return session['job_id']
+
+        results = self.db.execute_query(
+            "SELECT count(*) AS received FROM upload_chunks WHERE upload_id = %s",
+            (session['id'],),
+            fetch=True
+        )
+        missing = self.chunks_total(session) - results[0]['received']
+        if missing > 0:
+            raise UploadSessionError(f'{missing} chunks are missing', 409)
+
+        # Сессию закрывает только один запрос, даже если finalize пришел дважды
+        results = self.db.execute_query(
+            """UPDATE upload_sessions SET status = 'finalizing', updated_at = CURRENT_TIMESTAMP
+               WHERE id = %s AND status = 'open' RETURNING id""",
+            (session['id'],),
+            fetch=True,
+            commit=True
+        )
+        if not results:
+            raise UploadSessionError('Upload is being finalized', 409)
+
+        try:
+            job_id = enqueue(session)
+        except Exception:
+            self.db.execute_query("UPDATE upload_sessions SET status = 'open' WHERE id = %s",
+                                  (session['id'],), commit=True)
+            raise
+
+        self.db.execute_query(
+            """UPDATE upload_sessions SET status = 'finalized', job_id = %s, updated_at = CURRENT_TIMESTAMP
+               WHERE id = %s""",
+            (job_id, session['id']),
+            commit=True
+        )
+        logger.info(f"✅ Сессия загрузки {session['id']} собрана, задача #{job_id}")
+        return job_id
+
+    def abort(self, session):
+        """Отменяет незавершенную сессию и удаляет ее файл"""
+        if session['status'] != 'open':
+            raise UploadSessionError('Upload is already finalized', 409)
+        self.db.execute_query("DELETE FROM upload_sessions WHERE id = %s", (session['id'],), commit=True)
+        self._remove_file(session['staging_path'])
+
+    def expire(self):
+        """Удаляет сессии, не обновлявшиеся дольше UPLOAD_SESSION_TTL, и файлы незавершенных"""
+        try:
+            results = self.db.execute_query(
+                """DELETE FROM upload_sessions
+                   WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                   RETURNING id, status, staging_path""",
+                (UPLOAD_SESSION_TTL,),
+                fetch=True,
+                commit=True
+            )
+        except Exception as e:
+            logger.error(f"Error expiring upload sessions: {e}")
+            return
+        for row in results or []:
+            # Файл собранной сессии принадлежит задаче очереди
+            if row['status'] != 'finalized':
+                self._remove_file(row['staging_path'])
+                logger.info(f"🧹 Удалена брошенная сессия загрузки {row['id']}")
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
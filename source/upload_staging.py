@@ -0,0 +1,131 @@
+# upload_staging.py
+"""
+Прием загружаемых архивов прямо в staging-файл за один проход.
+
+Werkzeug по умолчанию складывает файл из multipart во временный файл, после
+чего file.save() копирует его еще раз. Здесь часть с файлом пишется сразу в
+итоговый staging-файл (stream_factory парсера форм), а по дороге считаются
+SHA-256, CRC32 и размер: повторно читать архив для контрольных сумм не нужно.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import zlib
+
+from werkzeug.formparser import parse_form_data
+
+logger = logging.getLogger(__name__)
+
+# Размер блока чтения тела запроса без multipart (application/zip, application/octet-stream)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class StagingFile:
+    """
+    Файл в папке staging, который при записи обновляет SHA-256, CRC32 и размер.
+    Поддерживает интерфейс, нужный парсеру форм Werkzeug (write/seek/read).
+    """
+
+    def __init__(self, staging_folder, suffix='.zip'):
+        fd, self.path = tempfile.mkstemp(suffix=suffix, dir=staging_folder)
+        self.file = os.fdopen(fd, 'w+b')
+        self.sha256 = hashlib.sha256()
+        self.crc32 = 0
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def tell(self):
+        return self.file.tell()
+
+    def read(self, *args):
+        return self.file.read(*args)
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def digest(self):
+        """Размер и контрольные суммы записанных данных"""
+        return {'size': self.size, 'sha256': self.sha256.hexdigest(), 'crc32': self.crc32}
+
+    def discard(self):
+        """Закрывает и удаляет файл (ошибка приема или лишняя часть формы)"""
+        self.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def receive_multipart_upload(environ, staging_folder, field, max_content_length=None):
+    """
+    Разбирает multipart-запрос, записывая файл поля field прямо в staging.
+    Возвращает (StagingFile, имя файла) или (None, None), если файла нет.
+    """
+    created = []
+
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        staged = StagingFile(staging_folder)
+        created.append(staged)
+        return staged
+
+    start_time = time.time()
+    try:
+        _, _, files = parse_form_data(environ, stream_factory=stream_factory,
+                                      max_content_length=max_content_length, silent=False)
+    except Exception:
+        for staged in created:
+            staged.discard()
+        raise
+
+    storage = files.get(field)
+    result = storage.stream if storage is not None and storage.filename else None
+    # Прочие файловые части формы не нужны
+    for staged in created:
+        if staged is result:
+            staged.close()
+        else:
+            staged.discard()
+
+    if result is None:
+        return None, None
+    _log_received(storage.filename, result, start_time)
+    return result, storage.filename
+
+
+def receive_stream_upload(stream, staging_folder, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Записывает тело запроса блоками chunk_size в staging; возвращает StagingFile"""
+    staged = StagingFile(staging_folder)
+    start_time = time.time()
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            staged.write(chunk)
+    except Exception:
+        staged.discard()
+        raise
+    staged.close()
+    _log_received(os.path.basename(staged.path), staged, start_time)
+    return staged
+
+
+def _log_received(name, staged, start_time):
+    elapsed = time.time() - start_time
+    speed = staged.size / elapsed / (1024 * 1024) if elapsed else 0.0
+    logger.info(f"📦 Архив {name} принят: {staged.size / (1024 * 1024):.1f} МБ за {elapsed:.2f}s "
+                f"({speed:.1f} МБ/с), crc32={staged.crc32:08x}")
@@ -6,7 +6,9 @@ import logging
 import shutil
 import json
 from urllib.parse import quote
+from PIL import Image
 from database import db_manager
+from thumbnail_manager import THUMBNAIL_FORMAT_SUFFIXES
 
 logger = logging.getLogger(__name__)
 
@@ -21,12 +23,66 @@ def safe_folder_name(name: str) -> str:
     return name[:255] if name else "unnamed"
 
 
+# Расширения принимаемых архивов; составные (.tar.gz) проверяются раньше простых
+ARCHIVE_EXTENSIONS = ('.tar.gz', '.tgz', '.tar', '.zip')
+
+
+def archive_stem(filename):
+    """Имя архива без расширения: 'album.tar.gz' -> 'album'"""
+    lower = filename.lower()
+    for ext in ARCHIVE_EXTENSIONS:
+        if lower.endswith(ext):
+            return filename[:-len(ext)]
+    return os.path.splitext(filename)[0]
+
+
+def read_image_info(path):
+    """
+    Ширина, высота и формат изображения из заголовка файла (Image.open не декодирует
+    пиксели); (None, None, None), если PIL формат не разбирает (например, SVG)
+    """
+    try:
+        with Image.open(path) as image:
+            return image.width, image.height, image.format
+    except Exception:
+        return None, None, None
+
+
+def parse_variant_sizes(value):
+    """Разбирает список размеров вида '1200x1200,800x800' в {'1200x1200': (1200, 1200), ...}"""
+    sizes = {}
+    for item in (value or '').split(','):
+        item = item.strip().lower()
+        if not item:
+            continue
+        match = re.fullmatch(r'(\d{1,4})x(\d{1,4})', item)
+        if not match or not all(int(side) > 0 for side in match.groups()):
+            logger.warning(f"Invalid image variant size ignored: {item}")
+            continue
+        width, height = int(match.group(1)), int(match.group(2))
+        sizes[f"{width}x{height}"] = (width, height)
+    return sizes
+
+
+def thumbnail_layers(thumbnail_folder):
+    """Папки вариантов превью (small, medium, ...) в корне папки превью"""
+    try:
+        return [entry.path for entry in os.scandir(thumbnail_folder)
+                if entry.is_dir() and not entry.name.startswith('.')]
+    except FileNotFoundError:
+        return []
+
+
 def cleanup_album_thumbnails(album_name, thumbnail_folder):
     """Очищает все превью для указанного альбома"""
     try:
-        album_thumb_path = os.path.join(thumbnail_folder, album_name)
-        if os.path.exists(album_thumb_path):
-            shutil.rmtree(album_thumb_path)
+        removed = False
+        for layer in thumbnail_layers(thumbnail_folder):
+            album_thumb_path = os.path.join(layer, album_name)
+            if os.path.isdir(album_thumb_path):
+                shutil.rmtree(album_thumb_path)
+                removed = True
+        if removed:
             logger.info(f"Cleaned up thumbnails for album: {album_name}")
         else:
             logger.info(f"No thumbnails found for album: {album_name}")
@@ -34,6 +90,18 @@ def cleanup_album_thumbnails(album_name, thumbnail_folder):
         logger.error(f"Error cleaning up thumbnails for album {album_name}: {e}")
 
 
+def cleanup_article_thumbnails(album_name, article_name, thumbnail_folder):
+    """Очищает все превью для указанного артикула"""
+    try:
+        for layer in thumbnail_layers(thumbnail_folder):
+            article_thumb_path = os.path.join(layer, album_name, article_name)
+            if os.path.isdir(article_thumb_path):
+                shutil.rmtree(article_thumb_path)
+                logger.info(f"Deleted article thumbnails directory: {article_thumb_path}")
+    except Exception as e:
+        logger.error(f"Error cleaning up thumbnails for article {album_name}/{article_name}: {e}")
+
+
 def cleanup_empty_folders(folder_path):
     """Рекурсивно удаляет пустые папки"""
     try:
@@ -51,29 +119,15 @@ def cleanup_empty_folders(folder_path):
 
 
 def cleanup_file_thumbnails(filename, upload_folder, thumbnail_folder):
-    """Очищает превью для конкретного файла"""
+    """Очищает превью для конкретного файла во всех вариантах и форматах"""
     try:
-        original_path = os.path.join(upload_folder, filename)
-        if not os.path.exists(original_path):
-            # Если оригинального файла нет, ищем и удаляем все возможные превью
-            rel_dir = os.path.dirname(filename)
-            file_base = os.path.splitext(os.path.basename(filename))[0]
-
-            if rel_dir and rel_dir != '.':
-                thumb_dir = os.path.join(thumbnail_folder, rel_dir)
-                if os.path.exists(thumb_dir):
-                    # Удаляем все превью для этого файла
-                    for thumb_file in os.listdir(thumb_dir):
-                        if thumb_file.startswith(file_base + '_'):
-                            thumb_path = os.path.join(thumb_dir, thumb_file)
-                            os.remove(thumb_path)
-                            logger.info(f"Deleted orphaned thumbnail: {thumb_path}")
-        else:
-            # Удаляем превью для существующего файла
-            # Для этого нужно обновить get_thumbnail_path чтобы принимать параметры
-            # Временно оставляем как есть, можно доработать позже
-            pass
-
+        for layer in thumbnail_layers(thumbnail_folder):
+            base_path = os.path.join(layer, *filename.split('/'))
+            for suffix in THUMBNAIL_FORMAT_SUFFIXES:
+                thumb_path = base_path + suffix
+                if os.path.isfile(thumb_path):
+                    os.remove(thumb_path)
+                    logger.info(f"Deleted thumbnail: {thumb_path}")
     except Exception as e:
         logger.error(f"Error cleaning up thumbnails for file {filename}: {e}")
 
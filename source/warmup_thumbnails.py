@@ -0,0 +1,256 @@
+# warmup_thumbnails.py
+"""
+Прогрев превью: заранее создает миниатюры альбома, артикула или всех файлов,
+чтобы после восстановления, пересборки или смены размеров превью первые
+пользователи не ждали генерации в serve_thumbnail.
+
+Запуск в контейнере приложения:
+    python warmup_thumbnails.py --all
+    python warmup_thumbnails.py --album <альбом> [--article <артикул>] [--workers 4] [--force]
+
+Актуальные превью пропускаются (--force пересоздает все, например после смены размеров).
+Прогресс сохраняется в <THUMBNAIL_FOLDER>/.warmup-state.json: повторный запуск той же
+области продолжает с места остановки (--restart начинает заново).
+"""
+import argparse
+import fcntl
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from database import db_manager
+from thumbnail_manager import publish_file, _init_render_worker, _warm_file_thumbnails
+
+logger = logging.getLogger(__name__)
+
+# Результаты прогрева одного файла (см. _warm_file_thumbnails)
+WARMUP_RESULTS = ('rendered', 'fresh', 'missing', 'failed')
+
+
+class ThumbnailWarmup:
+    """
+    Прогрев превью в пуле процессов с сохранением прогресса.
+
+    Файлы обрабатываются в порядке имен; в состоянии хранится последний файл,
+    до которого включительно все обработано, поэтому после прерывания прогрев
+    продолжается с него. Одновременно выполняется только один прогрев (flock).
+    """
+
+    def __init__(self, thumbnail_manager, checkpoint_interval=2.0):
+        self.manager = thumbnail_manager
+        self.checkpoint_interval = checkpoint_interval
+        self.state_path = os.path.join(thumbnail_manager.thumbnail_folder, '.warmup-state.json')
+        self.lock_path = os.path.join(thumbnail_manager.thumbnail_folder, '.locks', 'warmup.lock')
+
+    @staticmethod
+    def scope_name(album_name=None, article_name=None):
+        """Имя области прогрева: '*', '<альбом>' или '<альбом>/<артикул>'"""
+        if not album_name:
+            return '*'
+        return f"{album_name}/{article_name}" if article_name else album_name
+
+    def collect(self, album_name=None, article_name=None):
+        """Отсортированный список файлов области из БД"""
+        if album_name and article_name:
+            results = db_manager.execute_query(
+                "SELECT filename FROM files WHERE album_name = %s AND article_number = %s",
+                (album_name, article_name),
+                fetch=True
+            )
+        elif album_name:
+            results = db_manager.execute_query(
+                "SELECT filename FROM files WHERE album_name = %s",
+                (album_name,),
+                fetch=True
+            )
+        else:
+            results = db_manager.execute_query("SELECT filename FROM files", fetch=True)
+        return sorted(row['filename'] for row in results or [])
+
+    def load_state(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self, state):
+        try:
+            publish_file(self.state_path, json.dumps(state, ensure_ascii=False).encode('utf-8'))
+        except OSError as e:
+            logger.warning(f"Failed to save warm-up state: {e}")
+
+    def _open_lock(self):
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        return os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def is_running(self):
+        """Выполняется ли прогрев в каком-либо процессе"""
+        fd = self._open_lock()
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+
+    def get_status(self):
+        """Состояние последнего прогрева; прерванный процессом прогрев помечается как interrupted"""
+        state = self.load_state()
+        if not state:
+            return {'status': 'idle'}
+        if state.get('status') == 'running' and not self.is_running():
+            state['status'] = 'interrupted'
+        return state
+
+    def run(self, album_name=None, article_name=None, max_workers=None, force=False, restart=False,
+            progress_callback=None):
+        """
+        Прогревает превью области. progress_callback(state) вызывается при каждом сохранении прогресса.
+        Возвращает итоговое состояние; RuntimeError, если прогрев уже выполняется.
+        """
+        fd = self._open_lock()
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise RuntimeError('Прогрев превью уже выполняется')
+            return self._run_locked(album_name, article_name, max_workers or os.cpu_count() or 1,
+                                    force, restart, progress_callback)
+        finally:
+            os.close(fd)
+
+    def _run_locked(self, album_name, article_name, max_workers, force, restart, progress_callback):
+        scope = self.scope_name(album_name, article_name)
+        filenames = self.collect(album_name, article_name)
+
+        # Продолжаем прерванный прогрев той же области с тем же режимом
+        previous = self.load_state()
+        resume_after = None
+        if (not restart and previous and previous.get('scope') == scope and previous.get('force') == force
+                and previous.get('status') != 'completed'):
+            resume_after = previous.get('last_filename')
+        if resume_after:
+            pending = [filename for filename in filenames if filename > resume_after]
+        else:
+            pending = filenames
+
+        start_time = time.time()
+        state = {
+            'scope': scope,
+            'album_name': album_name,
+            'article_name': article_name,
+            'force': force,
+            'workers': max_workers,
+            'status': 'running',
+            'total': len(filenames),
+            'resumed_skipped': len(filenames) - len(pending),
+            'processed': 0,
+            **dict.fromkeys(WARMUP_RESULTS, 0),
+            'last_filename': resume_after,
+            'started_at': start_time,
+            'elapsed': 0.0,
+            'images_per_sec': 0.0
+        }
+        logger.info(f"🔥 Прогрев превью {scope}: {len(pending)} из {len(filenames)} файлов, {max_workers} процессов")
+
+        def checkpoint():
+            state['elapsed'] = time.time() - start_time
+            state['images_per_sec'] = round(state['processed'] / state['elapsed'], 2) if state['elapsed'] else 0.0
+            self._save_state(state)
+            if progress_callback:
+                progress_callback(state)
+
+        completed = set()
+        watermark = 0
+        last_checkpoint = time.time()
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers,
+                                     initializer=_init_render_worker,
+                                     initargs=self.manager.worker_initargs()) as executor:
+                futures = {}
+                next_index = 0
+                # Окно задач ограничено, чтобы не держать в памяти future на каждый файл
+                window = max_workers * 4
+                while next_index < len(pending) or futures:
+                    while next_index < len(pending) and len(futures) < window:
+                        original_path = os.path.join(self.manager.upload_folder, *pending[next_index].split('/'))
+                        futures[executor.submit(_warm_file_thumbnails, original_path, force)] = next_index
+                        next_index += 1
+
+                    finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        index = futures.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            logger.error(f"Ошибка прогрева превью {pending[index]}: {e}")
+                            result = 'failed'
+                        state[result] += 1
+                        state['processed'] += 1
+                        completed.add(index)
+
+                    # Сдвигаем отметку до первого необработанного файла
+                    while watermark in completed:
+                        completed.discard(watermark)
+                        state['last_filename'] = pending[watermark]
+                        watermark += 1
+
+                    if time.time() - last_checkpoint >= self.checkpoint_interval:
+                        checkpoint()
+                        last_checkpoint = time.time()
+
+            state['status'] = 'completed'
+        except BaseException:
+            state['status'] = 'interrupted'
+            raise
+        finally:
+            checkpoint()
+            logger.info(
+                f"🔥 Прогрев превью {scope} {state['status']}: {state['processed']} файлов за "
+                f"{state['elapsed']:.1f}s ({state['images_per_sec']} img/s), создано {state['rendered']}, "
+                f"актуальны {state['fresh']}, нет оригинала {state['missing']}, ошибок {state['failed']}"
+            )
+        return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Прогрев превью альбома, артикула или всех файлов')
+    scope = parser.add_mutually_exclusive_group(required=True)
+    scope.add_argument('--all', action='store_true', help='все файлы')
+    scope.add_argument('--album', help='имя альбома')
+    parser.add_argument('--article', help='артикул внутри альбома (вместе с --album)')
+    parser.add_argument('--workers', type=int, default=None, help='число процессов (по умолчанию - число ядер)')
+    parser.add_argument('--force', action='store_true', help='пересоздать актуальные превью (после смены размеров)')
+    parser.add_argument('--restart', action='store_true', help='начать заново, не продолжая прерванный прогрев')
+    args = parser.parse_args()
+    if args.article and not args.album:
+        parser.error('--article используется только вместе с --album')
+
+    # Папки и размеры превью берем из конфигурации приложения
+    from app import thumbnail_manager
+
+    def print_progress(state):
+        print(f"{state['processed']}/{state['total'] - state['resumed_skipped']} "
+              f"(создано {state['rendered']}, актуальны {state['fresh']}, ошибок {state['failed']}) "
+              f"{state['images_per_sec']} img/s", flush=True)
+
+    warmup = ThumbnailWarmup(thumbnail_manager)
+    try:
+        state = warmup.run(args.album, args.article, args.workers, args.force, args.restart, print_progress)
+    except RuntimeError as e:
+        print(e)
+        return 1
+    except KeyboardInterrupt:
+        print('Прогрев прерван, повторный запуск продолжит с места остановки')
+        return 130
+
+    print(json.dumps(state, ensure_ascii=False, indent=2))
+    return 0 if state['failed'] == 0 else 2
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,46 +1,255 @@
+import errno
+import hashlib
 import os
+import struct
 import zipfile
+import zlib
 import logging
 import time
 import threading
-import shutil
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
 from database import db_manager
+from blob_store import BlobStore
+from metrics import IngestMetrics
 from urllib.parse import quote
-from utils import safe_folder_name, cleanup_album_thumbnails, cleanup_empty_folders
+from utils import safe_folder_name, cleanup_album_thumbnails, cleanup_file_thumbnails, archive_stem, read_image_info
 
 logger = logging.getLogger(__name__)
 
+# Архивы с числом файлов не больше этого распаковываются в текущем процессе:
+# запуск пула процессов дороже самой распаковки
+EXTRACT_INLINE_MAX_FILES = 50
+
+# Срезов распаковки на процесс пула: срезы раздаются по мере освобождения процессов,
+# чем их больше, тем ровнее загрузка и чаще обновляется прогресс
+EXTRACT_SLICES_PER_WORKER = 4
+# Предел записей в срезе (прогресс) и условная стоимость одной записи в байтах
+# (открытие, ссылка, заголовок изображения), чтобы мелкие файлы не считались бесплатными
+EXTRACT_SLICE_MAX_FILES = 200
+EXTRACT_ENTRY_OVERHEAD = 64 * 1024
+
+# Блок копирования распакованных данных
+EXTRACT_COPY_CHUNK = 1024 * 1024
+
+# Ошибки, после которых copy_file_range/sendfile не поддерживаются для этой пары файлов
+_ZERO_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+# Собственные дескрипторы архива и хранилище блобов в процессе пула распаковки (см. _init_extract_worker)
+_worker_zip = None
+_worker_fd = None
+_worker_blobs = None
+
+
+def _init_extract_worker(zip_path, blob_store):
+    """Инициализатор процесса пула: открывает свой дескриптор архива (ZipFile не потокобезопасен)"""
+    global _worker_zip, _worker_fd, _worker_blobs
+    _worker_zip = zipfile.ZipFile(zip_path, 'r')
+    _worker_fd = os.open(zip_path, os.O_RDONLY)
+    _worker_blobs = blob_store
+
+
+def _stored_data_offset(archive_fd, file_info):
+    """Смещение данных записи в архиве: длины имени и extra берутся из локального заголовка"""
+    header = os.pread(archive_fd, zipfile.sizeFileHeader, file_info.header_offset)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Некорректный локальный заголовок {file_info.filename}")
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    return (file_info.header_offset + zipfile.sizeFileHeader
+            + fields[zipfile._FH_FILENAME_LENGTH] + fields[zipfile._FH_EXTRA_FIELD_LENGTH])
+
+
+def _copy_range(src_fd, dst_fd, offset, count):
+    """
+    Копирует count байт с offset src_fd в dst_fd без буферов Python:
+    copy_file_range, затем sendfile, в крайнем случае pread/write
+    """
+    methods = []
+    if hasattr(os, 'copy_file_range'):
+        methods.append(lambda: os.copy_file_range(src_fd, dst_fd, min(count, 1 << 30), offset))
+    if hasattr(os, 'sendfile'):
+        methods.append(lambda: os.sendfile(dst_fd, src_fd, offset, min(count, 1 << 30)))
+    methods.append(lambda: os.write(dst_fd, os.pread(src_fd, min(count, EXTRACT_COPY_CHUNK), offset)))
+
+    while count > 0:
+        try:
+            copied = methods[0]()
+        except OSError as e:
+            if e.errno in _ZERO_COPY_UNSUPPORTED and len(methods) > 1:
+                methods.pop(0)
+                continue
+            raise
+        if copied == 0:
+            raise zipfile.BadZipFile('Неожиданный конец архива')
+        offset += copied
+        count -= copied
+
+
+def _hash_range(src_fd, offset, count):
+    """SHA-256 участка файла"""
+    hasher = hashlib.sha256()
+    while count > 0:
+        chunk = os.pread(src_fd, min(count, EXTRACT_COPY_CHUNK), offset)
+        if not chunk:
+            raise zipfile.BadZipFile('Неожиданный конец архива')
+        hasher.update(chunk)
+        offset += len(chunk)
+        count -= len(chunk)
+    return hasher.hexdigest()
+
+
+def _extract_member(zip_ref, archive_fd, file_info, destination, blob_store):
+    """
+    Кладет запись архива в хранилище блобов и ставит на блоб ссылку в итоговом пути.
+    Возвращает SHA-256 содержимого.
+    """
+    try:
+        sha256 = _store_member(zip_ref, archive_fd, file_info, blob_store)
+        blob_store.link(sha256, destination)
+    except FileNotFoundError:
+        # Блоб удалили между записью и ссылкой (sweep() другой загрузки): кладем запись заново
+        sha256 = _store_member(zip_ref, archive_fd, file_info, blob_store, force=True)
+        blob_store.link(sha256, destination)
+    return sha256
+
+
+def _store_member(zip_ref, archive_fd, file_info, blob_store, force=False):
+    """Кладет запись архива в хранилище блобов, возвращает SHA-256"""
+    # Несжатые незашифрованные записи хэшируются и копируются из архива напрямую;
+    # если такой блоб уже есть, данные не пишутся вовсе
+    if file_info.compress_type == zipfile.ZIP_STORED and not file_info.flag_bits & 0x1:
+        offset = _stored_data_offset(archive_fd, file_info)
+        sha256 = _hash_range(archive_fd, offset, file_info.file_size)
+        if force or not blob_store.exists(sha256):
+            dst, temp_path = blob_store.temp_file()
+            try:
+                with dst:
+                    _copy_range(archive_fd, dst.fileno(), offset, file_info.file_size)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            blob_store.commit(temp_path, sha256)
+    else:
+        with zip_ref.open(file_info) as src:
+            sha256 = blob_store.store_stream(src, EXTRACT_COPY_CHUNK)
+    return sha256
+
+
+def _extract_entries(zip_ref, archive_fd, plan, blob_store):
+    """
+    Извлекает записи по плану [(ZipInfo, итоговый путь)], возвращает
+    [(записанный путь, SHA-256, ширина, высота, формат)]: размеры читаются из заголовка
+    только что записанного файла, пока он в page cache.
+    Поврежденная запись - ArchiveError, прочие ошибки (диск) пробрасываются как есть.
+    """
+    extracted = []
+    for file_info, destination in plan:
+        try:
+            sha256 = _extract_member(zip_ref, archive_fd, file_info, destination, blob_store)
+        except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+            raise ArchiveError(f"Поврежденная запись {file_info.filename}: {e}") from e
+        extracted.append((destination, sha256) + read_image_info(destination))
+    return extracted
+
+
+def _zip_entry_mtime(file_info):
+    """Время изменения файла из записи архива; None, если дата в архиве некорректна"""
+    try:
+        return datetime(*file_info.date_time)
+    except ValueError:
+        return None
+
+
+def _extract_slice(plan):
+    """
+    Задача пула: извлекает срез записей через дескрипторы архива процесса.
+    Возвращает (результат _extract_entries, время работы процесса над срезом)
+    """
+    start = time.perf_counter()
+    extracted = _extract_entries(_worker_zip, _worker_fd, plan, _worker_blobs)
+    return extracted, time.perf_counter() - start
+
+
+def _entry_cost(file_info):
+    """Оценка работы над записью: чтение сжатых данных, запись распакованных и накладные расходы"""
+    return file_info.compress_size + file_info.file_size + EXTRACT_ENTRY_OVERHEAD
+
+
+def _cost_slices(extract_plan, max_workers):
+    """
+    Делит план [(ZipInfo, путь)] на непрерывные срезы примерно равной стоимости (_entry_cost),
+    по EXTRACT_SLICES_PER_WORKER на процесс. Запись дороже целого среза (большой TIFF)
+    становится отдельным срезом. Возвращает срезы от самого дорогого к самому дешевому:
+    пул раздает их в этом порядке по мере освобождения процессов, и долгий срез
+    начинается первым, а не оставляет остальные процессы без работы в конце.
+    """
+    total = sum(_entry_cost(file_info) for file_info, _ in extract_plan)
+    target = total / (max_workers * EXTRACT_SLICES_PER_WORKER)
+
+    slices = []
+    current, current_cost = [], 0
+    for entry in extract_plan:
+        cost = _entry_cost(entry[0])
+        if current and current_cost + cost > target:
+            slices.append((current_cost, current))
+            current, current_cost = [], 0
+        current.append(entry)
+        current_cost += cost
+        if current_cost >= target or len(current) >= EXTRACT_SLICE_MAX_FILES:
+            slices.append((current_cost, current))
+            current, current_cost = [], 0
+    if current:
+        slices.append((current_cost, current))
+
+    slices.sort(key=lambda item: item[0], reverse=True)
+    return [plan_slice for _, plan_slice in slices]
+
+
+class ArchiveError(Exception):
+    """Архив некорректен или не проходит проверку: повтор обработки даст ту же ошибку"""
+
 
 class ZipProcessor:
-    def __init__(self, upload_folder, base_url, thumbnail_folder, max_workers=None):
+    def __init__(self, upload_folder, base_url, thumbnail_folder, max_workers=None, blob_store=None):
         self.upload_folder = upload_folder
+        self.blob_store = blob_store or BlobStore(upload_folder)
         self.base_url = base_url
         self.thumbnail_folder = thumbnail_folder
         # Оптимизируем количество воркеров
-        self.max_workers = max_workers or min(8, (os.cpu_count() or 1) * 2)
+        self.max_workers = max_workers or min(8, os.cpu_count() or 1)
         self.processing_lock = threading.Lock()
         self.active_processes = {}
-        # Кэш для путей
-        self.path_cache = {}
         self.batch_size = 100  # Увеличили размер батча
 
 
-    def process_zip(self, zip_path, original_zip_name=None):
+    def process_zip(self, zip_path, original_zip_name=None, progress_callback=None, merge=False, max_workers=None):
         """
-        Основной метод обработки ZIP
+        Основной метод обработки ZIP.
+        Возвращает (True, имя альбома) или (False, ошибка); если ошибка в самом архиве
+        (поврежден, нет изображений, недопустимая структура), бросает ArchiveError.
+        progress_callback(stage, **counters) сообщает стадию и счетчики
+        files_total, files_extracted, files_inserted, files_unchanged, files_removed
+        (используется очередью задач).
+        merge=True обновляет существующий альбом инкрементально: распаковываются и
+        перезаписываются только файлы, у которых изменились CRC32 или размер.
+        max_workers - процессов распаковки для этого архива (доля общего бюджета, см. admission.py);
+        по умолчанию self.max_workers.
         """
-        return self.process_zip_fast(zip_path, original_zip_name)
+        return self.process_zip_fast(zip_path, original_zip_name, progress_callback, merge, max_workers)
 
     def _extract_album_structure(self, zip_ref):
         """
         Анализирует структуру ZIP архива и определяет правильное имя альбома
         и структуру папок
         """
-        try:
-            # Получаем все файлы в архиве
-            all_files = [f.filename for f in zip_ref.filelist if not f.is_dir()]
+        return self._album_structure_from_paths([f.filename for f in zip_ref.filelist if not f.is_dir()])
 
+    def _album_structure_from_paths(self, all_files):
+        """
+        Имя альбома по списку путей файлов архива (ZIP или tar): единственная папка
+        верхнего уровня без файлов в корне
+        """
+        try:
             if not all_files:
                 return None, "ZIP архив пуст"
 
@@ -95,22 +304,30 @@ class ZipProcessor:
         """
         Определяет имя альбома из структуры ZIP архива
         """
+        return self._album_name_from_paths([f.filename for f in zip_ref.filelist if not f.is_dir()],
+                                           zip_path, original_zip_name)
+
+    def _album_name_from_paths(self, all_files, archive_path, original_name=None):
+        """
+        Имя альбома: из структуры архива, иначе из оригинального имени архива,
+        иначе из имени принятого файла
+        """
         # Пытаемся определить имя альбома из структуры
-        album_name, structure_error = self._extract_album_structure(zip_ref)
+        album_name, structure_error = self._album_structure_from_paths(all_files)
 
         if album_name and album_name != "root_album":
             logger.info(f"🎯 Используем имя альбома из структуры: {album_name}")
             # Если определили из структуры, используем безопасное имя
             return safe_folder_name(album_name)
 
-        # Если не удалось определить из структуры, используем оригинальное имя ZIP
-        if original_zip_name:
-            zip_name_without_ext = os.path.splitext(original_zip_name)[0]
-            logger.info(f"📁 Используем оригинальное имя ZIP как альбом: {zip_name_without_ext}")
+        # Если не удалось определить из структуры, используем оригинальное имя архива
+        if original_name:
+            zip_name_without_ext = archive_stem(original_name)
+            logger.info(f"📁 Используем оригинальное имя архива как альбом: {zip_name_without_ext}")
             return safe_folder_name(zip_name_without_ext)
 
         # Fallback: используем имя временного файла (без расширения .zip)
-        zip_basename = os.path.basename(zip_path)
+        zip_basename = os.path.basename(archive_path)
         zip_name_without_ext = os.path.splitext(zip_basename)[0]
         logger.warning(f"⚠️ Используем временное имя как альбом: {zip_name_without_ext}")
         return safe_folder_name(zip_name_without_ext)
@@ -120,9 +337,11 @@ class ZipProcessor:
         """
         Проверяет структуру ZIP архива
         """
-        try:
-            all_files = [f.filename for f in zip_ref.filelist if not f.is_dir()]
+        return self._validate_paths([f.filename for f in zip_ref.filelist if not f.is_dir()])
 
+    def _validate_paths(self, all_files):
+        """Проверяет список путей файлов архива: есть ли среди них изображения"""
+        try:
             if not all_files:
                 return False, "ZIP архив не содержит файлов"
 
@@ -154,10 +373,21 @@ class ZipProcessor:
             logger.error(f"Error validating ZIP structure: {e}")
             return False, str(e)
 
-    def process_zip_fast(self, zip_path, original_zip_name=None):
+    def process_zip_fast(self, zip_path, original_zip_name=None, progress_callback=None, merge=False,
+                         max_workers=None):
         """
         Оптимизированная обработка ZIP с правильным определением структуры
         """
+        metrics = IngestMetrics('zip', 'merge' if merge else 'replace')
+
+        def report(stage, **counters):
+            metrics.update(**counters)
+            if progress_callback:
+                try:
+                    progress_callback(stage, **counters)
+                except Exception as e:
+                    logger.warning(f"Ошибка обновления прогресса ZIP: {e}")
+
         logger.info(f"🚀 Начинаем обработку ZIP: {zip_path}")
         logger.info(f"📦 Оригинальное имя ZIP: {original_zip_name}")
         start_time = time.time()
@@ -168,7 +398,10 @@ class ZipProcessor:
                 return False, "ZIP уже обрабатывается"
             self.active_processes[zip_basename] = True
 
+        succeeded = False
         try:
+            metrics.stage('analyze')
+            metrics.bytes_in = os.path.getsize(zip_path)
             with zipfile.ZipFile(zip_path, 'r') as zip_ref:
                 # Определяем имя альбома из структуры архива
                 album_name = self._get_album_name_from_zip(zip_path, zip_ref, original_zip_name)
@@ -177,172 +410,229 @@ class ZipProcessor:
                 # Валидация структуры архива
                 is_valid, validation_error = self._validate_zip_structure(zip_ref)
                 if not is_valid:
-                    return False, validation_error
-
-                # Очистка превью
-                cleanup_album_thumbnails(album_name, self.thumbnail_folder)
-                os.makedirs(album_path, exist_ok=True)
+                    raise ArchiveError(validation_error)
 
                 # Получаем список файлов для обработки
                 image_files = self._get_image_files(zip_ref)
 
                 if not image_files:
-                    return False, "Нет файлов для обработки"
+                    raise ArchiveError("Нет файлов для обработки")
 
-                logger.info(f"📁 Альбом: '{album_name}', файлов: {len(image_files)}")
+                # В режиме слияния сравниваем центральный каталог архива с контрольными суммами в БД
+                full_plan = self._plan_extraction(image_files, album_name)
+                plan, existing, removed = self._diff_plan(full_plan, album_name, merge)
+                os.makedirs(album_path, exist_ok=True)
+
+                unchanged = len(full_plan) - len(plan)
+                logger.info(f"📁 Альбом: '{album_name}', файлов: {len(image_files)}"
+                            + (f", без изменений: {unchanged}, удалено: {len(removed)}" if existing else ""))
+                report('extracting', album_name=album_name, files_total=len(image_files),
+                       files_unchanged=unchanged, files_removed=len(removed))
 
                 # Параллельная обработка с батчингом
-                files_to_insert = self._process_files_parallel_batch(zip_ref, image_files, album_path, album_name)
+                metrics.stage('extract')
+                files_to_insert = self._process_files_parallel_batch(
+                    zip_path, plan, album_name,
+                    on_batch=lambda extracted: report('extracting', files_extracted=extracted),
+                    max_workers=max_workers, metrics=metrics)
 
-                if not files_to_insert:
+                if plan and not files_to_insert:
                     return False, "Не удалось обработать файлы"
 
-                # Удаляем пустые папки
-                cleanup_empty_folders(album_path)
-
                 # Батч-вставка в БД
-                db_success = self._batch_db_insert_fast(album_name, files_to_insert)
+                db_success = self._commit_album(album_name, files_to_insert, existing, removed, report, metrics)
+                metrics.bytes_out = sum(f[5] for f in files_to_insert)
 
                 processing_time = time.time() - start_time
                 logger.info(
-                    f"✅ ZIP обработан за {processing_time:.2f}s: {len(files_to_insert)} файлов в альбоме '{album_name}'")
-
-
-                return db_success, album_name
-
+                    f"✅ ZIP обработан за {processing_time:.2f}s: {len(files_to_insert)} файлов записано "
+                    f"в альбом '{album_name}'")
+
+                if not db_success:
+                    return False, "Ошибка записи файлов в базу данных"
+                succeeded = True
+                return True, album_name
+
+        except ArchiveError as e:
+            logger.error(f"❌ Некорректный ZIP {zip_path}: {e}")
+            raise
+        except zipfile.BadZipFile as e:
+            logger.error(f"❌ Некорректный ZIP {zip_path}: {e}")
+            raise ArchiveError(f"Некорректный ZIP-архив: {e}") from e
         except Exception as e:
             logger.error(f"❌ Ошибка обработки ZIP {zip_path}: {e}")
             return False, str(e)
         finally:
+            metrics.finish(succeeded)
             with self.processing_lock:
                 self.active_processes.pop(zip_basename, None)
 
     def _get_image_files(self, zip_ref):
         """Быстрое получение списка изображений"""
-        allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.svg'}
+        return [file_info for file_info in zip_ref.infolist()
+                if not file_info.is_dir() and self._is_image_path(file_info.filename)]
 
-        valid_files = []
-        for file_info in zip_ref.infolist():
-            if file_info.is_dir():
-                continue
-
-            # Пропускаем системные файлы и папки
-            if any(part.lower().startswith('__') for part in file_info.filename.split('/')):
-                continue
+    @staticmethod
+    def _is_image_path(filename):
+        """Изображение допустимого формата вне системных папок"""
+        allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.svg'}
 
-            ext = os.path.splitext(file_info.filename.lower())[1]
-            if ext in allowed_extensions:
-                valid_files.append(file_info)
+        # Пропускаем системные файлы и папки
+        if any(part.lower().startswith('__') for part in filename.split('/')):
+            return False
 
-        return valid_files
+        return os.path.splitext(filename.lower())[1] in allowed_extensions
 
-    def _process_files_parallel_batch(self, zip_ref, image_files, album_path, album_name):
-        """Параллельная обработка файлов с оптимизацией блокировок"""
+    def _diff_plan(self, plan, album_name, merge):
+        """
+        Оставляет в плане только новые и измененные файлы (merge) и находит удаленные.
+        Возвращает (план, {путь: (CRC32, размер)} из БД, удаленные пути); при полной
+        замене альбома сбрасывает его превью.
+        """
+        existing = self._load_album_checksums(album_name) if merge else {}
+        if not existing:
+            # Полная замена: превью альбома создаются заново
+            cleanup_album_thumbnails(album_name, self.thumbnail_folder)
+            return plan, existing, []
+
+        planned_paths = {relative_path for _, relative_path, _ in plan}
+        removed = [filename for filename in existing if filename not in planned_paths]
+        return [entry for entry in plan if not self._is_unchanged(entry, existing)], existing, removed
+
+    def _commit_album(self, album_name, files_to_insert, existing, removed, report, metrics):
+        """Записывает файлы альбома в БД (слиянием или заменой) и убирает ставшее лишним"""
+        metrics.stage('insert')
+        report('inserting', files_extracted=len(files_to_insert))
+        if existing:
+            db_success = self._batch_db_merge(album_name, files_to_insert, existing, removed)
+        else:
+            db_success = self._batch_db_insert_fast(album_name, files_to_insert)
+        if db_success:
+            metrics.stage('finalize')
+            if existing:
+                self._cleanup_merged_files(files_to_insert, existing, removed)
+            report('inserted', files_inserted=len(files_to_insert))
+            # Замененные и удаленные файлы могли быть последними ссылками на свои блобы
+            self.blob_store.sweep()
+        return db_success
+
+    def _public_link(self, relative_path):
+        return f"{self.base_url}/images/{quote(relative_path, safe='/')}"
+
+    def _plan_extraction(self, image_files, album_name):
+        """
+        План распаковки [(ZipInfo, относительный путь, артикул)] в порядке смещений в архиве.
+        Итоговый путь каждой записи вычисляется заранее (_plan_destination).
+        """
+        plan = []
+        for file_info in sorted(image_files, key=lambda info: info.header_offset):
+            destination = self._plan_destination(file_info.filename, album_name)
+            if destination:
+                plan.append((file_info,) + destination)
+        return plan
+
+    def _process_files_parallel_batch(self, zip_path, plan, album_name, on_batch=None, max_workers=None,
+                                      metrics=None):
+        """
+        Параллельная распаковка плана в пуле процессов; on_batch(extracted) после каждого среза.
+        Возвращает строки для БД: (путь, альбом, артикул, ссылка, CRC32, размер, SHA-256,
+        ширина, высота, формат, время изменения).
+
+        Данные пишутся в хранилище блобов, а в итоговый путь ставится жесткая ссылка,
+        без промежуточной структуры папок архива.
+        Каждый процесс открывает архив сам, а записи делятся на непрерывные срезы
+        по смещению локального заголовка: процесс читает свой участок архива
+        последовательно, а распаковка deflate не упирается в GIL. Срезы равны по объему
+        данных, а не по числу файлов, и раздаются от больших к меньшим (_cost_slices);
+        занятость процессов пула записывается в metrics.
+        Ошибка любого среза прерывает распаковку: альбом не записывается частично.
+        """
         files_to_insert = []
-
-        # Автоматически подбираем размер батча
-        batch_size = min(200, max(50, len(image_files) // (self.max_workers * 2)))
-        batches = [image_files[i:i + batch_size] for i in range(0, len(image_files), batch_size)]
-
-        logger.info(f"🔄 Обрабатываем {len(batches)} батчей по {batch_size} файлов")
-
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Собираем результаты без блокировки на каждой итерации
-            future_results = []
-
-            for batch in batches:
-                future = executor.submit(self._process_file_batch, zip_ref, batch, album_path, album_name)
-                future_results.append(future)
-
-            # Ждем завершения всех батчей
-            for future in as_completed(future_results):
+        planned = {}
+        extract_plan = []
+        for file_info, relative_path, article_number in plan:
+            absolute_path = os.path.join(self.upload_folder, *relative_path.split('/'))
+            planned[absolute_path] = (relative_path, article_number, file_info.CRC, file_info.file_size,
+                                      _zip_entry_mtime(file_info))
+            extract_plan.append((file_info, absolute_path))
+
+        def collect(extracted):
+            for extracted_path, sha256, width, height, image_format in extracted:
+                relative_path, article_number, crc32, file_size, mtime = planned[extracted_path]
+                files_to_insert.append((relative_path, album_name, article_number, self._public_link(relative_path),
+                                        crc32, file_size, sha256, width, height, image_format, mtime))
+            if on_batch:
+                on_batch(len(files_to_insert))
+
+        if not extract_plan:
+            return files_to_insert
+
+        if len(extract_plan) <= EXTRACT_INLINE_MAX_FILES:
+            archive_fd = os.open(zip_path, os.O_RDONLY)
+            try:
+                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                    collect(_extract_entries(zip_ref, archive_fd, extract_plan, self.blob_store))
+            finally:
+                os.close(archive_fd)
+            return files_to_insert
+
+        max_workers = max_workers or self.max_workers
+        slices = _cost_slices(extract_plan, max_workers)
+        max_workers = min(max_workers, len(slices))
+
+        logger.info(f"🔄 Распаковываем {len(slices)} срезов (от {len(slices[-1])} до "
+                    f"{max(len(plan_slice) for plan_slice in slices)} файлов) в {max_workers} процессах")
+
+        busy = 0.0
+        pool_start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_init_extract_worker,
+                                 initargs=(zip_path, self.blob_store)) as executor:
+            # Порядок отправки - порядок раздачи: самые дорогие срезы первыми
+            futures = [executor.submit(_extract_slice, plan_slice) for plan_slice in slices]
+
+            # Результаты забираем по мере готовности срезов. Ошибка среза прерывает загрузку:
+            # без его файлов альбом записался бы частично, а в режиме замены они считались бы удаленными
+            for future in as_completed(futures):
                 try:
-                    batch_results = future.result(timeout=300)  # Таймаут 5 минут
-                    files_to_insert.extend(batch_results)
+                    extracted, seconds = future.result()
                 except Exception as e:
-                    logger.error(f"Ошибка обработки батча: {e}")
+                    logger.error(f"Ошибка распаковки среза: {e}")
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                busy += seconds
+                collect(extracted)
+
+        # Доля времени, которую процессы пула были заняты распаковкой (1.0 - ни один не простаивал)
+        pool_seconds = time.perf_counter() - pool_start
+        utilization = min(busy / (max_workers * pool_seconds), 1.0) if pool_seconds else 1.0
+        logger.info(f"📊 Занятость процессов распаковки: {utilization:.0%} ({busy:.1f}s работы за "
+                    f"{pool_seconds:.1f}s в {max_workers} процессах)")
+        if metrics:
+            metrics.worker_utilization = utilization
 
         return files_to_insert
 
-    def _process_file_batch(self, zip_ref, file_batch, album_path, album_name):
-        """Обрабатывает батч файлов (вынесено для уменьшения блокировок)"""
-        batch_results = []
-
-        for file_info in file_batch:
-            try:
-                # Пропускаем системные файлы
-                if any(part.lower().startswith('__') for part in file_info.filename.split('/')):
-                    continue
-
-                # Извлекаем файл
-                zip_ref.extract(file_info.filename, album_path)
-                original_path = os.path.join(album_path, file_info.filename)
-
-                if os.path.exists(original_path):
-                    file_data = self._process_single_file_fast(original_path, album_name)
-                    if file_data:
-                        batch_results.append(file_data)
-            except Exception as e:
-                logger.error(f"Ошибка обработки {file_info.filename}: {e}")
-
-        return batch_results
-
-    def _process_single_file_fast(self, file_path, album_name):
-        """Быстрая обработка одного файла с правильным определением структуры"""
-        try:
-            # Используем относительный путь как ключ кэша
-            relative_path = os.path.relpath(file_path, self.upload_folder)
-            cache_key = f"{album_name}_{relative_path}"
-
-            if cache_key in self.path_cache:
-                return self.path_cache[cache_key]
-
-            file_dir = os.path.dirname(relative_path)
-            filename = os.path.basename(relative_path)
-
-            # Определяем артикул из структуры пути
-            article_number = None
-
-            if file_dir and file_dir != '.':
-                # Путь: temp_extract/album_name/article_number/filename
-                # ИЛИ: album_name/article_number/filename
-                path_parts = file_dir.split(os.sep)
-
-                # Если путь содержит больше 1 части, значит есть вложенные папки
-                if len(path_parts) >= 2:
-                    # Последняя часть пути - это артикул
-                    article_number = safe_folder_name(path_parts[-1])
-
-                    # Нормализуем путь: перемещаем файл из временной структуры в финальную
-                    normalized_dir = os.path.join(self.upload_folder, album_name, article_number)
-                    normalized_path = os.path.join(normalized_dir, filename)
-
-                    # Создаем целевую директорию и перемещаем файл
-                    os.makedirs(normalized_dir, exist_ok=True)
-                    if file_path != normalized_path:
-                        shutil.move(file_path, normalized_path)
-                        relative_path = os.path.relpath(normalized_path, self.upload_folder)
-                else:
-                    # Файл находится прямо в папке альбома (без артикула)
-                    article_number = safe_folder_name(os.path.splitext(filename)[0])
-            else:
-                # Файл в корне временной папки извлечения
-                article_number = safe_folder_name(os.path.splitext(filename)[0])
-
-            # Создаем публичную ссылку
-            encoded_path = quote(relative_path.replace(os.sep, '/'), safe='/')
-            public_link = f"{self.base_url}/images/{encoded_path}"
-
-            result = (relative_path.replace(os.sep, '/'), album_name, article_number, public_link)
-
-            # Кэшируем результат
-            self.path_cache[cache_key] = result
-            return result
+    @staticmethod
+    def _plan_destination(member_name, album_name):
+        """
+        Итоговый относительный путь и артикул для записи архива, None для системных файлов.
 
-        except Exception as e:
-            logger.error(f"Ошибка обработки файла {file_path}: {e}")
+        Файл из вложенной папки попадает в <альбом>/<последняя папка>/<файл>, и эта папка -
+        артикул; файл без папки остается в корне альбома, артикул - имя файла без расширения.
+        """
+        # Как и ZipFile.extract, отбрасываем пустые компоненты, '.' и '..'
+        parts = [part for part in member_name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+        # Пропускаем системные файлы и папки
+        if not parts or any(part.lower().startswith('__') for part in parts):
             return None
 
+        filename = parts[-1]
+        if len(parts) >= 2:
+            article_number = safe_folder_name(parts[-2])
+            return f"{album_name}/{article_number}/{filename}", article_number
+        return f"{album_name}/{filename}", safe_folder_name(os.path.splitext(filename)[0])
 
     def _batch_db_insert_fast(self, album_name, files_to_insert):
         """Ультра-быстрая вставка с использованием UNNEST"""
@@ -358,6 +648,13 @@ class ZipProcessor:
             album_names = [f[1] for f in files_to_insert]
             article_numbers = [f[2] for f in files_to_insert]
             public_links = [f[3] for f in files_to_insert]
+            crc32s = [f[4] for f in files_to_insert]
+            file_sizes = [f[5] for f in files_to_insert]
+            blob_hashes = [f[6] for f in files_to_insert]
+            widths = [f[7] for f in files_to_insert]
+            heights = [f[8] for f in files_to_insert]
+            image_formats = [f[9] for f in files_to_insert]
+            mtimes = [f[10] for f in files_to_insert]
 
             operations = [
                 # Удаляем старые записи
@@ -365,13 +662,22 @@ class ZipProcessor:
 
                 # Массовая вставка с UNNEST
                 ("""
-                INSERT INTO files (filename, album_name, article_number, public_link)
+                INSERT INTO files (filename, album_name, article_number, public_link, crc32, file_size, blob_sha256,
+                                   width, height, image_format, file_mtime)
                 SELECT 
                     unnest(%s::text[]) as filename,
                     unnest(%s::text[]) as album_name, 
                     unnest(%s::text[]) as article_number,
-                    unnest(%s::text[]) as public_link
-                """, (filenames, album_names, article_numbers, public_links))
+                    unnest(%s::text[]) as public_link,
+                    unnest(%s::bigint[]) as crc32,
+                    unnest(%s::bigint[]) as file_size,
+                    unnest(%s::text[]) as blob_sha256,
+                    unnest(%s::integer[]) as width,
+                    unnest(%s::integer[]) as height,
+                    unnest(%s::text[]) as image_format,
+                    unnest(%s::timestamp[]) as file_mtime
+                """, (filenames, album_names, article_numbers, public_links, crc32s, file_sizes, blob_hashes,
+                      widths, heights, image_formats, mtimes))
             ]
 
             success = db_manager.execute_in_transaction(operations)
@@ -388,27 +694,120 @@ class ZipProcessor:
             logger.error(f"❌ Ошибка быстрой вставки: {e}")
             return False
 
-    def _quick_validate_zip(self, zip_ref):
-        """Быстрая валидация ZIP архива"""
-        allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.svg'}
+    @staticmethod
+    def _load_album_checksums(album_name):
+        """Контрольные суммы файлов альбома из БД: {путь: (CRC32, размер)}"""
+        results = db_manager.execute_query(
+            "SELECT filename, crc32, file_size FROM files WHERE album_name = %s",
+            (album_name,),
+            fetch=True
+        )
+        return {row['filename']: (row['crc32'], row['file_size']) for row in results or []}
+
+    def _is_unchanged(self, entry, existing):
+        """Совпадают ли CRC32 и размер записи архива с БД (и файл на диске на месте)"""
+        file_info, relative_path, _ = entry
+        if existing.get(relative_path) != (file_info.CRC, file_info.file_size):
+            return False
+        try:
+            return os.path.getsize(os.path.join(self.upload_folder, *relative_path.split('/'))) == file_info.file_size
+        except OSError:
+            return False
 
-        # Проверяем первые 10 файлов для быстрой валидации
-        for file_info in zip_ref.infolist()[:10]:
-            if not file_info.is_dir():
-                # Пропускаем системные файлы
-                if any(part.lower().startswith('__') for part in file_info.filename.split('/')):
-                    continue
+    def _batch_db_merge(self, album_name, files_to_write, existing, removed):
+        """
+        Применяет изменения альбома одной транзакцией: удаляет исчезнувшие файлы,
+        обновляет измененные и вставляет новые. У измененных сбрасывается плейсхолдер
+        и обновляется created_at, чтобы пересобрались спрайты их артикулов.
+        """
+        try:
+            changed = [f for f in files_to_write if f[0] in existing]
+            added = [f for f in files_to_write if f[0] not in existing]
+            logger.info(f"💾 Слияние альбома '{album_name}': новых {len(added)}, "
+                        f"измененных {len(changed)}, удаленных {len(removed)}")
+            start_time = time.time()
 
-                ext = os.path.splitext(file_info.filename.lower())[1]
-                if ext in allowed_extensions:
-                    return True
-        return False
+            def columns(rows):
+                return tuple([f[i] for f in rows] for i in (0, 2, 3, 4, 5, 6, 7, 8, 9, 10))
+
+            operations = []
+            if removed:
+                operations.append(("DELETE FROM files WHERE album_name = %s AND filename = ANY(%s)",
+                                   (album_name, removed)))
+            if changed:
+                operations.append(("""
+                UPDATE files AS f
+                SET article_number = v.article_number, public_link = v.public_link,
+                    crc32 = v.crc32, file_size = v.file_size, blob_sha256 = v.blob_sha256,
+                    width = v.width, height = v.height, image_format = v.image_format, file_mtime = v.file_mtime,
+                    placeholder = NULL, created_at = CURRENT_TIMESTAMP
+                FROM (
+                    SELECT
+                        unnest(%s::text[]) as filename,
+                        unnest(%s::text[]) as article_number,
+                        unnest(%s::text[]) as public_link,
+                        unnest(%s::bigint[]) as crc32,
+                        unnest(%s::bigint[]) as file_size,
+                        unnest(%s::text[]) as blob_sha256,
+                        unnest(%s::integer[]) as width,
+                        unnest(%s::integer[]) as height,
+                        unnest(%s::text[]) as image_format,
+                        unnest(%s::timestamp[]) as file_mtime
+                ) AS v
+                WHERE f.album_name = %s AND f.filename = v.filename
+                """, columns(changed) + (album_name,)))
+            if added:
+                filenames, *values = columns(added)
+                operations.append(("""
+                INSERT INTO files (filename, album_name, article_number, public_link, crc32, file_size, blob_sha256,
+                                   width, height, image_format, file_mtime)
+                SELECT
+                    unnest(%s::text[]) as filename,
+                    %s as album_name,
+                    unnest(%s::text[]) as article_number,
+                    unnest(%s::text[]) as public_link,
+                    unnest(%s::bigint[]) as crc32,
+                    unnest(%s::bigint[]) as file_size,
+                    unnest(%s::text[]) as blob_sha256,
+                    unnest(%s::integer[]) as width,
+                    unnest(%s::integer[]) as height,
+                    unnest(%s::text[]) as image_format,
+                    unnest(%s::timestamp[]) as file_mtime
+                """, (filenames, album_name, *values)))
+
+            if not operations:
+                return True
+
+            success = db_manager.execute_in_transaction(operations)
+            elapsed = time.time() - start_time
+            if success:
+                logger.info(f"✅ Слияние альбома '{album_name}' за {elapsed:.2f}s")
+            else:
+                logger.error(f"❌ Ошибка слияния альбома '{album_name}' за {elapsed:.2f}s")
+            return success
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка слияния альбома '{album_name}': {e}")
+            return False
+
+    def _cleanup_merged_files(self, files_written, existing, removed):
+        """Удаляет превью измененных файлов, а также оригиналы и превью удаленных"""
+        for filename in [f[0] for f in files_written if f[0] in existing] + removed:
+            cleanup_file_thumbnails(filename, self.upload_folder, self.thumbnail_folder)
+
+        for filename in removed:
+            original_path = os.path.join(self.upload_folder, *filename.split('/'))
+            try:
+                os.remove(original_path)
+                # Папка артикула могла опустеть
+                os.rmdir(os.path.dirname(original_path))
+            except OSError:
+                pass
 
     def get_processing_stats(self):
         """Статистика обработки"""
         return {
             'active_processes': len(self.active_processes),
-            'cache_size': len(self.path_cache),
             'max_workers': self.max_workers,
             'batch_size': self.batch_size
         }